@@ -1,7 +1,11 @@
 # app/crud/chat.py
-from sqlalchemy.orm import Session
-from app.models.models import Chat
-from app.schemas.chat_schema import ChatCreate
+from datetime import datetime
+from typing import List, Optional
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.models.models import ChatHistory
+from app.schemas.chat_schema import ContentBlock
 
 # def create_chat(db: Session, chat: ChatCreate):
 #     db_chat = Chat(
@@ -17,3 +21,32 @@ from app.schemas.chat_schema import ChatCreate
 
 # def get_chats_by_user(db: Session, user_id: int):
 #     return db.query(Chat).filter(Chat.user_id == user_id).all()
+
+
+#-----------------------------------------------------------------------------------------------------------#
+#   Async chat history CRUD used on the request path, so the event loop is never blocked by Postgres.      #
+#-----------------------------------------------------------------------------------------------------------#
+
+async def ainsert_user_question(db: AsyncSession, session_id: str, user_id: int, question: str, query_time: datetime) -> int:
+    """Store the user question of a new turn and return the id of the chat_history row."""
+    chat = ChatHistory(session_id=session_id, user_id=user_id, question=question, timestamp_query=query_time)
+    db.add(chat)
+    await db.commit()
+    return chat.id
+
+async def aupdate_assistant_answer(db: AsyncSession, chat_id: int, blocks: List[ContentBlock], response_time: datetime) -> None:
+    """Attach the parsed assistant answer to the turn created by ainsert_user_question."""
+    await db.execute(
+        update(ChatHistory)
+        .where(ChatHistory.id == chat_id)
+        .values(response=jsonable_encoder(blocks), timestamp_response=response_time)
+    )
+    await db.commit()
+
+async def aget_session_turns(db: AsyncSession, session_id: str, limit: Optional[int] = None) -> List[ChatHistory]:
+    """Return the turns of a session in chronological order, optionally only the `limit` most recent ones."""
+    query = select(ChatHistory).where(ChatHistory.session_id == session_id).order_by(ChatHistory.id.desc())
+    if limit:
+        query = query.limit(limit)
+    result = await db.execute(query)
+    return list(reversed(result.scalars().all()))
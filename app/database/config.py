@@ -2,6 +2,7 @@
 from sqlalchemy import create_engine
 from dotenv import load_dotenv
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
 import os
 
@@ -21,6 +22,12 @@ engine = create_engine(DATABASE_URL, pool_size=10, max_overflow=5)
 #                   through this session will interact with the specified database.
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Async engine for the request path (chat history), same database through the asyncpg driver.
+# ASYNC_DATABASE_URL can be set explicitly, otherwise it is derived from DATABASE_URL.
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL") or DATABASE_URL.replace("+psycopg2", "").replace("postgresql://", "postgresql+asyncpg://", 1)
+async_engine = create_async_engine(ASYNC_DATABASE_URL, pool_size=10, max_overflow=5)
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
 # This creates a declarative base class, which is the foundation for 
 #       defining ORM models (Python classes that represent database tables). 
 #       Each model will inherit from this base class.
@@ -39,4 +46,12 @@ def get_db():
     # After the caller is done using the session, this block 
     # ensures that the session is properly closed, releasing any resources associated with it. This is crucial for avoiding database connection leaks.
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+
+async def get_async_db():
+    """
+    Async counterpart of get_db for handlers that must not block the event loop.
+    """
+    async with AsyncSessionLocal() as db:
+        yield db
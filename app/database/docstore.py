@@ -0,0 +1,195 @@
+# app/database/docstore.py
+import json
+import threading
+import zlib
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+from langchain_core.documents import Document
+from langchain_core.stores import BaseStore
+from sqlalchemy import delete, select, text
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+
+from app.database.config import SessionLocal, engine
+from app.models.models import pgDocument
+from app.utils.settings import DOCSTORE_BATCH_SIZE, DOCSTORE_CACHE_ITEMS, DOCSTORE_COMPRESSION
+
+#-----------------------------------------------------------------------------------------------------------#
+#   Parent docstore on the `docstore` table.                                                                #
+#                                                                                                           #
+#   - mget: hot parents come from an in-process LRU, the rest is fetched with one SELECT ... IN             #
+#   - mset: one multi-row INSERT ... ON CONFLICT DO UPDATE per DOCSTORE_BATCH_SIZE documents                #
+#   - mdelete: one DELETE ... IN per batch                                                                  #
+#                                                                                                           #
+#   With DOCSTORE_COMPRESSION documents are written as zlib compressed JSON into the `data` column and      #
+#   `value` stays NULL. Both formats are read, so the setting can be switched without a rebuild.           #
+#-----------------------------------------------------------------------------------------------------------#
+
+# Added to tables created before the `data` column existed
+ADD_DATA_COLUMN = "ALTER TABLE docstore ADD COLUMN IF NOT EXISTS data BYTEA"
+
+_column_checked = False
+_column_lock = threading.Lock()
+
+
+def ensure_data_column() -> None:
+    """Add the compressed column to an existing docstore table (create_all does not alter tables)."""
+    global _column_checked
+    with _column_lock:
+        if not _column_checked:
+            with engine.begin() as connection:
+                connection.execute(text(ADD_DATA_COLUMN))
+            _column_checked = True
+
+
+class PostgresStore(BaseStore[str, Document]):
+    """
+    Parent docstore of the ParentDocumentRetriever, backed by the `docstore` table.
+    Keys are stable parent ids (doc_id + position), so entries survive restarts and are shared by all
+    index versions that contain the same file content.
+    """
+
+    def __init__(self, db: Optional[Session] = None, compression=DOCSTORE_COMPRESSION,
+                 cache_items=DOCSTORE_CACHE_ITEMS, batch_size=DOCSTORE_BATCH_SIZE):
+        # A session passed by the caller is reused, otherwise every call opens its own short-lived session
+        self.db = db
+        self.compression = compression
+        self.cache_items = cache_items
+        self.batch_size = batch_size
+        self._cache: "OrderedDict[str, Document]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        ensure_data_column()
+
+    @contextmanager
+    def _session(self) -> Iterator[Session]:
+        if self.db is not None:
+            yield self.db
+            return
+        db = SessionLocal()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    def _batches(self, items: Sequence) -> Iterator[Sequence]:
+        for start in range(0, len(items), self.batch_size):
+            yield items[start:start + self.batch_size]
+
+    # -----------------------
+    # Serialization
+    # -----------------------
+    def _to_row(self, key: str, document: Document) -> dict:
+        value = {"page_content": document.page_content, "metadata": document.metadata}
+        if self.compression:
+            return {"key": key, "value": None, "data": zlib.compress(json.dumps(value).encode("utf-8"))}
+        return {"key": key, "value": value, "data": None}
+
+    @staticmethod
+    def _from_row(value: Optional[dict], data: Optional[bytes]) -> Document:
+        if data is not None:
+            value = json.loads(zlib.decompress(data))
+        return Document(page_content=value["page_content"], metadata=value.get("metadata", {}))
+
+    # -----------------------
+    # Hot parent cache
+    # -----------------------
+    def _remember(self, documents: Dict[str, Document]) -> None:
+        with self._lock:
+            for key, document in documents.items():
+                self._cache[key] = document
+                self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_items:
+                self._cache.popitem(last=False)
+
+    def _forget(self, keys: Sequence[str]) -> None:
+        with self._lock:
+            for key in keys:
+                self._cache.pop(key, None)
+
+    # -----------------------
+    # BaseStore API
+    # -----------------------
+    def mget(self, keys: Sequence[str]) -> List[Optional[Document]]:
+        """Return the documents of `keys` (None for unknown keys) with at most one query per batch."""
+        if not keys:
+            return []
+        found, missing = {}, []
+        with self._lock:
+            for key in dict.fromkeys(keys):
+                document = self._cache.get(key)
+                if document is None:
+                    missing.append(key)
+                else:
+                    self._cache.move_to_end(key)
+                    found[key] = document
+            self.hits += len(found)
+            self.misses += len(missing)
+
+        if missing:
+            loaded = {}
+            with self._session() as db:
+                for batch in self._batches(missing):
+                    rows = db.execute(
+                        select(pgDocument.key, pgDocument.value, pgDocument.data).where(pgDocument.key.in_(batch))
+                    ).all()
+                    loaded.update({row.key: self._from_row(row.value, row.data) for row in rows})
+            self._remember(loaded)
+            found.update(loaded)
+        return [found.get(key) for key in keys]
+
+    def mset(self, key_value_pairs: Sequence[Tuple[str, Document]]) -> None:
+        """Upsert documents with one multi-row statement per batch."""
+        rows = [self._to_row(key, document) for key, document in dict(key_value_pairs).items()]
+        if not rows:
+            return
+        statement = insert(pgDocument)
+        statement = statement.on_conflict_do_update(
+            index_elements=[pgDocument.key],
+            set_={"value": statement.excluded.value, "data": statement.excluded.data},
+        )
+        with self._session() as db:
+            for batch in self._batches(rows):
+                db.execute(statement, batch)
+            db.commit()
+        self._forget([row["key"] for row in rows])
+
+    def mdelete(self, keys: Sequence[str]) -> None:
+        if not keys:
+            return
+        keys = list(keys)
+        with self._session() as db:
+            for batch in self._batches(keys):
+                db.execute(delete(pgDocument).where(pgDocument.key.in_(batch)))
+            db.commit()
+        self._forget(keys)
+
+    def yield_keys(self, prefix: Optional[str] = None) -> Iterator[str]:
+        with self._session() as db:
+            query = select(pgDocument.key)
+            if prefix:
+                query = query.where(pgDocument.key.startswith(prefix))
+            keys = db.execute(query).scalars().all()
+        yield from keys
+
+    def _ensure_clean_state(self) -> None:
+        """Remove every stored parent (only used for a full rebuild)."""
+        with self._session() as db:
+            db.execute(delete(pgDocument))
+            db.commit()
+        with self._lock:
+            self._cache.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "cached_parents": len(self._cache),
+            "max_cached_parents": self.cache_items,
+            "compression": self.compression,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+        }
@@ -1,5 +1,5 @@
 from datetime import datetime
-from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, BigInteger, JSON
+from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, BigInteger, JSON, LargeBinary
 from sqlalchemy.orm import relationship
 from app.database.config import Base  # Import Base from the correct module
 from sqlalchemy.dialects.postgresql import JSONB
@@ -32,6 +32,8 @@ class pgDocument(Base):
     __tablename__ = "docstore"
     key = Column(String, primary_key=True)
     value = Column(JSONB)
+    # zlib compressed JSON of the document, used instead of `value` when DOCSTORE_COMPRESSION is on
+    data = Column(LargeBinary, nullable=True)
     
     def __repr__(self):
         return f"<SQLDocument key='{self.key}', value='{self.value}')"
@@ -1,25 +1,35 @@
 # app/routers/chat.py
 from datetime import datetime
-from fastapi import APIRouter, Depends, HTTPException, Header
+import time
+from fastapi import APIRouter, Depends, HTTPException, Header, Request
 from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
 from sqlalchemy.orm import Session
 from typing import List, Optional, Union
 from app.database.docstore import PostgresStore
-from app.database.helper_insert_update_chathistory import clear_all_chat_history, delete_chat_history_by_session, fetch_all_histories_grouped_by_session, fetch_chat_history_for_each_session, insert_user_question, update_assistant_answer
-from app.routers.helper import parse_markdown_to_blocks
+from app.database.helper_insert_update_chathistory import clear_all_chat_history, delete_chat_history_by_session, fetch_all_histories_grouped_by_session, fetch_chat_history_for_each_session
+from app.routers.helper import parse_markdown_to_blocks, persist_answer
 from app.routers.user_router import get_user_id_from_token
 from app.schemas.chat_schema import ChatCreate, ChatResponse, ChatRequest, ContentBlock
-from app.database.config import get_db
+from app.database.config import get_db, get_async_db
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.crud.chat_crud import ainsert_user_question, aupdate_assistant_answer
+from app.utils.executor import run_blocking
 from langchain_ollama import OllamaLLM
 from app.utils.chain_manager import *
 from app.utils.docu_manager import *
 from app.utils.embed_manager import *
 from app.utils.dependencies import *
 from app.utils.faiss_chroma_manager import *
+from app.utils.embedding_cache import get_embedding_cache, get_embeddings
+from app.utils.query_rewriter import get_rewrite_cache
+from app.utils.model_manager import get_model_manager
+from app.utils.admission import BATCH, INTERACTIVE, get_admission
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import StrOutputParser
 from langchain_core.runnables import RunnablePassthrough
-from langchain.callbacks.streaming_aiter import AsyncIteratorCallbackHandler
+from fastapi.encoders import jsonable_encoder
+from app.utils.sse import SSE_HEADERS, sse_event
 #document_manager = DocumentManager(directory_path="app/Data")
 #document_manager = AdvancedDocumentManager(directory_path="app/Data")
 embedding_manager = None
@@ -38,15 +48,20 @@ async def root():
 
 
 @router.get("/documents")
-def get_documents():
-    document_manager = DocumentManager(directory_path = "app/files/")
-    chunks = document_manager.split_document()
-    embedding_manager = EmbeddingManager(chunks=chunks)
-    vectordb = embedding_manager.create_embeddings()
-    return vectordb
+def get_documents(request: Request, index_store=Depends(get_index_store)):
+    """Describe the persisted index that all chat endpoints read from."""
+    manifest = index_store.manifest or {}
+    # The file watcher in a standalone process, the index watcher in a gunicorn worker
+    worker = getattr(request.app.state, "reindex_worker", None) or getattr(request.app.state, "index_watcher", None)
+    return {
+        "version": manifest.get("version"),
+        "embedding_model": manifest.get("embedding_model"),
+        "num_vectors": manifest.get("num_vectors"),
+        "files": sorted(manifest.get("files", {})),
+        "reindex": worker.status() if worker else None,
+    }
 def get_embedding_model(model_name: str):
-    llama = OllamaEmbeddings(model=model_name, base_url='http://ollama-container:11434')
-    return llama
+    return get_embeddings(model_name)
 def get_model(model_name: str):
     llama = OllamaLLM(model=model_name, base_url='http://ollama-container:11434')
     return llama
@@ -57,13 +72,25 @@ def get_parent_doc_retriever():
     chunks = document_manager.split_document()
     return chunks, document
 
+@router.get("/metrics")
+def get_metrics(request: Request):
+    """Runtime counters of the shared caches."""
+    registry = getattr(request.app.state, "chain_registry", None)
+    parent_store = getattr(request.app.state, "parent_store", None)
+    return {
+        "embedding_cache": get_embedding_cache().stats(),
+        "session_cache": registry.store.stats() if registry else None,
+        "answer_cache": registry.answer_cache.stats() if registry and registry.answer_cache else None,
+        "query_rewrite": get_rewrite_cache().stats(),
+        "models": get_model_manager().stats(),
+        "admission": get_admission().stats(),
+        "docstore": parent_store.docstore.stats() if parent_store and hasattr(parent_store.docstore, "stats") else None,
+    }
+
 @router.post("/faiss")
-async def chat_with_faiss(request: ChatRequest):
+async def chat_with_faiss(request: ChatRequest, vectordb=Depends(get_vectordb)):
 
-    document_manager = DocumentManager(directory_path = "app/files/")
-    embedding_manager_faiss = FAISSEmbeddingManager(chunks=document_manager.split_document())
-    faiss_index = embedding_manager_faiss.create_embeddings()
-    context = embedding_manager_faiss.query_embeddings(query_text=request.question, top_k=5)
+    context = await vectordb.asimilarity_search_with_score(request.question, k=5)
     print(context)
     context = "\n".join([f"Document {i+1}: {chunk.page_content}" for i, (chunk, _) in enumerate(context)])
 
@@ -89,7 +116,8 @@ async def chat_with_faiss(request: ChatRequest):
     | llm
     | StrOutputParser()
 )
-    response = chain.invoke({"question": request.question, "context": context})
+    async with await admit("llama3.1:8b", BATCH):
+        response = await chain.ainvoke({"question": request.question, "context": context})
 
     # Print the generated response
     print("response from llm hey ", response)
@@ -99,56 +127,83 @@ async def chat_with_faiss(request: ChatRequest):
 @router.post("/stream")
 async def stream_chat(
     request: ChatRequest,
+    http_request: Request,
     session_id: Optional[str] = Header(None),  # Extract 'Session-ID' from headers
+    registry=Depends(get_chain_registry),
+    db: AsyncSession = Depends(get_async_db),
+    user_id: int = Depends(get_user_id_from_token),
 ):
     """
     Streaming response API for real-time chatbot interactions.
+
+    Sends server-sent events: `start`, one `meta` event with the time to first token and whether the
+    answer came from the answer cache, one `token` event per generated piece of the answer and a final
+    `done` event with the parsed blocks.
+    The assembled answer is stored in chat_history once the stream is finished.
     """
     # Step 1: Capture question time
     query_time = datetime.now()
     print("Processing query with model:", request.selectedModel)
-    document_manager = DocumentManager(directory_path = "app/files/")
-    embedding_manager = EmbeddingManager(chunks=document_manager.split_document())
-    vectordb = embedding_manager.create_embeddings()
 
-    # Step 2: Retrieve relevant documents
-    retriever = AdvancedVectorRetriever(vectordb)
-    retriever_vanilla = retriever.retrieve_documents(search_type="similarity")
+    # Step 2: Look the question up in the answer cache; only a miss waits for a generation slot
+    # (interactive priority) or gets a 429, and both happen before anything is stored
+    # Reuse the prebuilt chain of the selected model (same retriever as /bot/query)
+    conversational_manager = registry.get(request.selectedModel)
+    prepared = await conversational_manager.aprepare_query(session_id, request.question)
+    slot = await admit(request.selectedModel, INTERACTIVE) if prepared[1] is None else None
+    try:
+        chat_id = await ainsert_user_question(db, session_id, user_id, request.question, query_time)
+    except BaseException:
+        release_slot(slot)
+        raise
 
-    # Step 3: Initialize conversational manager
-    conversational_manager = ConversationalChainManager(llm_name=request.selectedModel)
-    chain = conversational_manager.build_conversation_chain(retriever_vanilla)
-
-    # Step 4: Create an async generator for streaming
+    # Step 3: Create an async generator for streaming
     async def response_generator():
-        callback = AsyncIteratorCallbackHandler()
-        # Directly using the `astream` function to stream the tokens
-        async for token in chain.astream(
-            {"input": request.question},
-            config={"configurable": {"session_id": session_id}, "callbacks": [callback]},
-        ):
-            # Check if 'answer' exists and is a string
-            if "answer" in token and isinstance(token["answer"], str):
-                yield token["answer"]
-            #else:
-                #logging.warning(f"Unexpected token format: {token}")
+        started = time.perf_counter()
+        answer_parts = []
+        cancelled = False
+        meta = {}
+        tokens = conversational_manager.astream_user_query(session_id=session_id, user_query=request.question, meta=meta,
+                                                           prepared=prepared)
+        try:
+            yield sse_event({"model": request.selectedModel, "session_id": session_id, "chat_id": chat_id}, event="start")
+            async for token in tokens:
+                # Stop generating as soon as the client went away
+                if await http_request.is_disconnected():
+                    cancelled = True
+                    break
+                if not answer_parts:
+                    yield sse_event({"time_to_first_token": round(time.perf_counter() - started, 3),
+                                     "cached": meta.get("cached", False)}, event="meta")
+                answer_parts.append(token)
+                yield sse_event({"token": token}, event="token")
+        finally:
+            await tokens.aclose()
+            release_slot(slot)
+
+        # Step 4: Persist the assembled answer in one write
+        parsed_blocks, duration = await persist_answer(chat_id, "".join(answer_parts), query_time, cancelled=cancelled)
+        if not cancelled:
+            yield sse_event({"response": jsonable_encoder(parsed_blocks), "duration": duration,
+                             "cached": meta.get("cached", False)}, event="done")
 
     # Step 5: Return a streaming response
-    return StreamingResponse(response_generator(), media_type="text/event-stream")
+    # The background task releases the slot if the client left before the stream started
+    return StreamingResponse(response_generator(), media_type="text/event-stream", headers=SSE_HEADERS,
+                             background=BackgroundTask(release_slot, slot))
     
 @router.post("/query", response_model=ChatResponse)
 async def chat_with_bot(
     request: ChatRequest, 
     #vectordb=Depends(get_vectordb), 
     #embedding_manager=Depends(get_embedding_manager),
-    retriever=Depends(get_retriever),
-    db: Session = Depends(get_db),
+    registry=Depends(get_chain_registry),
+    db: AsyncSession = Depends(get_async_db),
     user_id: int = Depends(get_user_id_from_token),
     session_id: Optional[str] = Header(None),  # Extracts 'Session-ID' from headers
     ):
          # Step 1: Capture the question time (user query time)
         query_time = datetime.now()
-        chat_id = insert_user_question(session_id, user_id, request.question, query_time, db=db)
         #print("going inside the fucntion conversation manager", request.selectedModel)
         # Step 2: Process user query
 
@@ -159,14 +214,25 @@ async def chat_with_bot(
         #retriever_vanilla = retriever.retrieve_documents(search_type="similarity")
         #retriever_mmr = retriever.retrieve_documents(search_type="mmr")
 
-        conversational_manager = ConversationalChainManager(llm_name= request.selectedModel)#'deepseek-r1:32b')
-        conversational_manager.build_conversation_chain(retriever)
-        ans = conversational_manager.process_user_query(session_id=session_id, user_query=request.question)
+        meta = {}
+        # Prebuilt chain of the selected model, shared across requests
+        conversational_manager = registry.get(request.selectedModel)#'deepseek-r1:32b')
+        # Look the question up in the answer cache first (this also loads the history before the question is
+        # stored); only a miss takes a slot. Non-streaming callers are batch traffic, interactive streams get the
+        # free slots first. The slot is taken before anything is stored, so a 429 leaves no unanswered question
+        prepared = await conversational_manager.aprepare_query(session_id, request.question)
+        slot = await admit(request.selectedModel, BATCH) if prepared[1] is None else None
+        try:
+            chat_id = await ainsert_user_question(db, session_id, user_id, request.question, query_time)
+            ans = await conversational_manager.aprocess_user_query(session_id=session_id, user_query=request.question,
+                                                                   meta=meta, prepared=prepared)
+        finally:
+            release_slot(slot)
         #print('type of ans',type(ans))
         print("ans: ", ans)
 
         response_time = datetime.now()
-        parsed_blocks = parse_markdown_to_blocks(ans)
+        parsed_blocks = await run_blocking(parse_markdown_to_blocks, ans)
        
         duration = (response_time - query_time).total_seconds()
         print("time taken for processing...", duration)
@@ -174,10 +240,10 @@ async def chat_with_bot(
         # Add the duration as a "think" block
         duration_block = ContentBlock(type="botStatusMsg", content=f"Thought for {duration:.1f} seconds")
         parsed_blocks.append(duration_block)
-        update_assistant_answer(chat_id, parsed_blocks, response_time, db=db)
+        await aupdate_assistant_answer(db, chat_id, parsed_blocks, response_time)
         #return {"response": ans}
         print ("after parcing: ", parsed_blocks)
-        return ChatResponse(response=parsed_blocks,)
+        return ChatResponse(response=parsed_blocks, cached=meta.get("cached", False))
                             # duration=duration
                             #timestamp_query = query_time.isoformat(),  # Send the query timestamp
                             #timestamp_response = response_time.isoformat())
@@ -186,29 +252,22 @@ async def chat_with_bot(
 async def chat_with_bot_simple(
     request: ChatRequest,
     session_id: Optional[str] = Header(None),
-    search_type: str= "similarity"  # Extracts 'Session-ID' from headers  
+    search_type: str= "similarity",  # Extracts 'Session-ID' from headers  
+    vectordb=Depends(get_vectordb),
 ):
-    # Initialize DocumentManager and retrieve chunks
-    document_manager = DocumentManager(directory_path="app/files/")
-    chunks = document_manager.split_document()
-
-    # Create embeddings using EmbeddingManager
-    embedding_manager = EmbeddingManager(chunks=chunks)
-    vectordb = embedding_manager.create_embeddings()
-
-    # Initialize retriever with vector database
-    retriever_doc = AdvancedVectorRetriever(vectordb)
-    retriever = retriever_doc.retrieve_documents(search_type=search_type)
+    # Initialize retriever with the shared persisted index
+    retriever = vectordb.as_retriever(search_type=search_type)
     
     # Initialize ConversationalChainManager
     conversational_manager = ConversationalChainManager()
     
     # Build conversation chain for vanilla retriever
     chain = conversational_manager.build_conversation_chain(retriever)
-    response = chain.invoke(
-            {"input": request.question},
-            config={"configurable": {"session_id": session_id}}
-            )
+    async with await admit(conversational_manager.llm_name, BATCH):
+        response = await chain.ainvoke(
+                {"input": request.question},
+                config={"configurable": {"session_id": session_id}}
+                )
 
     
     # Return responses for both retrieval methods
@@ -226,10 +285,12 @@ def get_chat_histories_by_session(session_id: str, db: Session = Depends(get_db)
     return fetch_chat_history_for_each_session(session_id,db)
 
 @router.delete("/delete-session/{session_id}")
-def delete_session(session_id: str, db: Session = Depends(get_db)):
+def delete_session(session_id: str, db: Session = Depends(get_db), registry=Depends(get_chain_registry)):
+    registry.store.pop(session_id)
     return delete_chat_history_by_session(session_id, db)
 @router.delete("/delete-all")
-def delete_all_sessions(db: Session = Depends(get_db)):
+def delete_all_sessions(db: Session = Depends(get_db), registry=Depends(get_chain_registry)):
+    registry.store.clear()
     return clear_all_chat_history(db)
 
 # Dependency to get PostgresStore instance
@@ -1,9 +1,13 @@
 import re
+from datetime import datetime
 from typing import List
 from markdown import markdown # type: ignore
 from bs4 import BeautifulSoup, Tag
 from markdown import markdown
 from app.schemas.chat_schema import ContentBlock
+from app.crud.chat_crud import aupdate_assistant_answer
+from app.database.config import AsyncSessionLocal
+from app.utils.executor import run_blocking
 
 
 def parse_markdown_to_blocks(ans: str) -> List[ContentBlock]:
@@ -41,3 +45,18 @@ def parse_markdown_to_blocks(ans: str) -> List[ContentBlock]:
 
     return blocks
 
+
+
+async def persist_answer(chat_id: int, answer: str, query_time: datetime, cancelled: bool = False):
+    """
+    Parse a finished (or cancelled) answer into blocks, append the status block and store it on the
+    chat_history row created for the question. Returns the blocks and the duration in seconds.
+    """
+    response_time = datetime.now()
+    duration = (response_time - query_time).total_seconds()
+    parsed_blocks = await run_blocking(parse_markdown_to_blocks, answer)
+    status = "Generation cancelled after" if cancelled else "Thought for"
+    parsed_blocks.append(ContentBlock(type="botStatusMsg", content=f"{status} {duration:.1f} seconds"))
+    async with AsyncSessionLocal() as db:
+        await aupdate_assistant_answer(db, chat_id, parsed_blocks, response_time)
+    return parsed_blocks, duration
@@ -0,0 +1,221 @@
+# app/routers/ws_router.py
+import asyncio
+import logging
+import time
+from datetime import datetime
+
+from fastapi import APIRouter, HTTPException, WebSocket, WebSocketDisconnect, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.encoders import jsonable_encoder
+
+from app.crud.chat_crud import ainsert_user_question
+from app.database.config import AsyncSessionLocal, SessionLocal
+from app.routers.helper import persist_answer
+from app.routers.user_router import get_user_id_from_token
+from app.utils.admission import INTERACTIVE, AdmissionRejected, get_admission
+from app.utils.settings import WS_MAX_PENDING_QUESTIONS, WS_SEND_QUEUE_SIZE
+
+logger = logging.getLogger(__name__)
+
+#-----------------------------------------------------------------------------------------------------------#
+#   WebSocket chat channel, one connection per chat session.                                                #
+#                                                                                                           #
+#   Client -> server                                                                                        #
+#       {"type": "question", "id": "q1", "question": "...", "selectedModel": "llama3.1:8b"}                 #
+#       {"type": "cancel", "id": "q1"}                                                                      #
+#   Server -> client                                                                                        #
+#       {"type": "queued" | "start" | "meta" | "token" | "done" | "cancelled" | "error", "id": ..., ...}    #
+#       (an "error" for a question rejected by admission control carries "retry_after" in seconds)          #
+#                                                                                                           #
+#   Several questions can be sent without waiting; they are answered in order because each answer           #
+#   becomes part of the history of the next one. Outgoing frames go through a bounded queue, so a slow      #
+#   client slows down its own generation instead of growing memory. Acknowledgements of incoming frames     #
+#   ("queued", validation errors) use a separate control queue that never blocks the receiver, so a         #
+#   "cancel" is handled at once even while the answer frames are backed up; they are dropped when full.     #
+#-----------------------------------------------------------------------------------------------------------#
+
+router = APIRouter(
+    prefix="/ws",
+    tags=["ws"],
+)
+
+
+class ChatConnection:
+    """State of one chat WebSocket: send queue, pending questions and the answer in progress."""
+
+    def __init__(self, websocket: WebSocket, session_id: str, user_id: int):
+        self.websocket = websocket
+        self.session_id = session_id
+        self.user_id = user_id
+        self.registry = websocket.app.state.chain_registry
+        self.outbox = asyncio.Queue(maxsize=WS_SEND_QUEUE_SIZE)
+        self.control = asyncio.Queue(maxsize=WS_SEND_QUEUE_SIZE)
+        self._pending = asyncio.Event()  # set when either queue got a frame
+        self.questions = asyncio.Queue(maxsize=WS_MAX_PENDING_QUESTIONS)
+        self.cancelled_ids = set()
+        self.current_id = None
+        self.current_task = None
+        self.closed = False
+
+    async def send(self, message: dict) -> None:
+        """Queue a frame for the client; waits while the queue is full (backpressure)."""
+        if not self.closed:
+            await self.outbox.put(message)
+            self._pending.set()
+
+    def notify(self, message: dict) -> None:
+        """Queue a control frame without waiting; the receiver must never block on a slow client."""
+        if self.closed:
+            return
+        try:
+            self.control.put_nowait(message)
+            self._pending.set()
+        except asyncio.QueueFull:
+            logger.warning(f"WebSocket control queue full for session {self.session_id}, dropping {message.get('type')}")
+
+    async def sender(self) -> None:
+        while True:
+            # Control frames first; get_nowait on the outbox also wakes up a producer waiting for room
+            if not self.control.empty():
+                message = self.control.get_nowait()
+            elif not self.outbox.empty():
+                message = self.outbox.get_nowait()
+            else:
+                self._pending.clear()
+                await self._pending.wait()
+                continue
+            await self.websocket.send_json(message)
+
+    async def receiver(self) -> None:
+        while True:
+            message = await self.websocket.receive_json()
+            message_type = message.get("type")
+            message_id = message.get("id")
+
+            if message_type == "question":
+                if not message.get("question") or not message.get("selectedModel"):
+                    self.notify({"type": "error", "id": message_id, "detail": "question and selectedModel are required"})
+                    continue
+                try:
+                    self.questions.put_nowait(message)
+                except asyncio.QueueFull:
+                    self.notify({"type": "error", "id": message_id, "detail": "Too many pending questions"})
+                    continue
+                self.notify({"type": "queued", "id": message_id, "position": self.questions.qsize()})
+
+            elif message_type == "cancel":
+                if message_id is not None and message_id == self.current_id and self.current_task:
+                    self.current_task.cancel()
+                else:
+                    self.cancelled_ids.add(message_id)
+
+            else:
+                self.notify({"type": "error", "id": message_id, "detail": f"Unknown message type {message_type}"})
+
+    async def worker(self) -> None:
+        """Answer queued questions one after the other."""
+        try:
+            while True:
+                message = await self.questions.get()
+                if message.get("id") in self.cancelled_ids:
+                    self.cancelled_ids.discard(message.get("id"))
+                    await self.send({"type": "cancelled", "id": message.get("id")})
+                    continue
+                self.current_id = message.get("id")
+                self.current_task = asyncio.create_task(self.answer(message))
+                # asyncio.wait does not raise when the answer task is cancelled by the client
+                await asyncio.wait({self.current_task})
+                self.current_id, self.current_task = None, None
+        finally:
+            if self.current_task:
+                self.current_task.cancel()
+
+    async def answer(self, message: dict) -> None:
+        message_id = message.get("id")
+        query_time = datetime.now()
+        started = time.perf_counter()
+        answer_parts = []
+        cancelled = False
+        chat_id = None
+        tokens = None
+        slot = None
+        meta = {}
+        try:
+            # Same order as /bot/stream: answer cache first, a slot only on a miss; nothing is stored for a
+            # rejected question
+            conversational_manager = self.registry.get(message["selectedModel"])
+            prepared = await conversational_manager.aprepare_query(self.session_id, message["question"])
+            if prepared[1] is None:
+                slot = await get_admission().acquire(message["selectedModel"], INTERACTIVE)
+            async with AsyncSessionLocal() as db:
+                chat_id = await ainsert_user_question(db, self.session_id, self.user_id, message["question"], query_time)
+            await self.send({"type": "start", "id": message_id, "chat_id": chat_id})
+
+            tokens = conversational_manager.astream_user_query(self.session_id, message["question"], meta=meta,
+                                                               prepared=prepared)
+            async for token in tokens:
+                if not answer_parts:
+                    await self.send({"type": "meta", "id": message_id,
+                                     "time_to_first_token": round(time.perf_counter() - started, 3),
+                                     "cached": meta.get("cached", False)})
+                answer_parts.append(token)
+                await self.send({"type": "token", "id": message_id, "token": token})
+        except AdmissionRejected as e:
+            await self.send({"type": "error", "id": message_id, "detail": f"Too many requests: {e.reason}",
+                             "retry_after": e.retry_after})
+            return
+        except asyncio.CancelledError:
+            # Cancelled by the client (or the connection closed): the token stream is closed, which stops Ollama
+            cancelled = True
+        except Exception as e:
+            logger.error(f"WebSocket answer failed for session {self.session_id}: {e}", exc_info=True)
+            await self.send({"type": "error", "id": message_id, "detail": "Answer generation failed"})
+            return
+        finally:
+            if tokens is not None:
+                await tokens.aclose()
+            if slot is not None:
+                slot.release()
+
+        if chat_id is not None:
+            parsed_blocks, duration = await persist_answer(chat_id, "".join(answer_parts), query_time, cancelled=cancelled)
+        if cancelled:
+            await self.send({"type": "cancelled", "id": message_id})
+        else:
+            await self.send({"type": "done", "id": message_id, "response": jsonable_encoder(parsed_blocks), "duration": duration,
+                             "cached": meta.get("cached", False)})
+
+
+def _authenticate(websocket: WebSocket) -> int:
+    """Resolve the user from the auth_token cookie, like get_user_id_from_token does for HTTP requests."""
+    db = SessionLocal()
+    try:
+        return get_user_id_from_token(websocket, db)
+    finally:
+        db.close()
+
+
+@router.websocket("/chat/{session_id}")
+async def websocket_chat(websocket: WebSocket, session_id: str):
+    """Real-time chat over a persistent socket with streamed, cancellable and pipelined answers."""
+    try:
+        user_id = await run_in_threadpool(_authenticate, websocket)
+    except HTTPException as e:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason=str(e.detail))
+        return
+    if not hasattr(websocket.app.state, "chain_registry"):
+        await websocket.close(code=status.WS_1013_TRY_AGAIN_LATER, reason="Service is starting")
+        return
+
+    await websocket.accept()
+    connection = ChatConnection(websocket, session_id, user_id)
+    tasks = [asyncio.create_task(connection.sender()), asyncio.create_task(connection.worker())]
+    try:
+        await connection.receiver()
+    except WebSocketDisconnect:
+        logger.info(f"WebSocket disconnected for session {session_id}")
+    finally:
+        connection.closed = True
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
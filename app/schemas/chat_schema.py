@@ -27,4 +27,5 @@ class ContentBlock(BaseModel):
 
 class ChatResponse(BaseModel):
     response: List[ContentBlock]
+    cached: bool = False
     # duration: float
\ No newline at end of file
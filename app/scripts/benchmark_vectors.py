@@ -0,0 +1,84 @@
+import sys
+import os
+import argparse
+
+import faiss
+import numpy as np
+
+# Get the path to the backend directory
+current_dir = os.path.dirname(os.path.abspath(__file__))
+backend_dir = os.path.abspath(os.path.join(current_dir, os.pardir, os.pardir))
+
+# Add the backend directory to the Python path
+sys.path.append(backend_dir)
+
+from app.scripts.tune_index import load_queries
+from app.utils.ann_index import build_ann_index, default_search_params, evaluate, exact_neighbors
+from app.utils.index_store import VectorIndexStore
+from app.utils.quantized_index import STORAGE_TYPES, RescoringIndex, index_nbytes
+from app.utils.settings import EMBEDDING_MODEL, INDEX_DIR, RESCORE_FACTOR
+
+# Compare the vector storages (float32, float16, int8, binary) on the vectors of a published index or on
+# synthetic clustered vectors: resident index size, build time, single-query latency and recall@k of the
+# coarse pass alone and with the exact rescoring against the full-precision vectors.
+#   python app/scripts/benchmark_vectors.py --store chunks --queries questions.txt
+#   python app/scripts/benchmark_vectors.py --synthetic 200000 --dimension 1024 --index-type hnsw
+
+
+def synthetic_vectors(n: int, dimension: int, clusters: int = 256, seed: int = 0) -> np.ndarray:
+    """Normalized vectors around random centers, closer to real embeddings than uniform noise."""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dimension), dtype=np.float32)
+    vectors = centers[rng.integers(clusters, size=n)] + 0.5 * rng.standard_normal((n, dimension), dtype=np.float32)
+    faiss.normalize_L2(vectors)
+    return vectors
+
+
+def benchmark(vectors: np.ndarray, queries: np.ndarray, index_type: str, storages, k: int, factor: int):
+    flat = faiss.IndexFlatL2(vectors.shape[1])
+    flat.add(np.ascontiguousarray(vectors, dtype=np.float32))
+    truth = exact_neighbors(flat, queries, k)
+    full_size = vectors.shape[0] * vectors.shape[1] * 4
+    print(f"{vectors.shape[0]} vectors x {vectors.shape[1]} dims ({full_size / 2**20:.1f} MiB float32), "
+          f"{len(queries)} queries, recall@{k}, rescoring {factor} x k candidates.")
+    print(f"{'storage':<8} {'factory':<16} {'index MiB':>9} {'smaller':>7} {'build s':>7} "
+          f"{'p50 ms':>7} {'p95 ms':>7} {'coarse':>7} {'rescored':>8}")
+
+    for storage in storages:
+        index, ann = build_ann_index(flat, index_type, storage)
+        params = default_search_params(ann["type"])
+        # factor 1 rescores only the k coarse results: same ids, i.e. the recall of the coarse pass
+        coarse = evaluate(RescoringIndex(index, vectors, factor=1), params, queries, truth, k)
+        searched = RescoringIndex(index, vectors, factor=factor) if ann["rescore"] else index
+        result = evaluate(searched, params, queries, truth, k)
+        size = index_nbytes(index)
+        print(f"{storage:<8} {ann['factory']:<16} {size / 2**20:>9.1f} {full_size / size:>6.1f}x "
+              f"{ann.get('build_seconds', 0):>7.2f} {result['latency_ms_p50']:>7.3f} {result['latency_ms_p95']:>7.3f} "
+              f"{coarse['recall']:>7.4f} {result['recall']:>8.4f}")
+        del index, searched
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Memory, latency and recall of the vector storages.")
+    parser.add_argument("--store", default="chunks", help="Published index whose vectors are used (chunks or parents).")
+    parser.add_argument("--queries", default="", help="File with one question per line (default: sampled vectors).")
+    parser.add_argument("--synthetic", type=int, default=0, help="Use this many synthetic vectors instead of --store.")
+    parser.add_argument("--dimension", type=int, default=1024, help="Dimension of the synthetic vectors.")
+    parser.add_argument("--sample", type=int, default=500, help="Number of queries without --queries.")
+    parser.add_argument("--index-type", default="flat", help="flat, hnsw, ivf_flat, ivf_pq or auto.")
+    parser.add_argument("--storage", nargs="+", default=list(STORAGE_TYPES), choices=STORAGE_TYPES)
+    parser.add_argument("--k", type=int, default=10, help="Neighbours compared for recall@k.")
+    parser.add_argument("--rescore-factor", type=int, default=RESCORE_FACTOR, help="Candidates per result.")
+    args = parser.parse_args()
+
+    if args.synthetic:
+        vectors = synthetic_vectors(args.synthetic + args.sample, args.dimension)
+        vectors, queries = vectors[args.sample:], vectors[:args.sample]
+    else:
+        store = VectorIndexStore(name=args.store, index_dir=INDEX_DIR, embedding_model=EMBEDDING_MODEL)
+        version = store.current_version()
+        if version is None:
+            raise SystemExit(f"No published index '{args.store}', run app/scripts/build_index.py first.")
+        vectors = store.exact_vectors(version)
+        queries = load_queries(store, vectors, args.queries, args.sample)
+    benchmark(vectors, queries, args.index_type, args.storage, args.k, args.rescore_factor)
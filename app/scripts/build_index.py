@@ -0,0 +1,36 @@
+import sys
+import os
+import argparse
+
+# Get the path to the backend directory
+current_dir = os.path.dirname(os.path.abspath(__file__))
+backend_dir = os.path.abspath(os.path.join(current_dir, os.pardir, os.pardir))
+
+# Add the backend directory to the Python path
+sys.path.append(backend_dir)
+
+from app.utils.index_store import VectorIndexStore
+from app.utils.parent_store import ParentIndexStore
+from app.utils.settings import EMBEDDING_MODEL, FILES_DIR, INDEX_DIR
+
+# Build (or refresh) the persisted chunk index and parent retriever offline, so the API only has to load them at startup.
+#   python app/scripts/build_index.py            -> rebuild only if the source files changed
+#   python app/scripts/build_index.py --force    -> always re-embed the whole corpus
+
+def build_index(force: bool = False):
+    index_store = VectorIndexStore(name="chunks", index_dir=INDEX_DIR, source_dir=FILES_DIR, embedding_model=EMBEDDING_MODEL)
+    parent_store = ParentIndexStore(index_dir=INDEX_DIR, source_dir=FILES_DIR, embedding_model=EMBEDDING_MODEL)
+    for store in (index_store, parent_store):
+        if force:
+            store.build()
+        else:
+            store.load_or_build()
+        manifest = store.manifest
+        print(f"Index '{store.name}' version {manifest['version']}: {manifest['num_vectors']} vectors from {len(manifest['files'])} files.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the persisted FAISS index.")
+    parser.add_argument("--force", action="store_true", help="Re-embed all files even if nothing changed.")
+    args = parser.parse_args()
+    build_index(force=args.force)
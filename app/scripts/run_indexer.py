@@ -0,0 +1,78 @@
+import sys
+import os
+import argparse
+import logging
+import signal
+from queue import Queue
+
+from watchdog.observers import Observer
+
+# Get the path to the backend directory
+current_dir = os.path.dirname(os.path.abspath(__file__))
+backend_dir = os.path.abspath(os.path.join(current_dir, os.pardir, os.pardir))
+
+# Add the backend directory to the Python path
+sys.path.append(backend_dir)
+
+from app.utils.index_store import VectorIndexStore
+from app.utils.parent_store import ParentIndexStore
+from app.utils.services import FileChangeHandler, ReindexWorker
+from app.utils.settings import EMBEDDING_MODEL, FILES_DIR, INDEX_DIR, INDEX_KEEP_VERSIONS
+
+logger = logging.getLogger(__name__)
+
+# The only process that writes the indexes when the API runs as several gunicorn workers (INDEX_ROLE=reader).
+# It brings both indexes up to date, then watches app/files/ and publishes a new immutable version after every
+# batch of changes; the workers memory-map the versions and swap to a new one when CURRENT changes.
+#   python app/scripts/run_indexer.py           -> sync, then watch and publish until stopped (SIGTERM)
+#   python app/scripts/run_indexer.py --once    -> sync once and exit (cron, deployment step)
+
+
+def publish(index_store: VectorIndexStore, parent_store: ParentIndexStore):
+    """Sync both indexes with the source files and drop versions no worker should still be loading."""
+    for store in (index_store, parent_store):
+        version = store.current_version()
+        store.sync()
+        if store.current_version() != version:
+            logger.info(f"Published index '{store.name}' version {store.current_version()}.")
+        store.prune_versions(keep=INDEX_KEEP_VERSIONS)
+
+
+def run_indexer(once: bool = False):
+    index_store = VectorIndexStore(name="chunks", index_dir=INDEX_DIR, source_dir=FILES_DIR, embedding_model=EMBEDDING_MODEL)
+    parent_store = ParentIndexStore(index_dir=INDEX_DIR, source_dir=FILES_DIR, embedding_model=EMBEDDING_MODEL)
+    # First pass like the standalone API: rebuilds the parents if the docstore lost them, syncs changed files
+    index_store.load_or_build()
+    parent_store.load_or_build()
+    for store in (index_store, parent_store):
+        store.prune_versions(keep=INDEX_KEEP_VERSIONS)
+    if once:
+        return
+
+    queue = Queue()
+    worker = ReindexWorker(None, queue, action=lambda: publish(index_store, parent_store))
+    worker.start()
+    observer = Observer()
+    observer.schedule(FileChangeHandler(queue), path=FILES_DIR, recursive=True)
+    observer.start()
+    logger.info(f"Indexer watching {FILES_DIR}.")
+
+    # docker stop sends SIGTERM: finish the running sync instead of leaving a half written version behind
+    signal.signal(signal.SIGTERM, lambda *_: worker.stop())
+    try:
+        while worker.is_alive():
+            worker.join(timeout=1)
+    except KeyboardInterrupt:
+        worker.stop()
+        worker.join()
+    finally:
+        observer.stop()
+        observer.join(timeout=5)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Build the indexes and publish new versions when app/files/ changes.")
+    parser.add_argument("--once", action="store_true", help="Sync once and exit instead of watching the files.")
+    args = parser.parse_args()
+    run_indexer(once=args.once)
@@ -0,0 +1,92 @@
+import sys
+import os
+import argparse
+from datetime import datetime, timezone
+
+import faiss
+import numpy as np
+
+# Get the path to the backend directory
+current_dir = os.path.dirname(os.path.abspath(__file__))
+backend_dir = os.path.abspath(os.path.join(current_dir, os.pardir, os.pardir))
+
+# Add the backend directory to the Python path
+sys.path.append(backend_dir)
+
+from app.utils.ann_index import evaluate, exact_neighbors, sweep
+from app.utils.index_store import VectorIndexStore
+from app.utils.quantized_index import RescoringIndex
+from app.utils.settings import ANN_TARGET_RECALL, EMBEDDING_MODEL, INDEX_DIR
+
+# Pick the query-time parameter (nprobe / efSearch) of the published ANN index: the fastest setting that
+# reaches the target recall@k against an exact search. The result is written to app/index/<store>/TUNING and
+# used by every process that loads the index afterwards (restart or next reindex). Compact indexes
+# (VECTOR_STORAGE, ivf_pq) are measured with the exact rescoring the API applies.
+#   python app/scripts/tune_index.py --store parents --queries questions.txt
+#   python app/scripts/tune_index.py --store chunks --sample 1000 --k 10 --target-recall 0.98
+
+
+def load_queries(store: VectorIndexStore, vectors: np.ndarray, path: str, sample: int) -> np.ndarray:
+    """Embed the questions in `path` (one per line), or sample stored vectors when no file is given."""
+    if path:
+        with open(path, "r", encoding="utf-8") as file:
+            questions = [line.strip() for line in file if line.strip()]
+        return np.ascontiguousarray(store.embedding.embed_array(questions), dtype=np.float32)
+    positions = np.sort(np.random.default_rng(1).choice(len(vectors), min(sample, len(vectors)), replace=False))
+    return np.ascontiguousarray(vectors[positions], dtype=np.float32)
+
+
+def tune_index(store_name: str, queries_path: str, sample: int, k: int, target_recall: float, dry_run: bool):
+    store = VectorIndexStore(name=store_name, index_dir=INDEX_DIR, embedding_model=EMBEDDING_MODEL)
+    version = store.current_version()
+    if version is None:
+        raise SystemExit(f"No published index '{store_name}', run app/scripts/build_index.py first.")
+    manifest = store.read_manifest(version)
+    ann = manifest.get("ann", {"type": "flat", "factory": "Flat"})
+    if ann["type"] == "flat":
+        print(f"Index '{store_name}' version {version} is a flat index, there is nothing to tune.")
+        return
+
+    version_dir = store.root / version
+    ann_index = store._read_faiss_index(str(version_dir / "index.faiss"), mmap=True,
+                                        binary=ann.get("storage") == "binary")
+    vectors = store.exact_vectors(version)
+    if ann.get("rescore"):
+        ann_index = RescoringIndex(ann_index, vectors)
+    exact = faiss.IndexFlatL2(vectors.shape[1])
+    exact.add(np.ascontiguousarray(vectors, dtype=np.float32))
+    queries = load_queries(store, vectors, queries_path, sample)
+    truth = exact_neighbors(exact, queries, k)
+    print(f"Tuning {ann['factory']} ({ann_index.ntotal} vectors) with {len(queries)} queries, recall@{k} >= {target_recall}.")
+
+    results = []
+    for params in sweep(ann["type"], ann_index):
+        result = evaluate(ann_index, params, queries, truth, k)
+        results.append(result)
+        print(f"  {params:<14} recall {result['recall']:.4f}  p50 {result['latency_ms_p50']:.3f} ms  p95 {result['latency_ms_p95']:.3f} ms")
+
+    passing = [result for result in results if result["recall"] >= target_recall]
+    if passing:
+        best = min(passing, key=lambda result: result["latency_ms_p50"])
+    else:
+        best = max(results, key=lambda result: result["recall"])
+        print(f"No setting reaches recall {target_recall}; using the most accurate one. "
+              f"Consider a larger ANN_NLIST/ANN_PQ_M or ANN_INDEX_TYPE=hnsw.")
+    print(f"Chosen: {best['params']} (recall {best['recall']:.4f}, p50 {best['latency_ms_p50']:.3f} ms).")
+
+    if not dry_run:
+        store.write_tuning(dict(best, factory=ann["factory"], type=ann["type"], version=version, k=k,
+                                target_recall=target_recall, queries=len(queries),
+                                tuned_at=datetime.now(timezone.utc).isoformat()))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Tune nprobe/efSearch of the persisted ANN index.")
+    parser.add_argument("--store", default="parents", help="Index to tune (chunks or parents).")
+    parser.add_argument("--queries", default="", help="File with one held-out question per line.")
+    parser.add_argument("--sample", type=int, default=500, help="Stored vectors used as queries without --queries.")
+    parser.add_argument("--k", type=int, default=10, help="Neighbours compared for recall@k.")
+    parser.add_argument("--target-recall", type=float, default=ANN_TARGET_RECALL, help="Minimum recall@k.")
+    parser.add_argument("--dry-run", action="store_true", help="Only print the sweep, do not store the result.")
+    args = parser.parse_args()
+    tune_index(args.store, args.queries, args.sample, args.k, args.target_recall, args.dry_run)
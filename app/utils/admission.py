@@ -0,0 +1,176 @@
+# app/utils/admission.py
+import asyncio
+import heapq
+import itertools
+import logging
+import math
+import time
+from typing import Dict, Optional
+
+from app.utils.model_manager import parse_model_map
+from app.utils.settings import (ADMISSION_QUEUE_SIZE, ADMISSION_TIMEOUT_SECONDS, DEFAULT_MODEL_CONCURRENCY,
+                                MODEL_CONCURRENCY)
+
+logger = logging.getLogger(__name__)
+
+#-----------------------------------------------------------------------------------------------------------#
+#   Admission control in front of Ollama.                                                                   #
+#                                                                                                           #
+#   Every model has MODEL_CONCURRENCY generation slots. A request that finds no free slot waits in a        #
+#   bounded per-model queue: interactive requests (/bot/stream, WebSocket) before batch requests            #
+#   (/bot/query), first come first served within a priority. A full queue is rejected right away and a      #
+#   request that waited ADMISSION_TIMEOUT_SECONDS gives up; both become a 429 with a Retry-After estimated   #
+#   from the queue length and the recent generation time. Under a burst the queued requests are served at   #
+#   the rate Ollama can sustain instead of all of them timing out together.                                 #
+#-----------------------------------------------------------------------------------------------------------#
+
+INTERACTIVE, BATCH = 0, 1
+
+# Generation time assumed before the first request of a model finished
+DEFAULT_SERVICE_SECONDS = 10.0
+
+
+class AdmissionRejected(Exception):
+    """No slot could be given to the request; `retry_after` is a hint in seconds for the client."""
+
+    def __init__(self, model: str, reason: str, retry_after: int):
+        super().__init__(f"{model}: {reason}")
+        self.model = model
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class _ModelGate:
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.active = 0
+        self.waiters = []  # heap of (priority, sequence, future)
+        self.service_seconds = DEFAULT_SERVICE_SECONDS  # moving average of the slot hold time
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.wait_seconds_max = 0.0
+
+    def queued(self) -> int:
+        return sum(1 for _, _, future in self.waiters if not future.done())
+
+
+class AdmissionSlot:
+    """A held generation slot; released once, by `release()` or at the end of `async with`."""
+
+    def __init__(self, controller: "AdmissionController", gate: _ModelGate):
+        self._controller = controller
+        self._gate = gate
+        self._started = time.monotonic()
+        self._released = False
+
+    def release(self) -> None:
+        if not self._released:
+            self._released = True
+            self._controller._release(self._gate, time.monotonic() - self._started)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        self.release()
+
+
+class AdmissionController:
+    """Per-model slots with a bounded priority queue; all state lives on the event loop of this worker."""
+
+    def __init__(self, limits: Optional[Dict[str, int]] = None, default_limit=DEFAULT_MODEL_CONCURRENCY,
+                 queue_size=ADMISSION_QUEUE_SIZE, timeout=ADMISSION_TIMEOUT_SECONDS):
+        if limits is None:
+            limits = {model: int(limit) for model, limit in parse_model_map(MODEL_CONCURRENCY).items()}
+        self.limits = limits
+        self.default_limit = default_limit
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self._gates: Dict[str, _ModelGate] = {}
+        self._sequence = itertools.count()
+
+    def _gate(self, model: str) -> _ModelGate:
+        gate = self._gates.get(model)
+        if gate is None:
+            gate = self._gates[model] = _ModelGate(max(1, self.limits.get(model, self.default_limit)))
+        return gate
+
+    def retry_after(self, model: str) -> int:
+        """Seconds until a new request of `model` would probably get a slot."""
+        gate = self._gate(model)
+        rounds = (gate.queued() + 1) / gate.limit
+        return max(1, min(300, math.ceil(rounds * gate.service_seconds)))
+
+    def _reject(self, model: str, gate: _ModelGate, reason: str) -> AdmissionRejected:
+        logger.warning(f"Rejected a request for {model}: {reason} (active {gate.active}, queued {gate.queued()}).")
+        return AdmissionRejected(model, reason, self.retry_after(model))
+
+    async def acquire(self, model: str, priority: int = INTERACTIVE) -> AdmissionSlot:
+        """Wait for a slot of `model`; raises AdmissionRejected if the queue is full or the wait times out."""
+        gate = self._gate(model)
+        if gate.active < gate.limit and not gate.queued():
+            gate.active += 1
+            gate.admitted += 1
+            return AdmissionSlot(self, gate)
+
+        if gate.queued() >= self.queue_size:
+            gate.rejected += 1
+            raise self._reject(model, gate, "queue is full")
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(gate.waiters, (priority, next(self._sequence), future))
+        waited = time.monotonic()
+        try:
+            await asyncio.wait_for(future, self.timeout)
+        except asyncio.TimeoutError:
+            if future.done() and not future.cancelled():
+                self._release(gate, 0.0)  # the slot was handed over while the timeout fired
+            gate.timed_out += 1
+            raise self._reject(model, gate, f"no slot within {self.timeout:.0f}s")
+        except BaseException:
+            # Cancelled (client gone) right after a slot was handed over: give it back
+            if future.done() and not future.cancelled():
+                self._release(gate, 0.0)
+            raise
+        gate.wait_seconds_max = max(gate.wait_seconds_max, time.monotonic() - waited)
+        gate.admitted += 1
+        return AdmissionSlot(self, gate)
+
+    def _release(self, gate: _ModelGate, held_seconds: float) -> None:
+        if held_seconds:
+            gate.service_seconds = 0.8 * gate.service_seconds + 0.2 * held_seconds
+        # Hand the slot directly to the next waiter, so a new arrival cannot take it in between
+        while gate.waiters:
+            _, _, future = heapq.heappop(gate.waiters)
+            if not future.done():
+                future.set_result(None)
+                return
+        gate.active -= 1
+
+    def stats(self) -> dict:
+        return {
+            model: {
+                "limit": gate.limit,
+                "active": gate.active,
+                "queue_depth": gate.queued(),
+                "admitted": gate.admitted,
+                "rejected": gate.rejected,
+                "timed_out": gate.timed_out,
+                "max_wait_seconds": round(gate.wait_seconds_max, 2),
+                "avg_generation_seconds": round(gate.service_seconds, 2),
+                "retry_after": self.retry_after(model),
+            }
+            for model, gate in self._gates.items()
+        }
+
+
+_admission: Optional[AdmissionController] = None
+
+
+def get_admission() -> AdmissionController:
+    """Process-wide admission controller; with several API workers every worker has its own slots."""
+    global _admission
+    if _admission is None:
+        _admission = AdmissionController()
+    return _admission
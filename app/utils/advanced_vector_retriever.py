@@ -1,6 +1,4 @@
-from langchain_community.retrievers import BM25Retriever
-from langchain.retrievers import EnsembleRetriever
-from app.utils.docu_manager import AdvancedDocumentManager
+from app.utils.parent_store import ParentIndexStore
 
 class AdvancedVectorRetriever:
     def __init__(self, top_k=5):
@@ -14,10 +12,12 @@ class AdvancedVectorRetriever:
         """
         #self.vectordb = vectordb
         self.top_k = top_k
-        document_manager = AdvancedDocumentManager(directory_path = "app/files/")#DocumentManager(directory_path = "app/files/")
-
-        document_manager.load_documents()
-        self.parent_retriever = document_manager.create_parent_retriever(use_postgres=True, emd_model='bge-m3')
+        # Reattach to the persisted parent index instead of re-adding every document
+        parent_store = ParentIndexStore(source_dir="app/files/", embedding_model='bge-m3')
+        vectordb = parent_store.load_or_build()
+        self.parent_retriever = parent_store.as_retriever(vectordb, hybrid=False)
+        # Dense + persisted BM25 index over the same child chunks, fused in one pass
+        self.hybrid_retriever = parent_store.as_retriever(vectordb, hybrid=True, k=self.top_k)
         #self.documents = AdvancedDocumentManager.create_parent_retriever(use_postgres=True)
 
     def retrieve_documents(self, query):#search_type="similarity"):
@@ -40,18 +40,18 @@ class AdvancedVectorRetriever:
 
         Args:
             query (str): The input query to search for.
-            weights (dict): Weights for different retrieval strategies 
-                            (e.g., {"text": 0.7, "embedding": 0.3}).
+            weights (list): Weights of the dense and the keyword (BM25) ranking in the fusion
+                            (e.g., [0.7, 0.3]). Default: the configured weights.
 
         Returns:
             A list of hybrid search results.
         """
-        if weights is None:
-            weights = [0.5, 0.5]
-        # Implement advanced search logic here
-        parent_docs = self.retrieve_documents(query)
-        keyword_retriever = BM25Retriever.from_documents(parent_docs, search_type={"k":self.top_k})
-
-        ensemble_retriever = EnsembleRetriever(retrievers=[self.parent_retriever, keyword_retriever], weights=weights)  
-        compressed_docs = ensemble_retriever.invoke(query)
-        return compressed_docs
\ No newline at end of file
+        retriever = self.hybrid_retriever
+        if weights is not None:
+            retriever = retriever.model_copy(update={"dense_weight": weights[0], "sparse_weight": weights[1]})
+        # One dense search and one lookup in the corpus-wide BM25 index, fused with reciprocal-rank fusion
+        return retriever.invoke(query)
+
+    def query_hybrid_index(self, query_text, top_k=4):
+        """Hybrid search with `top_k` results, usable as hybrid_manager of FAISSChromaManager/HybridChainManager."""
+        return self.hybrid_retriever.query_hybrid_index(query_text, top_k)
\ No newline at end of file
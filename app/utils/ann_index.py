@@ -0,0 +1,205 @@
+# app/utils/ann_index.py
+import logging
+import math
+import time
+from typing import Dict, List, Optional, Tuple
+
+import faiss
+import numpy as np
+
+from app.utils.quantized_index import STORAGE_CODECS, STORAGE_TYPES, RescoringIndex, binarize
+from app.utils.settings import (ANN_AUTO_FLAT_BELOW, ANN_AUTO_HNSW_BELOW, ANN_HNSW_EF_CONSTRUCTION, ANN_HNSW_M,
+                                ANN_NLIST, ANN_PQ_M, ANN_SEARCH_PARAMS, ANN_TRAIN_SAMPLE)
+
+logger = logging.getLogger(__name__)
+
+#-----------------------------------------------------------------------------------------------------------#
+#   CPU ANN index factory.                                                                                  #
+#                                                                                                           #
+#   flat      exact scan, no training                      (small corpora, ground truth for tuning)        #
+#   hnsw      graph, no training, efSearch at query time   (up to ~1M vectors, fastest at high recall)      #
+#   ivf_flat  k-means lists, nprobe at query time          (large corpora, full vectors)                    #
+#   ivf_pq    k-means lists + product quantization         (millions of vectors, ~ANN_PQ_M bytes/vector)    #
+#   auto      flat below ANN_AUTO_FLAT_BELOW, hnsw below ANN_AUTO_HNSW_BELOW, ivf_pq above                  #
+#                                                                                                           #
+#   The ANN index is always derived from an exact IndexFlatL2 holding the same vectors in the same order,   #
+#   so positions (and LangChain's index_to_docstore_id) are identical. IVF is trained on a random sample    #
+#   of ANN_TRAIN_SAMPLE vectors. Nothing here uses the GPU, it stays free for the LLM.                     #
+#                                                                                                           #
+#   The storage (float32, float16, int8, binary) picks the codec of flat/hnsw/ivf_flat, see                 #
+#   quantized_index.py; binary builds faiss' binary indexes (BFlat, BHNSW, BIVF) over the sign bits.        #
+#-----------------------------------------------------------------------------------------------------------#
+
+INDEX_TYPES = ("flat", "hnsw", "ivf_flat", "ivf_pq")
+
+# Query-time parameter swept by the tuner and the values tried
+SEARCH_PARAMETER = {"hnsw": "efSearch", "ivf_flat": "nprobe", "ivf_pq": "nprobe"}
+SWEEP_VALUES = {
+    "hnsw": [16, 24, 32, 48, 64, 96, 128, 192, 256, 384, 512],
+    "ivf_flat": [1, 2, 4, 8, 12, 16, 24, 32, 48, 64, 96, 128, 192, 256],
+    "ivf_pq": [1, 2, 4, 8, 12, 16, 24, 32, 48, 64, 96, 128, 192, 256],
+}
+
+# Query-time parameters until the tuner wrote better ones (ANN_SEARCH_PARAMS overrides them)
+DEFAULT_SEARCH_PARAMS = {"hnsw": "efSearch=64", "ivf_flat": "nprobe=16", "ivf_pq": "nprobe=32"}
+
+# Vectors added to an ANN index per call
+ADD_BLOCK = 65536
+
+
+def resolve_index_type(index_type: str, n_vectors: int) -> str:
+    if index_type == "auto":
+        if n_vectors < ANN_AUTO_FLAT_BELOW:
+            return "flat"
+        return "hnsw" if n_vectors < ANN_AUTO_HNSW_BELOW else "ivf_pq"
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown ANN index type '{index_type}', expected one of {INDEX_TYPES} or 'auto'.")
+    return index_type
+
+
+def default_nlist(n_vectors: int) -> int:
+    """About 4 * sqrt(n) lists, with at least 39 training points per list (faiss warns below that)."""
+    return max(1, min(int(4 * math.sqrt(n_vectors)), n_vectors // 39))
+
+
+def default_pq_m(dimension: int) -> int:
+    """Largest number of sub-quantizers <= dimension / 16 that divides the dimension (1024 -> 64 bytes)."""
+    for m in range(max(dimension // 16, 1), 0, -1):
+        if dimension % m == 0:
+            return m
+    return 1
+
+
+def factory_string(index_type: str, dimension: int, n_vectors: int, storage: str = "float32") -> str:
+    if storage not in STORAGE_TYPES:
+        raise ValueError(f"Unknown vector storage '{storage}', expected one of {STORAGE_TYPES}.")
+    if storage == "binary":
+        # Binary indexes have no PQ variant, ivf_pq uses the plain binary IVF
+        if index_type == "flat":
+            return "BFlat"
+        if index_type == "hnsw":
+            return f"BHNSW{ANN_HNSW_M}"
+        return f"BIVF{ANN_NLIST or default_nlist(n_vectors)}"
+    codec = STORAGE_CODECS[storage]
+    if index_type == "flat":
+        return codec
+    if index_type == "hnsw":
+        return f"HNSW{ANN_HNSW_M},{codec}"
+    nlist = ANN_NLIST or default_nlist(n_vectors)
+    if index_type == "ivf_flat":
+        return f"IVF{nlist},{codec}"
+    m = ANN_PQ_M or default_pq_m(dimension)
+    if dimension % m:
+        raise ValueError(f"ANN_PQ_M={m} does not divide the embedding dimension {dimension}.")
+    return f"IVF{nlist},PQ{m}x8"
+
+
+def flat_vectors(index: faiss.Index) -> np.ndarray:
+    """
+    (ntotal, d) float32 view of the vectors of a flat index, without a copy when possible.
+    The view does not own its memory: it is only valid while `index` is alive.
+    """
+    if index.ntotal == 0:
+        return np.zeros((0, index.d), dtype=np.float32)
+    try:
+        return faiss.rev_swig_ptr(faiss.downcast_index(index).get_xb(), index.ntotal * index.d).reshape(index.ntotal, index.d)
+    except AttributeError:
+        return index.reconstruct_n(0, index.ntotal)
+
+
+def build_ann_index(flat: faiss.Index, index_type: str, storage: str = "float32") -> Tuple[faiss.Index, dict]:
+    """
+    Build the ANN index of `index_type` with `storage` over the vectors of `flat`; returns (index, description).
+    description["rescore"] tells whether its distances are approximate and need the exact rescoring.
+    """
+    n, dimension = flat.ntotal, flat.d
+    index_type = resolve_index_type(index_type, n)
+    if index_type in ("ivf_flat", "ivf_pq") and n < max(256, 39 * (ANN_NLIST or 1)):
+        logger.info(f"Only {n} vectors, too few to train {index_type}; using a flat index.")
+        index_type = "flat"
+    description = {"type": index_type, "factory": factory_string(index_type, dimension, n, storage),
+                   "storage": storage, "rescore": storage != "float32" or index_type == "ivf_pq", "num_vectors": n}
+    if description["factory"] == "Flat":
+        return flat, description
+
+    started = time.perf_counter()
+    vectors = flat_vectors(flat)
+    encode = binarize if storage == "binary" else np.ascontiguousarray
+    if storage == "binary":
+        index = faiss.index_binary_factory(dimension, description["factory"])
+    else:
+        index = faiss.index_factory(dimension, description["factory"], faiss.METRIC_L2)
+    if index_type == "hnsw":
+        hnsw_index = index if storage == "binary" else faiss.downcast_index(index)
+        hnsw_index.hnsw.efConstruction = ANN_HNSW_EF_CONSTRUCTION
+    if not index.is_trained:
+        sample = vectors
+        if n > ANN_TRAIN_SAMPLE:
+            positions = np.sort(np.random.default_rng(0).choice(n, ANN_TRAIN_SAMPLE, replace=False))
+            sample = vectors[positions]
+        index.train(encode(sample))
+        description["trained_on"] = len(sample)
+    for start in range(0, n, ADD_BLOCK):
+        index.add(encode(vectors[start:start + ADD_BLOCK]))
+    description["build_seconds"] = round(time.perf_counter() - started, 2)
+    logger.info(f"Built {description['factory']} over {n} vectors in {description['build_seconds']}s.")
+    return index, description
+
+
+def default_search_params(index_type: str) -> str:
+    parameter = SEARCH_PARAMETER.get(index_type)
+    if parameter is None:
+        return ""
+    return ANN_SEARCH_PARAMS if ANN_SEARCH_PARAMS.startswith(parameter) else DEFAULT_SEARCH_PARAMS[index_type]
+
+
+def set_search_params(index, params: Optional[str]) -> None:
+    """Apply query-time parameters like "nprobe=16" or "efSearch=64" (ignored for a flat index)."""
+    if isinstance(index, RescoringIndex):
+        index = index.coarse
+    if not params:
+        return
+    if isinstance(index, faiss.IndexBinary):
+        # ParameterSpace only knows float indexes
+        for param in params.split(","):
+            name, value = param.split("=")
+            setattr(index.hnsw if name == "efSearch" else index, name, int(value))
+    else:
+        faiss.ParameterSpace().set_index_parameters(index, params)
+
+
+def sweep(index_type: str, index) -> List[str]:
+    """Parameter settings the tuner tries for `index`, cheapest first."""
+    parameter = SEARCH_PARAMETER.get(index_type)
+    if parameter is None:
+        return [""]
+    if isinstance(index, RescoringIndex):
+        index = index.coarse
+    values = SWEEP_VALUES[index_type]
+    if parameter == "nprobe":
+        nlist = index.nlist if isinstance(index, faiss.IndexBinary) else faiss.extract_index_ivf(index).nlist
+        values = [value for value in values if value <= nlist]
+    return [f"{parameter}={value}" for value in values]
+
+
+def exact_neighbors(flat: faiss.Index, queries: np.ndarray, k: int) -> np.ndarray:
+    _, indices = flat.search(queries, k)
+    return indices
+
+
+def evaluate(index, params: str, queries: np.ndarray, truth: np.ndarray, k: int) -> Dict[str, float]:
+    """recall@k against `truth` and the single-query latency of `index` with `params`."""
+    set_search_params(index, params)
+    latencies, found = [], 0
+    for query, expected in zip(queries, truth):
+        started = time.perf_counter()
+        _, indices = index.search(query.reshape(1, -1), k)
+        latencies.append(time.perf_counter() - started)
+        found += len(set(indices[0].tolist()) & set(expected[expected >= 0].tolist()))
+    latencies.sort()
+    return {
+        "params": params,
+        "recall": round(found / (len(queries) * k), 4),
+        "latency_ms_p50": round(1000 * latencies[len(latencies) // 2], 3),
+        "latency_ms_p95": round(1000 * latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))], 3),
+    }
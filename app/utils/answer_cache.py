@@ -0,0 +1,161 @@
+# app/utils/answer_cache.py
+import logging
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Dict, FrozenSet, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+
+from app.utils.settings import ANSWER_CACHE_MAX_ENTRIES, ANSWER_CACHE_THRESHOLD, ANSWER_CACHE_TTL_SECONDS
+
+logger = logging.getLogger(__name__)
+
+#-----------------------------------------------------------------------------------------------------------#
+#   Semantic answer cache.                                                                                  #
+#                                                                                                           #
+#   Answers are keyed by (model, index version) and looked up by the cosine similarity of the embedding    #
+#   of the standalone (rewritten) question, so "Wie viele Urlaubstage habe ich?" and "Wieviele Urlaubstage  #
+#   habe ich" share one answer while the history still decides what a follow-up question means.           #
+#                                                                                                           #
+#   Every entry remembers the doc_ids of the documents it was answered from. When a new index version is   #
+#   published, `rebase` carries over the entries whose documents are unchanged and drops the others.       #
+#-----------------------------------------------------------------------------------------------------------#
+
+
+def document_sources(documents: Iterable[Document]) -> FrozenSet[str]:
+    """doc_ids (or source paths for documents without one) an answer was generated from."""
+    return frozenset(str(doc.metadata.get("doc_id") or doc.metadata.get("source")) for doc in documents
+                     if doc.metadata.get("doc_id") or doc.metadata.get("source"))
+
+
+@dataclass
+class CachedAnswer:
+    question: str
+    answer: str
+    sources: FrozenSet[str]
+    created: float = field(default_factory=time.time)
+    hits: int = 0
+
+
+class _Bucket:
+    """Entries of one (model, version) with their unit-length question vectors as one matrix."""
+
+    def __init__(self):
+        self.entries: List[CachedAnswer] = []
+        self.vectors: List[np.ndarray] = []
+        self._matrix: Optional[np.ndarray] = None
+
+    def matrix(self) -> np.ndarray:
+        if self._matrix is None:
+            self._matrix = np.vstack(self.vectors)
+        return self._matrix
+
+    def add(self, entry: CachedAnswer, vector: np.ndarray) -> None:
+        self.entries.append(entry)
+        self.vectors.append(vector)
+        self._matrix = None
+
+    def keep(self, indices: Sequence[int]) -> None:
+        self.entries = [self.entries[i] for i in indices]
+        self.vectors = [self.vectors[i] for i in indices]
+        self._matrix = None
+
+
+class AnswerCache:
+    """In-process semantic cache of final answers."""
+
+    def __init__(self, threshold=ANSWER_CACHE_THRESHOLD, ttl=ANSWER_CACHE_TTL_SECONDS, max_entries=ANSWER_CACHE_MAX_ENTRIES):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._buckets: Dict[Tuple[str, Optional[str]], _Bucket] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidated = 0
+
+    @staticmethod
+    def _normalize(vector) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32).reshape(-1)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _expired(self, entry: CachedAnswer, now: float) -> bool:
+        return self.ttl > 0 and now - entry.created > self.ttl
+
+    def _size(self) -> int:
+        return sum(len(bucket.entries) for bucket in self._buckets.values())
+
+    def _prune(self, bucket: _Bucket, now: float) -> None:
+        if any(self._expired(entry, now) for entry in bucket.entries):
+            bucket.keep([i for i, entry in enumerate(bucket.entries) if not self._expired(entry, now)])
+
+    def lookup(self, model: str, version: Optional[str], vector) -> Optional[CachedAnswer]:
+        """Return the cached answer of the most similar question above the threshold, if any."""
+        query = self._normalize(vector)
+        with self._lock:
+            bucket = self._buckets.get((model, version))
+            if bucket is not None:
+                self._prune(bucket, time.time())
+            if not bucket or not bucket.entries:
+                self.misses += 1
+                return None
+            scores = bucket.matrix() @ query
+            best = int(np.argmax(scores))
+            if scores[best] < self.threshold:
+                self.misses += 1
+                return None
+            entry = bucket.entries[best]
+            entry.hits += 1
+            self.hits += 1
+            return entry
+
+    def put(self, model: str, version: Optional[str], vector, question: str, answer: str, sources: FrozenSet[str]) -> None:
+        if not answer:
+            return
+        with self._lock:
+            bucket = self._buckets.setdefault((model, version), _Bucket())
+            bucket.add(CachedAnswer(question=question, answer=answer, sources=sources), self._normalize(vector))
+            # Evict the oldest entries across all buckets once the cache is full
+            while self._size() > self.max_entries:
+                _, key, index = min((entry.created, key, i) for key, b in self._buckets.items()
+                                    for i, entry in enumerate(b.entries))
+                old = self._buckets[key]
+                old.keep([i for i in range(len(old.entries)) if i != index])
+
+    def rebase(self, version: Optional[str], valid_sources: Iterable[str]) -> None:
+        """
+        Move the cache to a new index version: entries whose documents all still exist unchanged
+        are kept, entries built from changed or removed documents (or from no document) are dropped.
+        """
+        valid_sources = set(valid_sources)
+        with self._lock:
+            rebased: Dict[Tuple[str, Optional[str]], _Bucket] = {}
+            for (model, _), bucket in self._buckets.items():
+                target = rebased.setdefault((model, version), _Bucket())
+                for entry, vector in zip(bucket.entries, bucket.vectors):
+                    if entry.sources and entry.sources <= valid_sources:
+                        target.add(entry, vector)
+                    else:
+                        self.invalidated += 1
+            self._buckets = rebased
+        logger.info(f"Answer cache rebased to index version {version}, {self.invalidated} entries invalidated so far.")
+
+    def clear(self) -> None:
+        with self._lock:
+            self._buckets.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": self._size(),
+            "max_entries": self.max_entries,
+            "threshold": self.threshold,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidated": self.invalidated,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+        }
@@ -1,18 +1,26 @@
-from typing import AsyncIterable
-from langchain.chains import create_history_aware_retriever, create_retrieval_chain
+from operator import itemgetter
+from typing import AsyncIterable, Optional
 from langchain.chains.combine_documents import create_stuff_documents_chain
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain_ollama import OllamaLLM, ChatOllama
 from langchain_core.runnables.history import RunnableWithMessageHistory
-from langchain_community.chat_message_histories import ChatMessageHistory
 from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.runnables import RunnableLambda, RunnablePassthrough
 from langchain_community.retrievers import BM25Retriever
 from langchain.retrievers import EnsembleRetriever
 import logging
 from fastapi import Depends
 from sqlalchemy.orm import Session
 from app.models.models import ChatHistory
-from app.database.config import get_db
+from app.database.config import get_db, AsyncSessionLocal
+from app.crud.chat_crud import aget_session_turns
+from app.utils.session_cache import SessionHistoryCache, history_from_turns
+from app.utils.context_packer import ContextPacker
+from app.utils.answer_cache import AnswerCache, document_sources
+from app.utils.embedding_cache import get_embeddings
+from app.utils.model_manager import get_keep_alive, get_model_manager
+from app.utils.query_rewriter import QueryRewriter
+from app.utils.settings import HISTORY_SUMMARY_ENABLED, REWRITE_MODEL
 from app.database.helper_insert_update_chathistory import insert_user_question, update_assistant_answer
 from app.models.models import ChatHistory
 from app.utils.advanced_vector_retriever import AdvancedVectorRetriever
@@ -22,16 +30,34 @@ callback_manager = CallbackManager([StreamingStdOutCallbackHandler()])
 
 class ConversationalChainManager:
 
-    def __init__(self, llm_name = 'llama3.1:8b') -> None:
+    def __init__(self, llm_name = 'llama3.1:8b', store = None, answer_cache: Optional[AnswerCache] = None, index_version = None) -> None:
         #self.vectordb = vectordb
         self.base_url = 'http://ollama-container:11434'
         ## this for windows use anytherway to linux
         self.llm_name = llm_name
         #mode_name = "deepseek-r1:32b" or "llama3.1:8b"
-        self.llm_chat = ChatOllama(model=self.llm_name, base_url=self.base_url)# 
-        self.llm = OllamaLLM(model=self.llm_name, base_url=self.base_url)
-        self.store = {} ## Statefully manage ChatHistory
+        # Prompt packing for this model; num_ctx is set explicitly so Ollama never truncates the prompt silently
+        self.packer = ContextPacker(self.llm_name,
+                                    summarize=self.summarize_history if HISTORY_SUMMARY_ENABLED else None,
+                                    asummarize=self.asummarize_history if HISTORY_SUMMARY_ENABLED else None)
+        self.prompt_tokens = 0
+        # keep_alive on every request, otherwise Ollama unloads the model after 5 idle minutes
+        self.llm_chat = ChatOllama(model=self.llm_name, base_url=self.base_url, num_ctx=self.packer.context_window,
+                                   keep_alive=get_keep_alive(self.llm_name))# 
+        self.llm = OllamaLLM(model=self.llm_name, base_url=self.base_url, num_ctx=self.packer.context_window,
+                             keep_alive=get_keep_alive(self.llm_name))
+        # Question rewrites only need a small model; temperature 0 so cached rewrites match fresh ones
+        self.rewrite_model = REWRITE_MODEL or self.llm_name
+        self.rewrite_llm = OllamaLLM(model=self.rewrite_model, base_url=self.base_url, temperature=0,
+                                     num_ctx=self.packer.context_window, keep_alive=get_keep_alive(self.rewrite_model))
+        self.store = store if store is not None else SessionHistoryCache() ## Bounded ChatHistory cache, may be shared between managers
         self.conversation_chain = None
+        self.rewrite_chain = None
+        self.rewriter = None
+        # Semantic answer cache shared by the registry, keyed by model and index version (None = disabled)
+        self.answer_cache = answer_cache
+        self.index_version = index_version
+        self.embeddings = get_embeddings() if answer_cache is not None else None
         # self.retriever = self.vectordb.as_retriever(search_type = "similarity", search_kwargs={"k":4, 'fetch_k': 100, 'lambda_mult':1})
 
     # def get_session_history(self, session_id: str) -> BaseChatMessageHistory:
@@ -61,32 +87,55 @@ class ConversationalChainManager:
     #         logging.info(f"Updated history for session {session_id} with user message: {user_message} and bot response: {bot_response}")
 
     def load_session_history(self, session_id, )->BaseChatMessageHistory:
-        chat_history  = ChatMessageHistory()
+        """Load the most recent turns of a session (at most store.max_turns) from chat_history."""
         db = next(get_db())
         try:
-
-            session = db.query(ChatHistory).filter(ChatHistory.session_id == session_id).all()
-            if session:
-                for record in session:
-                    if record.question:
-                        chat_history.add_user_message(record.question)
-                    if record.response:    
-                        chat_history.add_ai_message(record.response)
-            return chat_history
+            records = (db.query(ChatHistory)
+                         .filter(ChatHistory.session_id == session_id)
+                         .order_by(ChatHistory.id.desc())
+                         .limit(self.store.max_turns)
+                         .all())
+            return history_from_turns(reversed(records), self.store.max_turns)
         except Exception as e:  
             print(f"An unexpected error occurred: {e}")
-            return {}
+            return self.store.new_history()
+        finally:
+            db.close()
 
     def get_session_history(self, session_id:str) -> BaseChatMessageHistory:
-        if session_id not in self.store:
-            self.store[session_id] = self.load_session_history(session_id)
+        history = self.store.get(session_id)
+        if history is None:
+            history = self.load_session_history(session_id)
+            self.store[session_id] = history
 
-        return self.store[session_id]
+        return history
 
+    async def aload_session_history(self, session_id: str) -> BaseChatMessageHistory:
+        """Async version of load_session_history, reads the turns through the async engine."""
+        async with AsyncSessionLocal() as db:
+            records = await aget_session_turns(db, session_id, limit=self.store.max_turns)
+        return history_from_turns(records, self.store.max_turns)
 
-    def get_retriever_chain(self, retriever): #search_type="similarity"):
+    async def aget_session_history(self, session_id: str, refresh: bool = False) -> BaseChatMessageHistory:
         """
-        Get a history-aware retriever chain for searching relevant documents
+        Make sure the history of `session_id` is cached before the chain runs.
+        RunnableWithMessageHistory calls get_session_history synchronously, so without this the
+        first request of a session would query Postgres on the event loop.
+        `refresh` (once per request, before the question is stored) reloads a cached history when
+        `store.revalidate` is set, because another worker may have added turns to the session.
+        """
+        history = None if refresh and self.store.revalidate else self.store.get(session_id)
+        if history is None:
+            history = await self.aload_session_history(session_id)
+            self.store[session_id] = history
+
+        return history
+
+
+    def get_rewrite_chain(self):
+        """
+        Get the chain that turns the latest question into a standalone question using the chat history.
+        First turns and questions that look self-contained are returned as is, other rewrites are cached.
         """
         #retriever_instance = AdvancedVectorRetriever(self.vectordb)
         #retriever = retriever_instance.retrieve_documents(search_type=search_type)
@@ -109,12 +158,20 @@ class ConversationalChainManager:
         ])
        #print("prompt_search_query: ", prompt_search_query[0])
 
+        # sends a prompts to the rewrite llm with the chat_histroy and user input to generate a search query for the retriever
+        self.rewriter = QueryRewriter(self.rewrite_llm, prompt_search_query, self.rewrite_model)
+        self.rewrite_chain = RunnableLambda(self.rewriter.rewrite, afunc=self.rewriter.arewrite).with_config(run_name="rewrite_question")
+        return self.rewrite_chain
+
+    def get_retriever_chain(self, retriever): #search_type="similarity"):
+        """
+        Get a history-aware retriever chain for searching relevant documents
+        """
         # Create a history-aware retriever chain
-        # sends a prompts to the llm with the chat_histroy and user input to generate a search query for the retriever
         # The retreiver_chain use search query to get the relevant document from faiss(vectrorstrore) 
         # that are revelent to the user query and chat history
-        history_aware_retriever  = create_history_aware_retriever(self.llm, retriever, prompt_search_query)
-        return history_aware_retriever 
+        history_aware_retriever = (self.get_rewrite_chain() | retriever).with_config(run_name="chat_retriever_chain")
+        return history_aware_retriever
     
     def get_retrieved_documents_chain(self):
         """
@@ -132,6 +189,8 @@ class ConversationalChainManager:
         At the end give always the header or title or source of your answer\
         {context}
         """
+        # Tokens of the prompt without the documents, the rest of the window is shared by history, question and context
+        self.prompt_tokens = self.packer.count(system_prompt.replace("{context}", ""))
         # Create a Prompt for the final response generation using retrieved documents
         # It contains the context(retrieved document from vector store), chat histroy and userinput.
         qa_prompt  = ChatPromptTemplate.from_messages([
@@ -149,11 +208,20 @@ class ConversationalChainManager:
         Build the complete conversation chain by integrating the retriever and document chains
         """
         # Call Above functions
-        history_aware_retriever = self.get_retriever_chain(retriever)
+        self.get_rewrite_chain()
         question_answer_chain = self.get_retrieved_documents_chain()
 
         # Create a conversation chain that integrates the retriever and document chains
-        chain = create_retrieval_chain(history_aware_retriever, question_answer_chain)
+        # Same steps as create_retrieval_chain, but the history is trimmed to its token budget before the
+        # rewrite and the retrieved documents are packed into what is left of the context window.
+        # The standalone question is a separate step so callers that already rewrote it (answer cache) can pass it in.
+        chain = (
+            RunnablePassthrough.assign(chat_history=RunnableLambda(self._pack_history, afunc=self._apack_history))
+            .assign(standalone_question=RunnableLambda(self._standalone_question, afunc=self._astandalone_question))
+            .assign(context=(itemgetter("standalone_question") | retriever).with_config(run_name="retrieve_documents"))
+            .assign(context=RunnableLambda(self._pack_context))
+            .assign(answer=question_answer_chain)
+        ).with_config(run_name="retrieval_chain")
         
         # Integrate the conversation chain with session Management for history handling
 
@@ -166,6 +234,38 @@ class ConversationalChainManager:
         )
         return self.conversation_chain
 
+    def _pack_history(self, inputs: dict):
+        return self.packer.pack_history(inputs.get("chat_history", []))
+
+    async def _apack_history(self, inputs: dict):
+        return await self.packer.apack_history(inputs.get("chat_history", []))
+
+    def _standalone_question(self, inputs: dict) -> str:
+        return inputs.get("standalone_question") or self.rewrite_chain.invoke(inputs)
+
+    async def _astandalone_question(self, inputs: dict) -> str:
+        return inputs.get("standalone_question") or await self.rewrite_chain.ainvoke(inputs)
+
+    def _pack_context(self, inputs: dict):
+        used = (self.prompt_tokens
+                + self.packer.count_messages(inputs.get("chat_history", []))
+                + self.packer.count(inputs["input"]))
+        return self.packer.pack_documents(inputs["context"], self.packer.document_budget(used))
+
+    def _summary_prompt(self, messages) -> str:
+        formatted_history = "\n".join(
+            [f"Human: {msg.content}" if msg.type == "human" else f"AI: {msg.content}" for msg in messages]
+        )
+        return ("Summarize the following conversation in a few sentences. Keep names, numbers and open questions, "
+                f"answer in the language of the conversation.\n\n{formatted_history}\n\nSummary:")
+
+    def summarize_history(self, messages) -> str:
+        """Summary of the turns that no longer fit the history budget (cached by the packer)."""
+        return self.llm.invoke(self._summary_prompt(messages))
+
+    async def asummarize_history(self, messages) -> str:
+        return await self.llm.ainvoke(self._summary_prompt(messages))
+
     def process_user_query(self, session_id: str, user_query: str) -> str:
         """
             Process a user query and stream the bot's response token-by-token.
@@ -197,6 +297,109 @@ class ConversationalChainManager:
 
         return bot_response
     
+    async def alookup_cached_answer(self, session_id: str, inputs: dict, rewrite: bool = True):
+        """
+            Rewrite the question and look it up in the answer cache.
+            Returns (cached answer or None, question vector). The standalone question is stored in `inputs`
+            so the chain does not rewrite it a second time on a miss.
+            With `rewrite=False` (no generation slot held yet) a question that needs the rewrite LLM is not
+            looked up and (None, None) is returned; `lookup_deferred` tells the caller to look it up later.
+        """
+        if self.answer_cache is None:
+            return None, None
+        history = await self.aget_session_history(session_id)
+        chat_history = await self.packer.apack_history(history.messages)
+        rewrite_inputs = {"input": inputs["input"], "chat_history": chat_history}
+        standalone = self.rewriter.cached(rewrite_inputs)
+        if standalone is None:
+            if not rewrite:
+                return None, None
+            standalone = await self.rewrite_chain.ainvoke(rewrite_inputs)
+        inputs["standalone_question"] = standalone
+        vector = (await self.embeddings.aembed_array([standalone]))[0]
+        return self.answer_cache.lookup(self.llm_name, self.index_version, vector), vector
+
+    def lookup_deferred(self, vector) -> bool:
+        return self.answer_cache is not None and vector is None
+
+    async def aprepare_query(self, session_id: str, user_query: str, refresh: bool = True):
+        """
+            Load the history and look the question up in the answer cache, so a caller can decide whether a
+            generation slot is needed. Returns (inputs, cached answer or None, question vector).
+            Called at the start of a request, before the question is stored (see `aget_session_history`).
+            Nothing is generated here: a question that needs the rewrite LLM is looked up once the caller
+            holds a slot, by aprocess_user_query / astream_user_query.
+        """
+        await self.aget_session_history(session_id, refresh=refresh)
+        inputs = {"input": user_query}
+        cached, vector = await self.alookup_cached_answer(session_id, inputs, rewrite=False)
+        return inputs, cached, vector
+
+    def remember_answer(self, vector, inputs: dict, answer: str, context) -> None:
+        if self.answer_cache is not None and vector is not None:
+            self.answer_cache.put(self.llm_name, self.index_version, vector,
+                                  inputs.get("standalone_question", inputs["input"]), answer, document_sources(context or []))
+
+    async def aprocess_user_query(self, session_id: str, user_query: str, meta: Optional[dict] = None,
+                                  prepared: Optional[tuple] = None) -> str:
+        """
+            Async version of process_user_query: history, retrieval and generation never block the event loop.
+            `meta["cached"]` tells whether the answer came from the answer cache.
+            `prepared` is the result of `aprepare_query` if the caller already looked the question up.
+        """
+        logging.info(f"Processing user query for session {session_id}: {user_query}")
+        meta = meta if meta is not None else {}
+        inputs, cached, vector = prepared or await self.aprepare_query(session_id, user_query, refresh=False)
+        if self.lookup_deferred(vector):
+            cached, vector = await self.alookup_cached_answer(session_id, inputs)
+        meta["cached"] = cached is not None
+        if cached is not None:
+            self.store.append_turn(session_id, user_query, cached.answer)
+            return cached.answer
+
+        # The generation slot is only taken for a real generation, cached answers never wait for a model
+        async with get_model_manager().use(self.llm_name):
+            response = await self.conversation_chain.ainvoke(
+                inputs,
+                config={"configurable": {"session_id": session_id}})
+        self.remember_answer(vector, inputs, response["answer"], response.get("context"))
+        return response["answer"]
+
+    async def astream_user_query(self, session_id: str, user_query: str, meta: Optional[dict] = None,
+                                 prepared: Optional[tuple] = None) -> AsyncIterable[str]:
+        """
+            Stream the answer tokens of a user query. Closing the generator closes the request to Ollama,
+            which stops the generation. A cached answer is yielded as one piece and sets `meta["cached"]`.
+            `prepared` is the result of `aprepare_query` if the caller already looked the question up.
+        """
+        meta = meta if meta is not None else {}
+        inputs, cached, vector = prepared or await self.aprepare_query(session_id, user_query, refresh=False)
+        if self.lookup_deferred(vector):
+            cached, vector = await self.alookup_cached_answer(session_id, inputs)
+        meta["cached"] = cached is not None
+        if cached is not None:
+            self.store.append_turn(session_id, user_query, cached.answer)
+            yield cached.answer
+            return
+
+        answer_parts, context = [], None
+        async with get_model_manager().use(self.llm_name):
+            stream = self.conversation_chain.astream(
+                inputs,
+                config={"configurable": {"session_id": session_id}})
+            try:
+                async for chunk in stream:
+                    if "context" in chunk:
+                        context = chunk["context"]
+                    token = chunk.get("answer")
+                    if isinstance(token, str) and token:
+                        answer_parts.append(token)
+                        yield token
+            finally:
+                await stream.aclose()
+        # Only complete answers are cached, a cancelled stream never gets here
+        self.remember_answer(vector, inputs, "".join(answer_parts), context)
+
     def rewrite_query(self, session_id: str, user_query: str):
         """
         Rewrite the user query based on the chat history.
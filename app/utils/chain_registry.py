@@ -0,0 +1,69 @@
+# app/utils/chain_registry.py
+import logging
+import threading
+from typing import Dict, Iterable, Optional, Tuple
+
+from app.utils.chain_manager import ConversationalChainManager
+from app.utils.answer_cache import AnswerCache
+from app.utils.session_cache import SessionHistoryCache
+from app.utils.settings import ANSWER_CACHE_ENABLED
+
+logger = logging.getLogger(__name__)
+
+
+class ChainRegistry:
+    """
+    Process-wide registry of prebuilt conversation chains.
+
+    One ConversationalChainManager (LLM clients, prompts and RunnableWithMessageHistory) is built lazily
+    per (model, retriever version) and reused by every request. All managers share one session history
+    store, so switching models does not reload the history from Postgres, and one answer cache (if
+    ANSWER_CACHE_ENABLED). Call `invalidate` after the index was rebuilt so the next request builds
+    chains on top of the new retriever.
+    """
+
+    def __init__(self, retriever, version: Optional[str] = None):
+        self.retriever = retriever
+        self.version = version
+        self.store = SessionHistoryCache()  ## Bounded session histories shared by all chains
+        self.answer_cache = AnswerCache() if ANSWER_CACHE_ENABLED else None
+        self._chains: Dict[Tuple[str, Optional[str]], ConversationalChainManager] = {}
+        self._lock = threading.Lock()
+
+    def get(self, llm_name: str) -> ConversationalChainManager:
+        """Return the manager for `llm_name`, building its chain on first use."""
+        key = (llm_name, self.version)
+        manager = self._chains.get(key)
+        if manager is not None:
+            return manager
+
+        with self._lock:
+            # Another request may have built it while we were waiting for the lock
+            manager = self._chains.get(key)
+            if manager is None:
+                logger.info(f"Building conversation chain for model {llm_name} (retriever version {self.version}).")
+                manager = ConversationalChainManager(llm_name=llm_name, store=self.store,
+                                                     answer_cache=self.answer_cache, index_version=self.version)
+                manager.build_conversation_chain(self.retriever)
+                self._chains[key] = manager
+        return manager
+
+    def invalidate(self, retriever, version: Optional[str] = None, sources: Optional[Iterable[str]] = None) -> None:
+        """
+        Swap in a new retriever and drop all chains built on the old one.
+        `sources` are the doc_ids of the new version; cached answers built from other documents are dropped.
+        Without them the whole answer cache is cleared.
+        """
+        with self._lock:
+            self.retriever = retriever
+            self.version = version
+            self._chains.clear()
+            if self.answer_cache is not None:
+                if sources is None:
+                    self.answer_cache.clear()
+                else:
+                    self.answer_cache.rebase(version, sources)
+        logger.info(f"Conversation chains invalidated, retriever version is now {version}.")
+
+    def models(self):
+        return sorted({model for model, _ in self._chains})
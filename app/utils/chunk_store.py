@@ -0,0 +1,192 @@
+# app/utils/chunk_store.py
+import json
+import mmap
+import os
+from array import array
+from collections.abc import Mapping
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+import numpy as np
+from langchain_community.docstore.base import Docstore
+from langchain_core.documents import Document
+
+#-----------------------------------------------------------------------------------------------------------#
+#   Read-only columnar chunk store, memory-mapped from disk.                                                #
+#                                                                                                           #
+#       <dir>/text.bin          texts of all chunks, UTF-8, back to back                                    #
+#       <dir>/text_offsets.npy  int64 (n + 1): chunk i is text.bin[offsets[i]:offsets[i + 1]]               #
+#       <dir>/ids.bin           chunk ids, back to back (+ ids_offsets.npy)                                 #
+#       <dir>/id_order.npy      positions sorted by id, for the binary search of search(id)                 #
+#       <dir>/metadata.npy      int32 (n, keys): index of the value in the key's table, -1 = key not set    #
+#       <dir>/metadata.json     count, metadata keys and the table of distinct values of every key          #
+#                                                                                                           #
+#   Metadata values are interned: "source" or "doc_id" are stored once per file, not once per chunk.        #
+#   Nothing is read into the Python heap besides the value tables; a Document is only built for the chunks  #
+#   a search returns. All workers mapping the same version share its pages through the OS page cache.       #
+#-----------------------------------------------------------------------------------------------------------#
+
+CHUNK_STORE_NAME = "docstore"
+
+
+class ChunkStoreWriter:
+    """Append (id, Document) pairs in index order, then `close()` writes the columns."""
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self._text = open(self.path / "text.bin", "wb")
+        self._ids = open(self.path / "ids.bin", "wb")
+        self._text_offsets = array("q", [0])
+        self._id_offsets = array("q", [0])
+        self._id_list: List[str] = []
+        self._keys: Dict[str, int] = {}
+        self._tables: List[list] = []
+        self._interned: List[Dict[str, int]] = []
+        self._columns: List[array] = []
+
+    @property
+    def count(self) -> int:
+        return len(self._id_list)
+
+    def add(self, id: str, document: Document) -> None:
+        self._text.write(document.page_content.encode("utf-8"))
+        self._text_offsets.append(self._text.tell())
+        self._ids.write(id.encode("utf-8"))
+        self._id_offsets.append(self._ids.tell())
+        self._id_list.append(id)
+
+        row = self.count - 1
+        for key, value in document.metadata.items():
+            column = self._keys.get(key)
+            if column is None:
+                column = self._keys[key] = len(self._keys)
+                self._tables.append([])
+                self._interned.append({})
+                self._columns.append(array("i", [-1]) * row)
+            encoded = json.dumps(value, sort_keys=True, default=str)
+            index = self._interned[column].get(encoded)
+            if index is None:
+                index = self._interned[column][encoded] = len(self._tables[column])
+                self._tables[column].append(json.loads(encoded))
+            self._columns[column].append(index)
+        for column in self._columns:
+            if len(column) == row:
+                column.append(-1)
+
+    def close(self) -> None:
+        self._text.close()
+        self._ids.close()
+        count = self.count
+        np.save(self.path / "text_offsets.npy", np.frombuffer(self._text_offsets, dtype=np.int64))
+        np.save(self.path / "ids_offsets.npy", np.frombuffer(self._id_offsets, dtype=np.int64))
+        np.save(self.path / "id_order.npy", np.argsort(np.array(self._id_list, dtype=str), kind="stable").astype(np.int64))
+        metadata = np.full((count, len(self._columns)), -1, dtype=np.int32)
+        for index, column in enumerate(self._columns):
+            metadata[:, index] = np.frombuffer(column, dtype=np.int32)
+        np.save(self.path / "metadata.npy", metadata)
+        with open(self.path / "metadata.json", "w", encoding="utf-8") as file:
+            json.dump({"count": count, "keys": list(self._keys), "tables": self._tables}, file)
+
+
+def write_chunk_store(path: Union[str, Path], ids: Iterable[str], documents: Iterable[Document]) -> None:
+    """Write the chunks (in index position order) as a chunk store in `path`."""
+    writer = ChunkStoreWriter(path)
+    for id, document in zip(ids, documents):
+        writer.add(id, document)
+    writer.close()
+
+
+def _map_file(path: Path):
+    """Read-only memory map of a file (mmap refuses empty files)."""
+    if os.path.getsize(path) == 0:
+        return b""
+    with open(path, "rb") as file:
+        return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+class ChunkStore(Docstore):
+    """LangChain Docstore over a chunk store directory; Documents are built on access."""
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+        with open(self.path / "metadata.json", "r", encoding="utf-8") as file:
+            info = json.load(file)
+        self.count = info["count"]
+        self.keys: List[str] = info["keys"]
+        self.tables: List[list] = info["tables"]
+        self._text = _map_file(self.path / "text.bin")
+        self._ids = _map_file(self.path / "ids.bin")
+        self.text_offsets = np.load(self.path / "text_offsets.npy", mmap_mode="r")
+        self.id_offsets = np.load(self.path / "ids_offsets.npy", mmap_mode="r")
+        self.id_order = np.load(self.path / "id_order.npy", mmap_mode="r")
+        self.metadata = np.load(self.path / "metadata.npy", mmap_mode="r")
+
+    def __len__(self) -> int:
+        return self.count
+
+    def id(self, position: int) -> str:
+        return self._ids[int(self.id_offsets[position]):int(self.id_offsets[position + 1])].decode("utf-8")
+
+    def text(self, position: int) -> str:
+        return self._text[int(self.text_offsets[position]):int(self.text_offsets[position + 1])].decode("utf-8")
+
+    def metadata_of(self, position: int) -> dict:
+        return {key: self.tables[column][value]
+                for column, (key, value) in enumerate(zip(self.keys, self.metadata[position].tolist())) if value >= 0}
+
+    def document(self, position: int) -> Document:
+        return Document(id=self.id(position), page_content=self.text(position), metadata=self.metadata_of(position))
+
+    def position(self, id: str) -> Optional[int]:
+        """Position of chunk `id` (binary search over the sorted ids), None if it is not stored."""
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self.id(int(self.id_order[middle])) < id:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.count and self.id(int(self.id_order[low])) == id:
+            return int(self.id_order[low])
+        return None
+
+    def search(self, search: str) -> Union[str, Document]:
+        position = self.position(search)
+        if position is None:
+            return f"ID {search} not found."
+        return self.document(position)
+
+    def add(self, texts: Dict[str, Document]) -> None:
+        raise NotImplementedError("ChunkStore is read-only, VectorIndexStore writes a new version instead.")
+
+    def delete(self, ids: List) -> None:
+        raise NotImplementedError("ChunkStore is read-only, VectorIndexStore writes a new version instead.")
+
+    def ids(self) -> Iterator[str]:
+        return (self.id(position) for position in range(self.count))
+
+    def items(self) -> Iterator[Tuple[str, Document]]:
+        """All (id, Document) pairs in index order; materializes every chunk, meant for the sync only."""
+        return ((self.id(position), self.document(position)) for position in range(self.count))
+
+    def index_ids(self) -> "ChunkIds":
+        return ChunkIds(self)
+
+
+class ChunkIds(Mapping):
+    """Lazy index position -> chunk id mapping, used as FAISS.index_to_docstore_id."""
+
+    def __init__(self, store: ChunkStore):
+        self.store = store
+
+    def __getitem__(self, position: int) -> str:
+        if not 0 <= position < self.store.count:
+            raise KeyError(position)
+        return self.store.id(int(position))
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(range(self.store.count))
+
+    def __len__(self) -> int:
+        return self.store.count
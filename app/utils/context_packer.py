@@ -0,0 +1,223 @@
+# app/utils/context_packer.py
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+
+from langchain_core.documents import Document
+from langchain_core.messages import BaseMessage, SystemMessage
+
+from app.utils.embedding_cache import text_key
+from app.utils.settings import (ANSWER_TOKEN_RESERVE, CHARS_PER_TOKEN, DEFAULT_CONTEXT_WINDOW, HISTORY_SUMMARY_MAX_TOKENS,
+                                HISTORY_TOKEN_BUDGET, MIN_CHUNK_TOKENS, MODEL_CONTEXT_WINDOWS, MODEL_TOKENIZERS)
+
+logger = logging.getLogger(__name__)
+
+#-----------------------------------------------------------------------------------------------------------#
+#   Token budgeted prompt packing.                                                                          #
+#                                                                                                           #
+#   context window (num_ctx) = answer reserve + system prompt + chat history + question + documents         #
+#                                                                                                           #
+#   - the history keeps the newest whole turns that fit HISTORY_TOKEN_BUDGET, older turns are dropped or,    #
+#     if a summarizer is given, replaced by a cached summary                                                #
+#   - retrieved documents are deduplicated and added in relevance order until the window is full; the      #
+#     first one that does not fit is truncated if a useful piece (MIN_CHUNK_TOKENS) is left                 #
+#                                                                                                           #
+#   The same window is passed to Ollama as num_ctx, so nothing is cut off silently on the server.           #
+#-----------------------------------------------------------------------------------------------------------#
+
+# Tokens added by the chat template around every message (role header, separators)
+MESSAGE_OVERHEAD_TOKENS = 8
+
+# Summaries kept per worker
+SUMMARY_CACHE_SIZE = 1024
+
+
+def _parse_model_map(value: str) -> Dict[str, str]:
+    """Parse "model=value,model=value" settings."""
+    entries = {}
+    for item in value.split(","):
+        model, _, setting = item.strip().rpartition("=")
+        if model and setting:
+            entries[model.strip()] = setting.strip()
+    return entries
+
+
+def get_context_window(model: str) -> int:
+    """Context window used for `model`, also sent to Ollama as num_ctx."""
+    windows = _parse_model_map(MODEL_CONTEXT_WINDOWS)
+    return int(windows.get(model, DEFAULT_CONTEXT_WINDOW))
+
+
+class TokenCounter:
+    """Counts tokens with the model's HuggingFace tokenizer if one is configured, otherwise estimates them."""
+
+    def __init__(self, model: str):
+        self.model = model
+        self.tokenizer = None
+        tokenizer_name = _parse_model_map(MODEL_TOKENIZERS).get(model)
+        if tokenizer_name:
+            try:
+                from transformers import AutoTokenizer
+                self.tokenizer = AutoTokenizer.from_pretrained(tokenizer_name)
+            except Exception as e:
+                logger.warning(f"Could not load tokenizer {tokenizer_name} for {model}, estimating tokens instead: {e}")
+
+    def count(self, text: str) -> int:
+        if not text:
+            return 0
+        if self.tokenizer is not None:
+            return len(self.tokenizer.encode(text, add_special_tokens=False))
+        return int(len(text) / CHARS_PER_TOKEN) + 1
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        """Cut `text` to at most `max_tokens` tokens, preferring to end at a paragraph or sentence."""
+        if max_tokens <= 0:
+            return ""
+        if self.tokenizer is not None:
+            ids = self.tokenizer.encode(text, add_special_tokens=False)
+            if len(ids) <= max_tokens:
+                return text
+            text = self.tokenizer.decode(ids[:max_tokens])
+        else:
+            limit = int(max_tokens * CHARS_PER_TOKEN)
+            if len(text) <= limit:
+                return text
+            text = text[:limit]
+        for separator in ("\n\n", "\n", ". "):
+            cut = text.rfind(separator)
+            if cut > len(text) // 2:
+                return text[:cut + 1].rstrip()
+        return text
+
+
+_counters: Dict[str, TokenCounter] = {}
+_counters_lock = threading.Lock()
+
+
+def get_token_counter(model: str) -> TokenCounter:
+    """Return the shared token counter of `model` (tokenizers are loaded once per worker)."""
+    with _counters_lock:
+        if model not in _counters:
+            _counters[model] = TokenCounter(model)
+        return _counters[model]
+
+
+class ContextPacker:
+    """Fits chat history and retrieved documents into the context window of one model."""
+
+    def __init__(self, model: str, context_window: Optional[int] = None, answer_reserve=ANSWER_TOKEN_RESERVE,
+                 history_budget=HISTORY_TOKEN_BUDGET, min_chunk_tokens=MIN_CHUNK_TOKENS,
+                 summarize: Optional[Callable[[List[BaseMessage]], str]] = None,
+                 asummarize: Optional[Callable[[List[BaseMessage]], Awaitable[str]]] = None):
+        self.model = model
+        self.context_window = context_window or get_context_window(model)
+        self.answer_reserve = answer_reserve
+        self.history_budget = history_budget
+        self.min_chunk_tokens = min_chunk_tokens
+        self.counter = get_token_counter(model)
+        self.summarize = summarize
+        self.asummarize = asummarize
+        self._summaries: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def count(self, text: str) -> int:
+        return self.counter.count(text)
+
+    def count_messages(self, messages: Sequence[BaseMessage]) -> int:
+        return sum(self.count(str(message.content)) + MESSAGE_OVERHEAD_TOKENS for message in messages)
+
+    # -----------------------
+    # Chat history
+    # -----------------------
+    def split_history(self, messages: Sequence[BaseMessage]) -> Tuple[List[BaseMessage], List[BaseMessage]]:
+        """Return (older, recent): `recent` are the newest whole turns that fit the history budget."""
+        used, start = 0, len(messages)
+        # Walk back one turn (question + answer) at a time so a question is never kept without its answer
+        while start > 0:
+            turn_start = start - 2 if start >= 2 and messages[start - 2].type == "human" else start - 1
+            tokens = self.count_messages(messages[turn_start:start])
+            if used + tokens > self.history_budget:
+                break
+            used += tokens
+            start = turn_start
+        return list(messages[:start]), list(messages[start:])
+
+    def _summary_key(self, messages: Sequence[BaseMessage]) -> str:
+        digest = hashlib.sha256(self.model.encode("utf-8"))
+        for message in messages:
+            digest.update(f"{message.type}:{message.content}\x00".encode("utf-8"))
+        return digest.hexdigest()
+
+    def _cached_summary(self, key: str) -> Optional[str]:
+        with self._lock:
+            summary = self._summaries.get(key)
+            if summary is not None:
+                self._summaries.move_to_end(key)
+            return summary
+
+    def _remember_summary(self, key: str, summary: str) -> str:
+        summary = self.counter.truncate(summary.strip(), HISTORY_SUMMARY_MAX_TOKENS)
+        with self._lock:
+            self._summaries[key] = summary
+            while len(self._summaries) > SUMMARY_CACHE_SIZE:
+                self._summaries.popitem(last=False)
+        return summary
+
+    def _with_summary(self, summary: str, recent: List[BaseMessage]) -> List[BaseMessage]:
+        if not summary:
+            return recent
+        return [SystemMessage(content=f"Summary of the earlier conversation: {summary}"), *recent]
+
+    def pack_history(self, messages: Sequence[BaseMessage]) -> List[BaseMessage]:
+        older, recent = self.split_history(messages)
+        if not older or self.summarize is None:
+            return recent
+        key = self._summary_key(older)
+        summary = self._cached_summary(key)
+        if summary is None:
+            summary = self._remember_summary(key, self.summarize(older))
+        return self._with_summary(summary, recent)
+
+    async def apack_history(self, messages: Sequence[BaseMessage]) -> List[BaseMessage]:
+        older, recent = self.split_history(messages)
+        if not older or (self.summarize is None and self.asummarize is None):
+            return recent
+        key = self._summary_key(older)
+        summary = self._cached_summary(key)
+        if summary is None:
+            generated = await self.asummarize(older) if self.asummarize else self.summarize(older)
+            summary = self._remember_summary(key, generated)
+        return self._with_summary(summary, recent)
+
+    # -----------------------
+    # Retrieved documents
+    # -----------------------
+    def document_budget(self, used_tokens: int) -> int:
+        """Tokens left for documents once the answer reserve and the rest of the prompt are accounted for."""
+        return max(self.context_window - self.answer_reserve - used_tokens, 0)
+
+    def pack_documents(self, documents: Sequence[Document], budget: int) -> List[Document]:
+        """Deduplicate `documents` (kept in relevance order) and fit them into `budget` tokens."""
+        packed, seen, used = [], set(), 0
+        for document in documents:
+            key = text_key(document.page_content)
+            if key in seen:
+                continue
+            seen.add(key)
+
+            tokens = self.count(document.page_content) + MESSAGE_OVERHEAD_TOKENS
+            if used + tokens <= budget:
+                packed.append(document)
+                used += tokens
+                continue
+
+            remaining = budget - used - MESSAGE_OVERHEAD_TOKENS
+            if remaining >= self.min_chunk_tokens:
+                content = self.counter.truncate(document.page_content, remaining)
+                packed.append(Document(page_content=content, metadata={**document.metadata, "truncated": True}))
+            break
+
+        logger.debug(f"Packed {len(packed)} of {len(documents)} documents into {budget} tokens for {self.model}.")
+        return packed
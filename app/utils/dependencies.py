@@ -1,17 +1,52 @@
 # app/utils/dependencies.py
-from fastapi import Depends, Request
+from typing import Optional
+
+from fastapi import HTTPException, Request, status
+
+from app.utils.admission import AdmissionRejected, AdmissionSlot, get_admission
+from app.utils.settings import NOT_READY_RETRY_AFTER
+
+
+def _app_state(request: Request, name: str):
+    """Return app.state.<name>, or a fast 503 while the startup is still loading the indexes."""
+    value = getattr(request.app.state, name, None)
+    if value is None:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Service is starting, the document index is not loaded yet.",
+            headers={"Retry-After": str(NOT_READY_RETRY_AFTER)},
+        )
+    return value
 
 def get_document_manager(request: Request):
-    return request.app.state.document_manager
+    return _app_state(request, "document_manager")
 
-def get_embedding_manager(request: Request):
-    return request.app.state.embedding_manager
+def get_index_store(request: Request):
+    return _app_state(request, "index_store")
 
 def get_vectordb(request: Request):
-    return request.app.state.vectordb
+    return _app_state(request, "vectordb")
 
 def get_retriever(request: Request):
-    if not hasattr(request.app.state, "retriever"):
-        raise RuntimeError("Retriever not initialzed. App state might bot be set up.")
+    return _app_state(request, "retriever")
+
+def get_chain_registry(request: Request):
+    return _app_state(request, "chain_registry")
+
+
+async def admit(model: str, priority: int) -> AdmissionSlot:
+    """Generation slot for `model`, or a fast 429 with Retry-After while Ollama is saturated."""
+    try:
+        return await get_admission().acquire(model, priority)
+    except AdmissionRejected as e:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=f"Too many requests for {e.model}: {e.reason}.",
+            headers={"Retry-After": str(e.retry_after)},
+        )
+
 
-    return request.app.state.retriever
\ No newline at end of file
+def release_slot(slot: Optional[AdmissionSlot]) -> None:
+    """Release a slot from `admit`; `slot` is None for answers that needed no slot (answer cache hits)."""
+    if slot is not None:
+        slot.release()
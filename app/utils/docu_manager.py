@@ -1,18 +1,15 @@
 import glob, os
-import uuid
+import hashlib
 from langchain_core.documents import Document
-from langchain_community.document_loaders import PyPDFLoader, Docx2txtLoader, TextLoader, PyMuPDFLoader, PDFPlumberLoader, PDFMinerLoader, PyPDFLoader
+from langchain_community.document_loaders import PyPDFLoader, PDFPlumberLoader, PDFMinerLoader
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from pathlib import Path
-import PyPDF2
-from langchain_ollama import OllamaEmbeddings
 from langchain_community.vectorstores import FAISS
-from langchain.retrievers import ParentDocumentRetriever
 from langchain.storage import InMemoryStore
 
-from app.database.config import get_db
-from app.database.docstore import PostgresStore
-from typing import Iterable, List, Optional, Any
+from app.utils.parsing import iter_pdf_pages, parse_file, parse_files
+from typing import Iterable, Iterator, List, Optional, Any
+from app.utils.settings import INDEX_BLOCK_SIZE
 #-------------------------------------------------------------------------------#
 #                           TODO                                                #
 # conversion from diffent document format like docx, pdf, which contain...      #
@@ -21,6 +18,24 @@ from typing import Iterable, List, Optional, Any
 #                                                                               #
 #-------------------------------------------------------------------------------#
 
+def file_sha256(path: str, block_size: int = 1 << 20) -> str:
+    """Return the sha256 hex digest of a file, read in blocks so large PDFs are not loaded at once."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def file_doc_id(path: str, sha256: Optional[str] = None) -> str:
+    """Stable document id derived from the file path and its content hash."""
+    sha256 = sha256 or file_sha256(path)
+    return hashlib.sha256(f"{os.path.normpath(path)}:{sha256}".encode("utf-8")).hexdigest()[:32]
+
+def chunk_id(doc_id: str, position: int) -> str:
+    """Stable id of the n-th chunk of a document."""
+    return f"{doc_id}-{position}"
+
+
 class DocumentManager:
     """ Load the document from user defined location and split it into smaller chunks so that it can easily process"""
     def __init__(self, directory_path, glob_pattern=['**/*.pdf', '**/*.docx', '**/*.txt']):
@@ -29,34 +44,46 @@ class DocumentManager:
         self.documents = []  # Raw loaded documents
         self.chunks = [] # Processed chunks
 
-    def load_documents(self):
-        """ Load the documents form the list of file path."""
+    def load_file(self, document_path, doc_id=None):
+        """ Load a single file (PDF with PyMuPDF, docx, txt) and tag every page with a stable doc_id."""
+        return parse_file(document_path, doc_id or file_doc_id(document_path), mode="pages")
 
-        for pattern in self.glob_pattern:
-            # Get all documents matching the pattern, including subdirectories
-            documents_path = glob.glob(os.path.join(self.directory_path, pattern), recursive=True)
-            #documents_path = glob.glob(f"{self.directory_path}/**/*", recursive=True)
-            # print("list of given documents", documents_path)
-            for document_path in documents_path:
-                # Load PDF if it matches
-                if document_path.endswith('.pdf'):
-                    # Replace this with actual PDF loading code
-                    #print("pdf loader", document_path)
-                    document_loader = PyMuPDFLoader(document_path)#, extract_images=True)
-                # Check for docx and load it
-                elif document_path.endswith('.docx'):
-                    document_loader = Docx2txtLoader(document_path)
-                # Check for txt and load it
-                elif document_path.endswith('.txt'):
-                    document_loader = TextLoader(document_path)
-                #other cases asked user to check the document format.
-                else:
-                    print(f'Please check documets format.')
-
-                # Extend the documents list with loaded content
-                self.documents.extend(document_loader.load())
+    def load_documents(self):
+        """ Load the documents form the list of file path, parsed in parallel on a process pool."""
+        # Extend the documents list with loaded content, failed files are logged and skipped
+        for file_documents in self.iter_documents():
+            self.documents.extend(file_documents)
 
         return self.documents
+
+    def list_files(self):
+        """ All files matching the glob patterns, including subdirectories."""
+        documents_path = set()
+        for pattern in self.glob_pattern:
+            documents_path.update(glob.glob(os.path.join(self.directory_path, pattern), recursive=True))
+        return sorted(path for path in documents_path if os.path.isfile(path))
+
+    def iter_documents(self, documents_path=None) -> Iterator[List[Document]]:
+        """Yield the documents of one file at a time (parsed on the process pool), nothing is kept."""
+        documents_path = self.list_files() if documents_path is None else documents_path
+        for result in parse_files([(path, file_doc_id(path)) for path in documents_path], mode="pages"):
+            if result.documents:
+                yield result.documents
+
+    def iter_chunks(self, batch_size: int = INDEX_BLOCK_SIZE, documents_path=None) -> Iterator[List[Document]]:
+        """
+        Load -> split pipeline in bounded batches: yields lists of about `batch_size` chunks, so memory
+        depends on the batch size and the largest file, not on the size of the corpus.
+        """
+        text_splitter = self.text_splitter()
+        batch = []
+        for file_documents in self.iter_documents(documents_path):
+            batch.extend(text_splitter.split_documents(file_documents))
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
     # -----------------------
     # Step 2: Split Documents simple methods
     # -----------------------
@@ -72,17 +99,19 @@ class DocumentManager:
         if not documents:
             raise ValueError("No documents to split. Please check the documents first.")
         
+        self.chunks = self.text_splitter().split_documents(documents)
+        return self.chunks
+
+    def text_splitter(self):
         # split mehtod
         # we can test here other splitter
-        text_splitter = RecursiveCharacterTextSplitter(
+        return RecursiveCharacterTextSplitter(
                             chunk_size=2500,
                             chunk_overlap=200,
                             length_function=len,
                             is_separator_regex=False,
 
                             )
-        self.chunks = text_splitter.split_documents(documents)
-        return self.chunks
 
 
 class AdvancedDocumentManager:
@@ -100,38 +129,58 @@ class AdvancedDocumentManager:
         """ Load the documents form the list of file path."""
 
         self.documents.clear()
-        documents_path = glob.glob(f"{self.directory_path}/**/*", recursive=True)
-        print("list of given documents", documents_path)
-        for document_path in documents_path:
-            # Load PDF if it matches
-            if document_path.endswith('.pdf'):
-                print(f"Loading PDF file: {document_path}")
-                #document_loader = PyMuPDFLoader(file_path=document_path)#, concatenate_pages=True)#, extract_images=True)PDFPlumberLoader
-                #document = document_loader.load()
-                #self.documents.extend(document)
-                full_text  = self.extract_text_with_formating(document_path)
-                if full_text :
-                    self.documents.append(Document(page_content=full_text , metadata={'source': document_path,"doc_id": str(uuid.uuid4())}))
+        for file_documents in self.iter_documents():
+            self.documents.extend(file_documents)
                 
         return self.documents
+
+    def iter_documents(self) -> Iterator[List[Document]]:
+        """Yield the document of one PDF at a time (parsed on the process pool), nothing is kept."""
+        documents_path = glob.glob(f"{self.directory_path}/**/*", recursive=True)
+        print("list of given documents", documents_path)
+        pdf_paths = sorted(path for path in documents_path if path.endswith('.pdf'))
+        for result in parse_files([(path, file_doc_id(path)) for path in pdf_paths], mode="document"):
+            if result.documents:
+                yield result.documents
+
+    def iter_chunks(self, batch_size: int = INDEX_BLOCK_SIZE) -> Iterator[List[Document]]:
+        """Streaming counterpart of split_document: yields bounded batches of chunks."""
+        text_splitter = self.text_splitter()
+        batch = []
+        for file_documents in self.iter_documents():
+            batch.extend(text_splitter.split_documents(file_documents))
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def load_file(self, document_path, doc_id=None):
+        """ Load a single PDF as one document. The doc_id is derived from path and content hash so reloads deduplicate."""
+        # Load PDF if it matches
+        if not document_path.endswith('.pdf'):
+            return []
+        print(f"Loading PDF file: {document_path}")
+        #document_loader = PyMuPDFLoader(file_path=document_path)#, concatenate_pages=True)#, extract_images=True)PDFPlumberLoader
+        #document = document_loader.load()
+        #self.documents.extend(document)
+        full_text  = self.extract_text_with_formating(document_path)
+        if not full_text:
+            return []
+        return [Document(page_content=full_text , metadata={'source': document_path, "doc_id": doc_id or file_doc_id(document_path)})]
     
     def extract_text_with_formating(self, pdf_path):
         """Extract text from a PDF file using PDFMiner."""
-        content = ""
+        # Pages are collected and joined once (repeated += is quadratic for large PDFs)
+        pages = []
         try: 
-            with open(pdf_path, 'rb') as file:
-                # Open the PDF file
-                reader = PyPDF2.PdfReader(file)
-                # Extract text from each page
-                for page_num, page in enumerate(reader.pages):
-                    text = page.extract_text()
-                    if text:
-                        content += f"\n---------- New Page Started (Page No.: {page_num + 1}) ----------\n{text}\n"
+            for text in iter_pdf_pages(pdf_path):
+                pages.append(text)
 
         except Exception as e:
             print(f"Error extracting text: {e}")
 
-        return content
+        return "".join(pages)
             
     # -----------------------
     # Step 2: Split Documents
@@ -149,15 +198,17 @@ class AdvancedDocumentManager:
         if not documents:
             raise ValueError("No documents to split. Please check the documents first.")
         
+        self.chunks = self.text_splitter().split_documents(documents)
+        return self.chunks          
+
+    def text_splitter(self):
         # split mehtod
         # we can test here other splitter
-        text_splitter = RecursiveCharacterTextSplitter(
+        return RecursiveCharacterTextSplitter(
                             chunk_size=3000,
                             chunk_overlap=200
 
                             )
-        self.chunks = text_splitter.split_documents(documents)
-        return self.chunks          
     
     def monkeypatch_FAISS(self, embeddings_model):
         def _add_texts(self, texts, metadatas=None, ids=None, **kwargs):
@@ -169,34 +220,22 @@ class AdvancedDocumentManager:
     # Step 3: Create Retriever(s)
     # -------------------------------
     def create_parent_retriever(self, use_postgres: bool = False, emd_model:str='nomic-embed-text'):
-        """Create retriever directly from raw documents"""
-        embedding = OllamaEmbeddings(model=emd_model, base_url="http://ollama-container:11434")
+        """
+        Attach to the persisted parent retriever (child vectors on disk + parent docstore).
+        Only files that changed since the published version are parsed and embedded; with the in-memory
+        docstore nothing survives a restart, so that variant is rebuilt every time.
+        """
+        # Imported here, the parent store itself builds on this module
+        from app.utils.parent_store import ParentIndexStore
 
-        # Load the documents if they havenot been loaded yet
-        if not self.documents:
-            self.load_documents()
-        
-        texts = ["FAISS is an important library", "LangChain supports FAISS"]
-        self.monkeypatch_FAISS(embedding)
-        vectordb = FAISS.from_texts(texts, embedding)
         if use_postgres:
             # PostgreSQL version
-            store = PostgresStore(db=next(get_db()))  # Get database session
-            store._ensure_clean_state()
+            parent_store = ParentIndexStore(source_dir=self.directory_path, embedding_model=emd_model)
+            vectordb = parent_store.load_or_build()
         else:
             # In-memory version
-            store = InMemoryStore()
-            
-        parent_splitter = RecursiveCharacterTextSplitter(chunk_size=3000)
-        child_splitter = RecursiveCharacterTextSplitter(chunk_size=400, add_start_index=True)
-        
-        retriever = ParentDocumentRetriever(
-                            vectorstore=vectordb,
-                            docstore=store,
-                            id_key="parent_id",
-                            parent_splitter=parent_splitter, 
-                            child_splitter=child_splitter,
-                            child_metadata_fields=["source"],)
-        retriever.add_documents(self.documents)
-
-        return retriever
\ No newline at end of file
+            parent_store = ParentIndexStore(name="parents_memory", source_dir=self.directory_path,
+                                            embedding_model=emd_model, docstore=InMemoryStore())
+            vectordb = parent_store.build()
+        self.parent_store = parent_store
+        return parent_store.as_retriever(vectordb)
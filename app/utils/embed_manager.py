@@ -1,11 +1,14 @@
-import numpy as np
 import faiss, chromadb
 from sentence_transformers import SentenceTransformer
 from langchain_community.vectorstores import FAISS
 from langchain_huggingface import HuggingFaceEmbeddings
-from langchain_ollama import OllamaEmbeddings
 import os
+import tempfile
 from chromadb.config import Settings
+from app.utils.ann_index import build_ann_index, default_search_params, set_search_params
+from app.utils.chunk_store import ChunkStore, ChunkStoreWriter
+from app.utils.embedding_cache import get_embeddings
+from app.utils.settings import ANN_INDEX_TYPE, INDEX_BLOCK_SIZE
 
 #os.environ['CURL_CA_BUNDLE'] = ''
 
@@ -24,15 +27,25 @@ from chromadb.config import Settings
 #-----------------------------------------------------------------------------------------------------------------------#
 
 
+def iter_batches(chunks, batch_size=INDEX_BLOCK_SIZE):
+    """Accept a list of chunks or an iterable of chunk batches (e.g. DocumentManager.iter_chunks())."""
+    if isinstance(chunks, list) and (not chunks or not isinstance(chunks[0], list)):
+        for start in range(0, len(chunks), batch_size):
+            yield chunks[start:start + batch_size]
+    else:
+        yield from chunks
+
+
 class EmbeddingManager:
-    """ Manage Emedding"""
-    def __init__(self, chunks, embedding_model='bge-m3', base_url="http://ollama-container:11434"):
+    """ Manage Emedding, `chunks` may be a list or a stream of chunk batches"""
+    def __init__(self, chunks, embedding_model='bge-m3', base_url="http://ollama-container:11434", index_type=ANN_INDEX_TYPE):
         self.chunks = chunks
         #self.persist_directory = persist_directory
         self.embedding_model = embedding_model
+        self.index_type = index_type
         self.vectordb = None
         self.base_url = base_url
-        self.embedding = OllamaEmbeddings(model=self.embedding_model, base_url=self.base_url)
+        self.embedding = get_embeddings(self.embedding_model, self.base_url)
 
     
     # Method to create embeddings
@@ -44,20 +57,31 @@ class EmbeddingManager:
 
     
         # Creating an instance of Chroma with the sections and the embeddings
-        self.vectordb = FAISS.from_documents(documents=self.chunks, embedding=self.embedding) # persist_directory=self.persist_directory)
+        # Batch by batch, so a streamed corpus is never held in memory as a whole
+        for batch in iter_batches(self.chunks):
+            if self.vectordb is None:
+                self.vectordb = FAISS.from_documents(documents=batch, embedding=self.embedding) # persist_directory=self.persist_directory)
+            else:
+                self.vectordb.add_documents(batch)
+        # Replace the flat scan by the configured CPU ANN index (same vector order, so the docstore ids match);
+        # this index is for searching, the persisted stores in index_store.py handle updates
+        if self.vectordb is not None:
+            self.vectordb.index, ann = build_ann_index(self.vectordb.index, self.index_type)
+            set_search_params(self.vectordb.index, default_search_params(ann["type"]))
         return self.vectordb
 
 
 
 class FAISSEmbeddingManager:
     """Manage embeddings using FAISS."""
-    def __init__(self, chunks, embedding_model='nomic-embed-text', base_url="http://ollama-container:11434"):
+    def __init__(self, chunks, embedding_model='nomic-embed-text', base_url="http://ollama-container:11434", index_type=ANN_INDEX_TYPE):
         self.chunks = chunks
         self.embedding_model = embedding_model
+        self.index_type = index_type
         self.base_url = base_url
-        self.embedding = OllamaEmbeddings(model=self.embedding_model, base_url=self.base_url)  # Instantiate once
+        self.embedding = get_embeddings(self.embedding_model, self.base_url)  # Shared batched, cached client
         self.faiss_index = None
-        self.chunk_map = {}
+        self.chunk_map = None  # ChunkStore: index position -> chunk, memory-mapped instead of a dict of Documents
         self.embedding_dimension = None
 
     def _get_embedding_dimension(self):
@@ -68,16 +92,24 @@ class FAISSEmbeddingManager:
 
     def create_embeddings(self):
         self.embedding_dimension = self._get_embedding_dimension()
-        #self.vectordb = faiss.GpuIndexFlatL2(self.embedding_dimension)
-        gpu_resources = faiss.StandardGpuResources()
-        #print(f"gpu_resources: {gpu_resources}")
-        self.faiss_index = faiss.GpuIndexFlatL2(gpu_resources, self.embedding_dimension)
-
-        for i, chunk in enumerate(self.chunks):
-            vector = self.embedding.embed_documents([chunk.page_content])[0]
-            self.faiss_index.add(np.array([vector], dtype=np.float32))
-            self.chunk_map[i] = chunk
-
+        # CPU only, the GPU is needed by Ollama for the LLM
+        flat_index = faiss.IndexFlatL2(self.embedding_dimension)
+
+        # Embed in large blocks and append each block to the index in one call; the chunks go to a chunk
+        # store on disk as they are embedded, so no block outlives its loop iteration
+        self._chunk_dir = tempfile.TemporaryDirectory(prefix="chunks-")  # removed with the manager
+        writer = ChunkStoreWriter(self._chunk_dir.name)
+        for block in iter_batches(self.chunks):
+            vectors = self.embedding.embed_array([chunk.page_content for chunk in block])
+            flat_index.add(vectors)
+            for chunk in block:
+                writer.add(str(writer.count), chunk)
+        writer.close()
+        self.chunk_map = ChunkStore(self._chunk_dir.name)
+
+        # Train/build the configured ANN index (flat, hnsw, ivf_flat, ivf_pq) over the collected vectors
+        self.faiss_index, ann = build_ann_index(flat_index, self.index_type)
+        set_search_params(self.faiss_index, default_search_params(ann["type"]))
         return self.faiss_index
 
     def query_embeddings(self, query_text, top_k=5):
@@ -85,11 +117,11 @@ class FAISSEmbeddingManager:
         if self.faiss_index is None:
             raise ValueError("FAISS database not initialized. Call `create_embeddings` first.")
 
-        query_vector = np.array([self.embedding.embed_query(query_text)], dtype=np.float32)
+        query_vector = self.embedding.embed_array([query_text])
         
         distances, indices = self.faiss_index.search(query_vector, top_k)
 
-        results = [(self.chunk_map[idx], distances[0][i]) for i, idx in enumerate(indices[0])]
+        results = [(self.chunk_map.document(int(idx)), distances[0][i]) for i, idx in enumerate(indices[0]) if idx != -1]
         return results
 
 # # ------------------------------------------------------------------------------------------#
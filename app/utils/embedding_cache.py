@@ -0,0 +1,189 @@
+# app/utils/embedding_cache.py
+import asyncio
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, Iterable, List
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from app.utils.embedding_client import OllamaEmbeddingClient, get_embedding_client
+from app.utils.settings import EMBED_CACHE_MEMORY_ITEMS, EMBED_CACHE_PATH, EMBEDDING_MODEL, OLLAMA_BASE_URL
+
+logger = logging.getLogger(__name__)
+
+#-----------------------------------------------------------------------------------------------------------#
+#   Embedding cache keyed by (model name, sha256 of the normalized text).                                   #
+#                                                                                                           #
+#   Tier 1: bounded in-process LRU (OrderedDict), shared by every manager in the worker.                    #
+#   Tier 2: sqlite file next to the index, survives restarts and is shared between workers.                 #
+#   Vectors are stored as raw float32 bytes.                                                                #
+#-----------------------------------------------------------------------------------------------------------#
+
+# sqlite limits the number of host parameters per statement
+SQLITE_MAX_PARAMS = 500
+
+
+def normalize_text(text: str) -> str:
+    """Unicode-normalize and collapse whitespace so trivially different texts share an entry."""
+    return " ".join(unicodedata.normalize("NFKC", text).split())
+
+
+def text_key(text: str) -> str:
+    return hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """Two tier (memory LRU + sqlite) cache of embedding vectors."""
+
+    def __init__(self, path=EMBED_CACHE_PATH, max_items=EMBED_CACHE_MEMORY_ITEMS):
+        self.path = path
+        self.max_items = max_items
+        self._memory: "OrderedDict[tuple, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits_memory = 0
+        self.hits_disk = 0
+        self.misses = 0
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " model TEXT NOT NULL, key TEXT NOT NULL, vector BLOB NOT NULL,"
+            " PRIMARY KEY (model, key))"
+        )
+        self._db.commit()
+
+    def _remember(self, model: str, key: str, vector: np.ndarray) -> None:
+        self._memory[(model, key)] = vector
+        self._memory.move_to_end((model, key))
+        while len(self._memory) > self.max_items:
+            self._memory.popitem(last=False)
+
+    def get_many(self, model: str, keys: Iterable[str]) -> Dict[str, np.ndarray]:
+        """Return the cached vectors for `keys`; missing keys are simply absent from the result."""
+        found, missing = {}, []
+        with self._lock:
+            for key in keys:
+                vector = self._memory.get((model, key))
+                if vector is None:
+                    missing.append(key)
+                    continue
+                self._memory.move_to_end((model, key))
+                found[key] = vector
+            self.hits_memory += len(found)
+
+            for start in range(0, len(missing), SQLITE_MAX_PARAMS):
+                batch = missing[start:start + SQLITE_MAX_PARAMS]
+                rows = self._db.execute(
+                    f"SELECT key, vector FROM embeddings WHERE model = ? AND key IN ({','.join('?' * len(batch))})",
+                    [model, *batch],
+                ).fetchall()
+                for key, blob in rows:
+                    vector = np.frombuffer(blob, dtype=np.float32)
+                    found[key] = vector
+                    self._remember(model, key, vector)
+                self.hits_disk += len(rows)
+            self.misses += len(missing) - sum(1 for key in missing if key in found)
+        return found
+
+    def put_many(self, model: str, vectors: Dict[str, np.ndarray]) -> None:
+        with self._lock:
+            for key, vector in vectors.items():
+                self._remember(model, key, vector)
+            self._db.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, key, vector) VALUES (?, ?, ?)",
+                [(model, key, np.ascontiguousarray(vector, dtype=np.float32).tobytes()) for key, vector in vectors.items()],
+            )
+            self._db.commit()
+
+    def stats(self) -> dict:
+        lookups = self.hits_memory + self.hits_disk + self.misses
+        return {
+            "memory_items": len(self._memory),
+            "max_memory_items": self.max_items,
+            "hits_memory": self.hits_memory,
+            "hits_disk": self.hits_disk,
+            "misses": self.misses,
+            "hit_rate": round((self.hits_memory + self.hits_disk) / lookups, 4) if lookups else None,
+        }
+
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings that only send cache misses to the underlying Ollama client."""
+
+    def __init__(self, client: OllamaEmbeddingClient, cache: EmbeddingCache):
+        self.client = client
+        self.cache = cache
+        self.model = client.model
+
+    def _assemble(self, keys: List[str], vectors: Dict[str, np.ndarray]) -> np.ndarray:
+        return np.vstack([vectors[key] for key in keys]).astype(np.float32, copy=False)
+
+    def embed_array(self, texts: List[str]) -> np.ndarray:
+        """Embed `texts` as one float32 block, computing each distinct uncached text only once."""
+        if not texts:
+            return np.empty((0, 0), dtype=np.float32)
+        keys = [text_key(text) for text in texts]
+        vectors = self.cache.get_many(self.model, dict.fromkeys(keys))
+        missing = {key: text for key, text in zip(keys, texts) if key not in vectors}
+        if missing:
+            computed = self.client.embed_array(list(missing.values()))
+            new_vectors = dict(zip(missing.keys(), computed))
+            self.cache.put_many(self.model, new_vectors)
+            vectors.update(new_vectors)
+        return self._assemble(keys, vectors)
+
+    async def aembed_array(self, texts: List[str]) -> np.ndarray:
+        if not texts:
+            return np.empty((0, 0), dtype=np.float32)
+        keys = [text_key(text) for text in texts]
+        vectors = await asyncio.to_thread(self.cache.get_many, self.model, dict.fromkeys(keys))
+        missing = {key: text for key, text in zip(keys, texts) if key not in vectors}
+        if missing:
+            computed = await self.client.aembed_array(list(missing.values()))
+            new_vectors = dict(zip(missing.keys(), computed))
+            await asyncio.to_thread(self.cache.put_many, self.model, new_vectors)
+            vectors.update(new_vectors)
+        return self._assemble(keys, vectors)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.embed_array(texts).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_array([text])[0].tolist()
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return (await self.aembed_array(texts)).tolist()
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return (await self.aembed_array([text]))[0].tolist()
+
+
+_cache = None
+_embeddings: Dict[tuple, CachedEmbeddings] = {}
+_lock = threading.Lock()
+
+
+def get_embedding_cache() -> EmbeddingCache:
+    """Return the process-wide embedding cache."""
+    global _cache
+    with _lock:
+        if _cache is None:
+            _cache = EmbeddingCache()
+        return _cache
+
+
+def get_embeddings(model: str = EMBEDDING_MODEL, base_url: str = OLLAMA_BASE_URL) -> CachedEmbeddings:
+    """Return the shared, cached embeddings for `model`. Use this instead of creating OllamaEmbeddings."""
+    cache = get_embedding_cache()
+    with _lock:
+        if (model, base_url) not in _embeddings:
+            _embeddings[(model, base_url)] = CachedEmbeddings(get_embedding_client(model, base_url), cache)
+        return _embeddings[(model, base_url)]
@@ -0,0 +1,145 @@
+# app/utils/embedding_client.py
+import asyncio
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+import httpx
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from app.utils.settings import (EMBED_BATCH_SIZE, EMBED_MAX_CONCURRENCY, EMBED_MAX_RETRIES, EMBED_TIMEOUT,
+                                EMBEDDING_MODEL, OLLAMA_BASE_URL)
+
+logger = logging.getLogger(__name__)
+
+#-----------------------------------------------------------------------------------------------------------#
+#   Embedding client for the Ollama /api/embed endpoint.                                                    #
+#                                                                                                           #
+#   Texts are sent in batches of `batch_size` with at most `max_concurrency` requests in flight over a     #
+#   pooled keep-alive connection. Results come back as one contiguous float32 block so they can be added   #
+#   to a faiss index without going through Python lists.                                                    #
+#-----------------------------------------------------------------------------------------------------------#
+
+# Status codes worth retrying: Ollama answers 429/503 while a model is (re)loading
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class OllamaEmbeddingClient(Embeddings):
+    """LangChain compatible embeddings backed by a batched, bounded-concurrency Ollama client."""
+
+    def __init__(self, model=EMBEDDING_MODEL, base_url=OLLAMA_BASE_URL, batch_size=EMBED_BATCH_SIZE,
+                 max_concurrency=EMBED_MAX_CONCURRENCY, max_retries=EMBED_MAX_RETRIES, timeout=EMBED_TIMEOUT):
+        self.model = model
+        self.base_url = base_url
+        self.batch_size = batch_size
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.timeout = timeout
+        limits = httpx.Limits(max_connections=max_concurrency, max_keepalive_connections=max_concurrency)
+        self._client = httpx.Client(base_url=base_url, timeout=timeout, limits=limits)
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix=f"embed-{model}")
+        self._async_client = None
+        self._semaphore = None
+
+    def _payload(self, texts: List[str]) -> dict:
+        return {"model": self.model, "input": texts, "truncate": True}
+
+    def _to_array(self, response: httpx.Response, expected: int) -> np.ndarray:
+        embeddings = response.json()["embeddings"]
+        if len(embeddings) != expected:
+            raise ValueError(f"Ollama returned {len(embeddings)} embeddings for {expected} texts.")
+        return np.asarray(embeddings, dtype=np.float32)
+
+    def _should_retry(self, error: Exception) -> bool:
+        if isinstance(error, httpx.HTTPStatusError):
+            return error.response.status_code in RETRY_STATUS_CODES
+        return isinstance(error, httpx.TransportError)
+
+    def _backoff(self, attempt: int) -> float:
+        return min(0.5 * 2 ** attempt, 10.0)
+
+    # -----------------------
+    # Sync API
+    # -----------------------
+    def _embed_batch(self, texts: List[str]) -> np.ndarray:
+        """Embed one batch, retrying transient failures with exponential backoff."""
+        for attempt in range(self.max_retries + 1):
+            try:
+                response = self._client.post("/api/embed", json=self._payload(texts))
+                response.raise_for_status()
+                return self._to_array(response, len(texts))
+            except (httpx.HTTPStatusError, httpx.TransportError) as e:
+                if attempt == self.max_retries or not self._should_retry(e):
+                    raise
+                logger.warning(f"Embedding batch of {len(texts)} failed ({e}), retry {attempt + 1}/{self.max_retries}.")
+                time.sleep(self._backoff(attempt))
+
+    def embed_array(self, texts: List[str]) -> np.ndarray:
+        """Embed `texts` and return a contiguous (len(texts), dim) float32 array in input order."""
+        if not texts:
+            return np.empty((0, 0), dtype=np.float32)
+        batches = [texts[start:start + self.batch_size] for start in range(0, len(texts), self.batch_size)]
+        if len(batches) == 1:
+            return self._embed_batch(batches[0])
+        return np.vstack(list(self._executor.map(self._embed_batch, batches)))
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.embed_array(texts).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_array([text])[0].tolist()
+
+    # -----------------------
+    # Async API
+    # -----------------------
+    def _get_async_client(self):
+        if self._async_client is None:
+            limits = httpx.Limits(max_connections=self.max_concurrency, max_keepalive_connections=self.max_concurrency)
+            self._async_client = httpx.AsyncClient(base_url=self.base_url, timeout=self.timeout, limits=limits)
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._async_client
+
+    async def _aembed_batch(self, texts: List[str]) -> np.ndarray:
+        client = self._get_async_client()
+        async with self._semaphore:
+            for attempt in range(self.max_retries + 1):
+                try:
+                    response = await client.post("/api/embed", json=self._payload(texts))
+                    response.raise_for_status()
+                    return self._to_array(response, len(texts))
+                except (httpx.HTTPStatusError, httpx.TransportError) as e:
+                    if attempt == self.max_retries or not self._should_retry(e):
+                        raise
+                    logger.warning(f"Embedding batch of {len(texts)} failed ({e}), retry {attempt + 1}/{self.max_retries}.")
+                    await asyncio.sleep(self._backoff(attempt))
+
+    async def aembed_array(self, texts: List[str]) -> np.ndarray:
+        if not texts:
+            return np.empty((0, 0), dtype=np.float32)
+        batches = [texts[start:start + self.batch_size] for start in range(0, len(texts), self.batch_size)]
+        return np.vstack(await asyncio.gather(*(self._aembed_batch(batch) for batch in batches)))
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return (await self.aembed_array(texts)).tolist()
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return (await self.aembed_array([text]))[0].tolist()
+
+    def close(self):
+        self._client.close()
+        self._executor.shutdown(wait=False)
+
+
+_clients: Dict[tuple, OllamaEmbeddingClient] = {}
+_clients_lock = threading.Lock()
+
+
+def get_embedding_client(model: str = EMBEDDING_MODEL, base_url: str = OLLAMA_BASE_URL) -> OllamaEmbeddingClient:
+    """Return the process-wide client for `model`, so all managers share one connection pool."""
+    with _clients_lock:
+        if (model, base_url) not in _clients:
+            _clients[(model, base_url)] = OllamaEmbeddingClient(model=model, base_url=base_url)
+        return _clients[(model, base_url)]
@@ -0,0 +1,20 @@
+# app/utils/executor.py
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from app.utils.settings import BLOCKING_EXECUTOR_WORKERS
+
+#-----------------------------------------------------------------------------------------------------------#
+#   Bounded thread pool for blocking work on the request path (markdown rendering, PDF parsing, sync       #
+#   LangChain components). Keeping it separate from the default loop executor means a burst of slow        #
+#   tasks cannot starve FastAPI's own threadpool.                                                           #
+#-----------------------------------------------------------------------------------------------------------#
+
+_executor = ThreadPoolExecutor(max_workers=BLOCKING_EXECUTOR_WORKERS, thread_name_prefix="blocking")
+
+
+async def run_blocking(func, *args, **kwargs):
+    """Run `func(*args, **kwargs)` in the bounded executor and await its result."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, functools.partial(func, *args, **kwargs))
@@ -3,8 +3,9 @@ from langchain.chains.combine_documents import create_stuff_documents_chain
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain_ollama import OllamaLLM
 from langchain_core.runnables.history import RunnableWithMessageHistory
-from langchain_community.chat_message_histories import ChatMessageHistory
 from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.runnables import RunnableLambda
+from app.utils.session_cache import SessionHistoryCache
 
 
 class FAISSChromaManager:
@@ -13,7 +14,7 @@ class FAISSChromaManager:
         ## this for windows use anytherway to linux
         self.hybrid_manager = hybrid_manager
         self.llm = OllamaLLM(model="llama3.1:8b", base_url='http://ollama-container:11434')
-        self.store = {}  ## Statefully manage ChatHistory
+        self.store = SessionHistoryCache()  ## Bounded, evicting ChatHistory cache
         self.conversation_chain = None
         self.faiss_index = self
 
@@ -21,19 +22,18 @@ class FAISSChromaManager:
         """
         Get the session_id for Chat Message History.
         """
-        if session_id not in self.store:
-            self.store[session_id] = ChatMessageHistory()
+        history = self.store.get(session_id)
+        if history is None:
+            history = self.store.new_history()
+            self.store[session_id] = history
 
-        return self.store[session_id]
+        return history
     
     def update_session_history(self, session_id: str, user_message: str, bot_response: str) -> None:
         """
         Update session history with user and bot messages.
         """
-        if session_id in self.store:
-            history = self.store[session_id]
-            history.add_user_message(user_message)
-            history.add_ai_message(bot_response)
+        self.store.append_turn(session_id, user_message, bot_response)
         
     def retrieve_documents(self, session_id: str, user_query: str, top_k=4):
         return self.hybrid_manager.query_hybrid_index(user_query, top_k)
@@ -46,8 +46,8 @@ class FAISSChromaManager:
     
         
 
-        # Create retriever using hybrid index
-        #retriever = lambda query_text, top_k=4: hybrid_manager.query_hybrid_index(query_text, top_k)
+        # Create retriever using hybrid index (e.g. a HybridRetriever or AdvancedVectorRetriever)
+        retriever = RunnableLambda(lambda query_text: self.hybrid_manager.query_hybrid_index(query_text, 4))
 
         #retriever = self.vectordb.as_retriever(search_type = search_type, search_kwargs={"k":4, 'fetch_k': 100, 'lambda_mult':1})
 
@@ -174,17 +174,16 @@ class HybridChainManager:
         """
         Initialize the HybridChainManager.
         Args:
-            hybrid_manager: The HybridEmbeddingManager instance for hybrid retrieval.
+            hybrid_manager: Anything with query_hybrid_index(query_text, top_k), e.g. a HybridRetriever.
             llm: The language model instance (e.g., OllamaLLM).
         """
         ## this for windows use anytherway to linux
         #self.llm = OllamaLLM(model="llama3.2")
         self.llm = OllamaLLM(model="llama3.1:8b", base_url='http://ollama-container:11434')
-        self.store = {} ## Statefully manage ChatHistory
         self.conversation_chain = None
 
         self.hybrid_manager = hybrid_manager
-        self.session_histories = {}  # Store chat history by session ID
+        self.session_histories = SessionHistoryCache()  # Bounded chat history by session ID
 
     def retriever(self, query_text, top_k=4):
         """
@@ -207,8 +206,11 @@ class HybridChainManager:
         Returns:
             The bot's response.
         """
-        # Retrieve the session history
-        chat_history = self.session_histories.get(session_id, [])
+        # Retrieve the session history (only user/assistant turns are kept, not the per-turn system prompts)
+        history = self.session_histories.get(session_id)
+        if history is None:
+            history = self.session_histories.new_history()
+            self.session_histories[session_id] = history
 
         # Retrieve context using the query
         retrieved_documents = self.retriever(user_query, top_k)
@@ -220,17 +222,13 @@ class HybridChainManager:
         Answer in German. Keep responses relevant and accurate.
         """
 
-        # Append the retrieved documents to the chat history
-        chat_history.append({"role": "system", "content": system_prompt})
-        chat_history.append({"role": "user", "content": user_query})
+        # Send the system prompt with the retrieved documents, the previous turns and the new question
+        messages = [("system", system_prompt), *history.messages, ("human", user_query)]
 
         # Generate the bot's response
-        response = self.llm.chat(chat_history)
+        response = self.llm.invoke(messages)
 
-        # Add the bot's response to the chat history
-        chat_history.append({"role": "assistant", "content": response})
-
-        # Update the session history
-        self.session_histories[session_id] = chat_history
+        # Append the turn to the cached history in place
+        self.session_histories.append_turn(session_id, user_query, response)
 
         return response
@@ -0,0 +1,79 @@
+# app/utils/hybrid_retriever.py
+from typing import List, Optional
+
+import faiss
+import numpy as np
+from langchain_community.vectorstores import FAISS
+from langchain_core.callbacks import AsyncCallbackManagerForRetrieverRun, CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.stores import BaseStore
+
+from app.utils.executor import run_blocking
+from app.utils.settings import HYBRID_DENSE_WEIGHT, HYBRID_FETCH_K, HYBRID_RRF_K, HYBRID_SPARSE_WEIGHT
+from app.utils.sparse_index import SparseIndex, reciprocal_rank_fusion
+
+#-----------------------------------------------------------------------------------------------------------#
+#   Hybrid dense + BM25 retrieval in one pass.                                                              #
+#                                                                                                           #
+#   query -> embedding -> FAISS top fetch_k chunk ids ──┐                                                   #
+#   query -> tokens    -> BM25  top fetch_k chunk ids ──┴─> reciprocal-rank fusion -> top k                 #
+#                                                                                                           #
+#   With a docstore the fused chunks are child chunks: they are mapped to their parents (id_key in the     #
+#   metadata) in fused order and the first k distinct parents are read with one mget, like the              #
+#   ParentDocumentRetriever does for the dense results alone.                                               #
+#-----------------------------------------------------------------------------------------------------------#
+
+
+class HybridRetriever(BaseRetriever):
+    vectorstore: FAISS
+    sparse: SparseIndex
+    docstore: Optional[BaseStore] = None
+    id_key: str = "parent_id"
+    k: int = 4
+    fetch_k: int = HYBRID_FETCH_K
+    rrf_k: int = HYBRID_RRF_K
+    dense_weight: float = HYBRID_DENSE_WEIGHT
+    sparse_weight: float = HYBRID_SPARSE_WEIGHT
+
+    def _dense_ids(self, embedding: List[float]) -> List[str]:
+        vector = np.asarray([embedding], dtype=np.float32)
+        if self.vectorstore._normalize_L2:
+            faiss.normalize_L2(vector)
+        _, indices = self.vectorstore.index.search(vector, self.fetch_k)
+        return [self.vectorstore.index_to_docstore_id[i] for i in indices[0] if i != -1]
+
+    def _search(self, query: str, embedding: List[float]) -> List[Document]:
+        dense = self._dense_ids(embedding)
+        sparse = [id for id, _ in self.sparse.search(query, self.fetch_k)]
+        fused = reciprocal_rank_fusion([dense, sparse], [self.dense_weight, self.sparse_weight], k=self.rrf_k)
+
+        chunks = []
+        for id in fused:
+            chunk = self.vectorstore.docstore.search(id)
+            if isinstance(chunk, Document):
+                chunks.append(chunk)
+        if self.docstore is None:
+            return chunks[:self.k]
+
+        parent_ids = []
+        for chunk in chunks:
+            parent_id = chunk.metadata.get(self.id_key)
+            if parent_id is not None and parent_id not in parent_ids:
+                parent_ids.append(parent_id)
+                if len(parent_ids) == self.k:
+                    break
+        return [document for document in self.docstore.mget(parent_ids) if document is not None]
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        return self._search(query, self.vectorstore.embedding_function.embed_query(query))
+
+    async def _aget_relevant_documents(self, query: str, *,
+                                       run_manager: AsyncCallbackManagerForRetrieverRun) -> List[Document]:
+        embedding = await self.vectorstore.embedding_function.aembed_query(query)
+        # Index search and the docstore read block, keep them off the event loop
+        return await run_blocking(self._search, query, embedding)
+
+    def query_hybrid_index(self, query_text: str, top_k: int = 4) -> List[Document]:
+        """`top_k` fused results for `query_text` (interface used by FAISSChromaManager/HybridChainManager)."""
+        return self.model_copy(update={"k": top_k}).invoke(query_text)
@@ -0,0 +1,434 @@
+# app/utils/index_store.py
+import glob, os, json, shutil
+import logging
+import pickle
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, Optional
+
+import faiss
+import numpy as np
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores import FAISS
+
+from app.utils.ann_index import build_ann_index, default_search_params, flat_vectors, set_search_params
+from app.utils.chunk_store import CHUNK_STORE_NAME, ChunkStore, write_chunk_store
+from app.utils.docu_manager import DocumentManager, chunk_id, file_doc_id, file_sha256
+from app.utils.embedding_cache import get_embeddings
+from app.utils.parsing import parse_files
+from app.utils.quantized_index import RescoringIndex
+from app.utils.sparse_index import SPARSE_NAME, SparseIndex
+from app.utils.settings import (ANN_INDEX_TYPE, EMBEDDING_MODEL, FILES_DIR, INDEX_BLOCK_SIZE, INDEX_DIR,
+                                VECTOR_STORAGE)
+
+logger = logging.getLogger(__name__)
+
+#-----------------------------------------------------------------------------------------------------------#
+#   Layout on disk (one directory per store name):                                                          #
+#                                                                                                           #
+#       app/index/chunks/CURRENT                    -> name of the active version                          #
+#       app/index/chunks/TUNING                     -> query-time parameters chosen by tune_index.py        #
+#       app/index/chunks/<version>/index.faiss      -> ANN index searched by the API (mmap when supported), #
+#                                                      compact codes with VECTOR_STORAGE != float32         #
+#       app/index/chunks/<version>/vectors.npy      -> float32 vectors in index order (when index.faiss is  #
+#                                                      not flat): memory-mapped for the exact rescoring,    #
+#                                                      the source of the flat index for sync and tuning     #
+#       app/index/chunks/<version>/docstore/        -> chunk texts, ids and metadata in index order,        #
+#                                                      memory-mapped (chunk_store.py); versions written     #
+#                                                      before it have the pickled LangChain index.pkl       #
+#       app/index/chunks/<version>/sparse.pkl       -> BM25 inverted index over the same chunk ids          #
+#       app/index/chunks/<version>/manifest.json    -> embedding model + ingestion ledger: sha256 and       #
+#                                                      vector ids of every source file                      #
+#                                                                                                           #
+#   Versions are immutable. A new build is written to a temporary directory and published by replacing     #
+#   the CURRENT pointer, so a reader never sees a half written index.                                       #
+#-----------------------------------------------------------------------------------------------------------#
+
+MANIFEST_NAME = "manifest.json"
+CURRENT_NAME = "CURRENT"
+TUNING_NAME = "TUNING"
+EXACT_NAME = "vectors.npy"
+MANIFEST_FORMAT = 2
+
+
+class VectorIndexStore:
+    """Build, persist and load a versioned FAISS index for the documents in `source_dir`."""
+
+    # How files are parsed (see app/utils/parsing.py): one document per page
+    parse_mode = "pages"
+
+    def __init__(self, name="chunks", index_dir=INDEX_DIR, source_dir=FILES_DIR,
+                 embedding_model=EMBEDDING_MODEL, block_size=INDEX_BLOCK_SIZE,
+                 glob_pattern=['**/*.pdf', '**/*.docx', '**/*.txt'], index_type=ANN_INDEX_TYPE,
+                 storage=VECTOR_STORAGE):
+        self.name = name
+        self.root = Path(index_dir) / name
+        self.source_dir = source_dir
+        self.glob_pattern = glob_pattern
+        self.embedding_model = embedding_model
+        self.block_size = block_size
+        self.index_type = index_type
+        self.storage = storage
+        self.embedding = get_embeddings(self.embedding_model)
+        self.vectordb = None
+        self.sparse = None
+        self.manifest = None
+
+    # -----------------------
+    # Source files
+    # -----------------------
+    def list_sources(self):
+        """Return the sorted list of source files matching the glob patterns."""
+        paths = set()
+        for pattern in self.glob_pattern:
+            paths.update(glob.glob(os.path.join(self.source_dir, pattern), recursive=True))
+        return sorted(path for path in paths if os.path.isfile(path))
+
+    def scan_sources(self, previous: Optional[Dict[str, dict]] = None) -> Dict[str, dict]:
+        """
+        Fingerprint every source file.
+
+        The sha256 of a file is only recomputed when its size or mtime differ from the entry in
+        `previous`, so a restart on an unchanged corpus only stats the files.
+        """
+        previous = previous or {}
+        files = {}
+        for path in self.list_sources():
+            stat = os.stat(path)
+            entry = previous.get(path)
+            if entry and entry.get("size") == stat.st_size and entry.get("mtime") == stat.st_mtime:
+                files[path] = dict(entry)
+                continue
+            files[path] = {"sha256": file_sha256(path), "size": stat.st_size, "mtime": stat.st_mtime}
+        return files
+
+    # -----------------------
+    # Versions and manifests
+    # -----------------------
+    def current_version(self) -> Optional[str]:
+        """Return the name of the published version or None if nothing was built yet."""
+        pointer = self.root / CURRENT_NAME
+        if not pointer.exists():
+            return None
+        version = pointer.read_text().strip()
+        return version if (self.root / version / MANIFEST_NAME).exists() else None
+
+    def read_manifest(self, version: str) -> dict:
+        with open(self.root / version / MANIFEST_NAME, "r", encoding="utf-8") as file:
+            return json.load(file)
+
+    def doc_ids(self, manifest: Optional[dict] = None) -> set:
+        """doc_ids of all documents in a version (the current one by default)."""
+        manifest = manifest if manifest is not None else (self.manifest or {})
+        return {file_doc_id(path, entry["sha256"]) for path, entry in manifest.get("files", {}).items()}
+
+    def ann_matches(self, manifest: dict) -> bool:
+        """True if the ANN index of a version was built for the configured ANN_INDEX_TYPE and VECTOR_STORAGE."""
+        ann = manifest.get("ann", {})
+        return ann.get("requested", "flat") == self.index_type and ann.get("storage", "float32") == self.storage
+
+    def is_up_to_date(self, manifest: dict, files: Dict[str, dict]) -> bool:
+        """An index can be reused when it was built with the same model from the same file contents."""
+        if manifest.get("format") != MANIFEST_FORMAT or manifest.get("embedding_model") != self.embedding_model:
+            return False
+        if not self.ann_matches(manifest):
+            return False
+        indexed = {path: entry["sha256"] for path, entry in manifest.get("files", {}).items()}
+        return indexed == {path: entry["sha256"] for path, entry in files.items()}
+
+    def _publish(self, version: str) -> None:
+        """Atomically point CURRENT at `version`."""
+        tmp_pointer = self.root / f".{CURRENT_NAME}.tmp"
+        tmp_pointer.write_text(version)
+        os.replace(tmp_pointer, self.root / CURRENT_NAME)
+
+    # -----------------------
+    # Save / load
+    # -----------------------
+    def save(self, vectordb: FAISS, files: Dict[str, dict]) -> str:
+        """Write `vectordb` as a new immutable version and publish it."""
+        self.root.mkdir(parents=True, exist_ok=True)
+        version = datetime.now(timezone.utc).strftime("v%Y%m%d%H%M%S%f")
+        tmp_dir = self.root / f".{version}.tmp"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        tmp_dir.mkdir()
+
+        # vectordb holds the exact flat index; the ANN index searched by the API is derived from it
+        ann_index, ann = build_ann_index(vectordb.index, self.index_type, self.storage)
+        ann["requested"] = self.index_type
+        if ann_index is not vectordb.index:
+            np.save(tmp_dir / EXACT_NAME, flat_vectors(vectordb.index))
+        if isinstance(ann_index, faiss.IndexBinary):
+            faiss.write_index_binary(ann_index, str(tmp_dir / "index.faiss"))
+        else:
+            faiss.write_index(ann_index, str(tmp_dir / "index.faiss"))
+        del ann_index
+        # The chunks in index order instead of LangChain's pickled docstore, readers map them lazily
+        ids = [vectordb.index_to_docstore_id[position] for position in range(vectordb.index.ntotal)]
+        write_chunk_store(tmp_dir / CHUNK_STORE_NAME, ids, (vectordb.docstore.search(id) for id in ids))
+        if self.sparse is not None:
+            self.sparse.save(str(tmp_dir / SPARSE_NAME))
+        manifest = {
+            "format": MANIFEST_FORMAT,
+            "version": version,
+            "name": self.name,
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "embedding_model": self.embedding_model,
+            "num_vectors": vectordb.index.ntotal,
+            "ann": ann,
+            "files": files,
+        }
+        with open(tmp_dir / MANIFEST_NAME, "w", encoding="utf-8") as file:
+            json.dump(manifest, file, indent=2)
+
+        os.replace(tmp_dir, self.root / version)
+        self._publish(version)
+        self.manifest = manifest
+        logger.info(f"Published index '{self.name}' version {version} ({manifest['num_vectors']} vectors).")
+        return version
+
+    def prune_versions(self, keep: int = 3) -> None:
+        """Delete all but the `keep` newest versions; CURRENT is never deleted."""
+        current = self.current_version()
+        versions = sorted(path.name for path in self.root.glob("v*") if path.is_dir())
+        for version in versions[:-keep] if keep > 0 else versions:
+            if version != current:
+                # Readers that still mmap an old version keep their pages, the files are unlinked only
+                shutil.rmtree(self.root / version, ignore_errors=True)
+                logger.info(f"Removed old index '{self.name}' version {version}.")
+
+    def _read_faiss_index(self, path: str, mmap: bool, binary: bool = False):
+        """Read a faiss index, memory-mapping it when the index type supports it."""
+        read_index = faiss.read_index_binary if binary else faiss.read_index
+        if mmap:
+            try:
+                return read_index(path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+            except (RuntimeError, AttributeError) as e:
+                logger.info(f"mmap not supported for {path}, reading it into memory ({e}).")
+        return read_index(path)
+
+    def exact_vectors(self, version: str, mmap: bool = True) -> np.ndarray:
+        """(ntotal, d) float32 vectors of a version, memory-mapped from vectors.npy when it has one."""
+        version_dir = self.root / version
+        if (version_dir / EXACT_NAME).exists():
+            return np.load(version_dir / EXACT_NAME, mmap_mode="r" if mmap else None)
+        # Flat versions: index.faiss is the exact index. Copy its vectors out, a view would point into the
+        # index freed when this function returns
+        index = self._read_faiss_index(str(version_dir / "index.faiss"), mmap=False)
+        return index.reconstruct_n(0, index.ntotal)
+
+    def read_tuning(self) -> dict:
+        path = self.root / TUNING_NAME
+        if not path.exists():
+            return {}
+        with open(path, "r", encoding="utf-8") as file:
+            return json.load(file)
+
+    def write_tuning(self, tuning: dict) -> None:
+        """Store the parameters chosen by the tuner; they apply to every version with the same ANN factory."""
+        self.root.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.root / f".{TUNING_NAME}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            json.dump(tuning, file, indent=2)
+        os.replace(tmp_path, self.root / TUNING_NAME)
+
+    def search_params(self, manifest: dict) -> str:
+        """Tuned query-time parameters for the ANN index of `manifest`, or the defaults of its type."""
+        ann = manifest.get("ann", {"type": "flat"})
+        tuning = self.read_tuning()
+        if tuning.get("factory") == ann.get("factory") and tuning.get("params") is not None:
+            return tuning["params"]
+        return default_search_params(ann["type"])
+
+    def load(self, version: Optional[str] = None, mmap: bool = True, exact: bool = False) -> FAISS:
+        """
+        Load a published version (default: CURRENT) without touching the embedding model.
+        With `exact` the flat index of the vectors is loaded instead of the ANN index (for the sync).
+        Compact indexes (VECTOR_STORAGE, ivf_pq) are wrapped to rescore their candidates exactly. The chunks
+        stay memory-mapped in a read-only ChunkStore, except with `exact`, where the sync needs a mutable copy.
+        """
+        version = version or self.current_version()
+        if version is None:
+            raise FileNotFoundError(f"No published index found in {self.root}.")
+
+        version_dir = self.root / version
+        manifest = self.read_manifest(version)
+        ann = manifest.get("ann", {})
+        if exact and (version_dir / EXACT_NAME).exists():
+            vectors = self.exact_vectors(version, mmap=False)
+            index = faiss.IndexFlatL2(vectors.shape[1])
+            index.add(np.ascontiguousarray(vectors, dtype=np.float32))
+            del vectors
+        else:
+            index = self._read_faiss_index(str(version_dir / "index.faiss"), mmap=mmap,
+                                           binary=ann.get("storage") == "binary")
+            set_search_params(index, self.search_params(manifest))
+            if ann.get("rescore") and (version_dir / EXACT_NAME).exists():
+                index = RescoringIndex(index, self.exact_vectors(version, mmap=mmap))
+        if (version_dir / CHUNK_STORE_NAME).exists():
+            chunk_store = ChunkStore(version_dir / CHUNK_STORE_NAME)
+            if exact:
+                docstore = InMemoryDocstore(dict(chunk_store.items()))
+                index_to_docstore_id = dict(enumerate(chunk_store.ids()))
+            else:
+                docstore, index_to_docstore_id = chunk_store, chunk_store.index_ids()
+        else:
+            with open(version_dir / "index.pkl", "rb") as file:
+                docstore, index_to_docstore_id = pickle.load(file)
+
+        self.vectordb = FAISS(
+            embedding_function=self.embedding,
+            index=index,
+            docstore=docstore,
+            index_to_docstore_id=index_to_docstore_id,
+        )
+        sparse_path = version_dir / SPARSE_NAME
+        if sparse_path.exists():
+            self.sparse = SparseIndex.load(str(sparse_path))
+        else:
+            # Versions written before the sparse index existed: index the chunks of the docstore once
+            logger.info(f"No sparse index in version {version}, building it from the docstore.")
+            documents = dict(docstore.items()) if isinstance(docstore, ChunkStore) else docstore._dict
+            self.sparse = SparseIndex.from_documents(documents)
+        self.manifest = manifest
+        logger.info(f"Loaded index '{self.name}' version {version} ({index.ntotal} vectors).")
+        return self.vectordb
+
+    # -----------------------
+    # Build / incremental sync
+    # -----------------------
+    def _empty_vectordb(self) -> FAISS:
+        """Create an empty index with the dimension of the embedding model."""
+        dimension = len(self.embedding.embed_query("dimension probe"))
+        return FAISS(
+            embedding_function=self.embedding,
+            index=faiss.IndexFlatL2(dimension),
+            docstore=InMemoryDocstore(),
+            index_to_docstore_id={},
+        )
+
+    def diff_sources(self, indexed: Dict[str, dict], files: Dict[str, dict]):
+        """Split the scanned files into (added, changed, removed) paths compared to the ledger."""
+        added = [path for path in files if path not in indexed]
+        changed = [path for path in files if path in indexed and indexed[path]["sha256"] != files[path]["sha256"]]
+        removed = [path for path in indexed if path not in files]
+        return added, changed, removed
+
+    def make_document_manager(self):
+        return DocumentManager(directory_path=self.source_dir, glob_pattern=self.glob_pattern)
+
+    def split_documents(self, document_manager: DocumentManager, path: str, documents: list):
+        """Split the parsed documents of one file into the chunks that are embedded."""
+        if not documents:
+            return []
+        # The splitter directly, split_document would keep the chunks on the manager
+        return document_manager.text_splitter().split_documents(documents)
+
+    def split_file(self, document_manager: DocumentManager, path: str, sha256: str):
+        """Parse and split one file into chunks tagged with its stable doc_id."""
+        documents = document_manager.load_file(path, doc_id=file_doc_id(path, sha256))
+        return self.split_documents(document_manager, path, documents)
+
+    def add_block(self, vectordb: FAISS, pending: list, ledger: Dict[str, dict], files: Dict[str, dict]) -> None:
+        """Embed the chunks of the pending files as one block and append it to the index."""
+        file_ids = {path: [chunk_id(chunk.metadata["doc_id"], i) for i, chunk in enumerate(file_chunks)]
+                    for path, file_chunks in pending}
+        chunks = [chunk for _, file_chunks in pending for chunk in file_chunks]
+        if chunks:
+            texts = [chunk.page_content for chunk in chunks]
+            vectors = self.embedding.embed_array(texts)
+            # Same private add LangChain uses internally, but fed with one contiguous float32 block
+            ids = [id for path, _ in pending for id in file_ids[path]]
+            vectordb._FAISS__add(texts, vectors, metadatas=[chunk.metadata for chunk in chunks], ids=ids)
+            self.sparse.add(ids, texts)
+        for path, _ in pending:
+            ledger[path] = dict(files[path], ids=file_ids[path])
+        pending.clear()
+
+    def sync(self, rebuild: bool = False) -> FAISS:
+        """
+        Bring the published index in line with the source directory.
+
+        Only new or changed files are parsed, split and embedded; vectors of changed and removed files
+        are deleted by the ids recorded in the ledger. With `rebuild=True` every file is re-embedded.
+        The published version is only read into memory when a file changed or the ANN settings differ.
+        Files stream through parse -> split -> embed -> add in blocks of `block_size` chunks, so only one
+        block (plus the files being parsed) is held in memory at a time.
+        """
+        version = None if rebuild else self.current_version()
+        manifest = self.read_manifest(version) if version else None
+        incremental = bool(manifest and manifest.get("format") == MANIFEST_FORMAT
+                           and manifest.get("embedding_model") == self.embedding_model)
+        indexed = manifest["files"] if incremental else {}
+
+        # Diff against the ledger first: the vectors and chunks are only read when there is something to do
+        files = self.scan_sources(previous=indexed)
+        added, changed, removed = self.diff_sources(indexed, files)
+        logger.info(f"Sync index '{self.name}': {len(added)} added, {len(changed)} changed, {len(removed)} removed files.")
+        if incremental and not (added or changed or removed) and self.ann_matches(manifest):
+            if self.manifest is not None and self.manifest.get("version") == version:
+                return self.vectordb
+            return self.load(version)
+
+        if incremental:
+            vectordb = self.load(version, mmap=False, exact=True)
+        else:
+            vectordb = self._empty_vectordb()
+            self.sparse = SparseIndex()
+
+        stale = {path: indexed[path] for path in changed + removed}
+        stale_ids = [id for entry in stale.values() for id in entry.get("ids", [])]
+        if stale_ids:
+            vectordb.delete(stale_ids)
+            self.sparse.remove(stale_ids)
+
+        # Unchanged files keep their ledger entry, failed files are left out so the next sync retries them
+        ledger = {path: dict(indexed[path], **files[path]) for path in files
+                  if path in indexed and path not in changed}
+        document_manager = self.make_document_manager()
+        pending, pending_chunks = [], 0
+        # Files are parsed in parallel on a process pool, results arrive as soon as each file is done
+        to_parse = [(path, file_doc_id(path, files[path]["sha256"])) for path in added + changed]
+        for result in parse_files(to_parse, mode=self.parse_mode):
+            path = result.path
+            if not result.ok:
+                continue
+            try:
+                file_chunks = self.split_documents(document_manager, path, result.documents)
+            except Exception as e:
+                logger.error(f"Could not split {path}: {e}", exc_info=True)
+                continue
+            files[path]["parse_seconds"] = round(result.seconds, 3)
+            pending.append((path, file_chunks))
+            pending_chunks += len(file_chunks)
+            if pending_chunks >= self.block_size:
+                self.add_block(vectordb, pending, ledger, files)
+                pending_chunks = 0
+        self.add_block(vectordb, pending, ledger, files)
+
+        self.save(vectordb, ledger)
+        self.release(stale)
+        self.vectordb = vectordb
+        return vectordb
+
+    def release(self, stale: Dict[str, dict]) -> None:
+        """Called with the old ledger entries of changed and removed files once the new version is published."""
+
+    def build(self) -> FAISS:
+        """Embed the whole corpus from scratch and publish it as a new version."""
+        return self.sync(rebuild=True)
+
+    def load_or_build(self) -> FAISS:
+        """Memory-map the published index when the source files are unchanged, otherwise sync it incrementally."""
+        version = self.current_version()
+        manifest = self.read_manifest(version) if version else None
+        files = self.scan_sources(previous=manifest.get("files") if manifest else None)
+
+        if manifest and self.is_up_to_date(manifest, files):
+            return self.load(version)
+
+        if manifest:
+            logger.info(f"Source files changed since version {version}, updating index '{self.name}'.")
+        self.sync()
+        # Serve the freshly published version read-only, like every other reader
+        return self.load()
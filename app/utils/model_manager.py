@@ -0,0 +1,223 @@
+# app/utils/model_manager.py
+import asyncio
+import logging
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Dict, Iterable, Optional, Set
+
+import httpx
+
+from app.utils.settings import (DEFAULT_KEEP_ALIVE, MODEL_KEEP_ALIVE, MODEL_MAX_ACTIVE, MODEL_PS_REFRESH_SECONDS,
+                                OLLAMA_BASE_URL, WARMUP_MODELS)
+
+logger = logging.getLogger(__name__)
+
+#-----------------------------------------------------------------------------------------------------------#
+#   Ollama model residency.                                                                                 #
+#                                                                                                           #
+#   - keep_alive per model (MODEL_KEEP_ALIVE), passed to every request so Ollama does not unload a model    #
+#     after its default 5 minutes                                                                           #
+#   - preload of WARMUP_MODELS at startup                                                                   #
+#   - resident models from /api/ps, refreshed at most every MODEL_PS_REFRESH_SECONDS                        #
+#   - with MODEL_MAX_ACTIVE > 0 at most that many different models generate at the same time. A request     #
+#     for another model waits until the running ones drained and later requests do not overtake it. When   #
+#     a model is switched in, every request already waiting for it runs in that batch, so two large models  #
+#     are swapped once per batch instead of on every request.                                               #
+#-----------------------------------------------------------------------------------------------------------#
+
+
+def parse_model_map(value: str) -> Dict[str, str]:
+    """Parse "model=value,..." settings (keep_alive as Ollama expects it, e.g. 30m, 2h or -1 for forever)."""
+    mapping = {}
+    for item in value.split(","):
+        if "=" in item:
+            model, keep_alive = item.rsplit("=", 1)
+            mapping[model.strip()] = keep_alive.strip()
+    return mapping
+
+
+_keep_alive = parse_model_map(MODEL_KEEP_ALIVE)
+
+
+def get_keep_alive(model: str) -> str:
+    return _keep_alive.get(model, DEFAULT_KEEP_ALIVE)
+
+
+class ModelStats:
+    def __init__(self):
+        self.requests = 0
+        self.inflight = 0
+        self.queued = 0
+        self.loads = 0
+        self.load_seconds_total = 0.0
+        self.load_seconds_last: Optional[float] = None
+        self.load_seconds_max = 0.0
+        self.wait_seconds_max = 0.0
+
+    def record_load(self, seconds: float) -> None:
+        self.loads += 1
+        self.load_seconds_total += seconds
+        self.load_seconds_last = seconds
+        self.load_seconds_max = max(self.load_seconds_max, seconds)
+
+
+class ModelManager:
+    """Keeps the configured models loaded in Ollama and schedules requests so large models do not thrash."""
+
+    def __init__(self, base_url=OLLAMA_BASE_URL, max_active=MODEL_MAX_ACTIVE, ps_refresh=MODEL_PS_REFRESH_SECONDS):
+        self.base_url = base_url
+        self.max_active = max_active
+        self.ps_refresh = ps_refresh
+        self.stats_by_model: Dict[str, ModelStats] = {}
+        self.resident: Set[str] = set()
+        self._resident_at = 0.0
+        self._client: Optional[httpx.AsyncClient] = None
+        # Scheduling state, only touched on the event loop
+        self._active: Dict[str, int] = {}
+        self._activated_at: Dict[str, int] = {}  # last ticket issued when a model became active
+        self._waiting = deque()  # [ticket, model] in arrival order
+        self._ticket = 0
+        self._condition: Optional[asyncio.Condition] = None
+        self._loading: Dict[str, asyncio.Task] = {}
+
+    def _stats(self, model: str) -> ModelStats:
+        return self.stats_by_model.setdefault(model, ModelStats())
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            # Loading a 32B model from disk can take minutes
+            self._client = httpx.AsyncClient(base_url=self.base_url, timeout=600)
+        return self._client
+
+    # -----------------------
+    # Residency
+    # -----------------------
+    async def refresh_resident(self, force=False) -> Set[str]:
+        """Models currently loaded in Ollama (GET /api/ps), cached for `ps_refresh` seconds."""
+        if force or time.monotonic() - self._resident_at > self.ps_refresh:
+            try:
+                response = await self.client.get("/api/ps")
+                response.raise_for_status()
+                self.resident = {model["name"] for model in response.json().get("models", [])}
+                self._resident_at = time.monotonic()
+            except httpx.HTTPError as e:
+                logger.warning(f"Could not read the loaded models from Ollama: {e}")
+        return self.resident
+
+    async def _load(self, model: str) -> None:
+        started = time.perf_counter()
+        # A generate request without a prompt only loads the model and sets its keep_alive
+        response = await self.client.post("/api/generate", json={"model": model, "keep_alive": get_keep_alive(model)})
+        response.raise_for_status()
+        seconds = time.perf_counter() - started
+        self._stats(model).record_load(seconds)
+        # Ollama may have evicted other models to make room
+        await self.refresh_resident(force=True)
+        self.resident.add(model)
+        logger.info(f"Loaded model {model} in {seconds:.1f}s (keep_alive {get_keep_alive(model)}).")
+
+    async def ensure_loaded(self, model: str) -> None:
+        """Load `model` unless Ollama has it resident; concurrent callers share one load."""
+        if model in await self.refresh_resident():
+            return
+        task = self._loading.get(model)
+        if task is None:
+            task = asyncio.ensure_future(self._load(model))
+            self._loading[model] = task
+            task.add_done_callback(lambda _: self._loading.pop(model, None))
+        await asyncio.shield(task)
+
+    async def preload(self, models: Iterable[str] = WARMUP_MODELS) -> None:
+        """Load the models one after another (loading several at once only competes for disk and VRAM)."""
+        await self.refresh_resident(force=True)
+        for model in models:
+            await self.ensure_loaded(model)
+
+    # -----------------------
+    # Scheduling
+    # -----------------------
+    def _can_start(self, ticket: int, model: str) -> bool:
+        if self.max_active <= 0:
+            return True
+        if model in self._active and ticket <= self._activated_at[model]:
+            # Was already waiting when its model was switched in, runs in the same batch
+            return True
+        for waiting_ticket, waiting_model in self._waiting:
+            if waiting_ticket == ticket:
+                break
+            if waiting_model not in self._active:
+                # An earlier request waits for a model switch, nobody overtakes it
+                return False
+        return model in self._active or len(self._active) < self.max_active
+
+    @asynccontextmanager
+    async def use(self, model: str):
+        """Hold a generation slot for `model` and make sure it is loaded."""
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        stats = self._stats(model)
+        stats.requests += 1
+        self._ticket += 1
+        entry = (self._ticket, model)
+        waited = time.monotonic()
+        async with self._condition:
+            self._waiting.append(entry)
+            stats.queued += 1
+            try:
+                await self._condition.wait_for(lambda: self._can_start(entry[0], model))
+            finally:
+                self._waiting.remove(entry)
+                stats.queued -= 1
+                # Waiters behind this one may be able to start now
+                self._condition.notify_all()
+            if model not in self._active:
+                self._activated_at[model] = self._ticket
+            self._active[model] = self._active.get(model, 0) + 1
+        stats.inflight += 1
+        stats.wait_seconds_max = max(stats.wait_seconds_max, time.monotonic() - waited)
+        try:
+            await self.ensure_loaded(model)
+            yield
+        finally:
+            stats.inflight -= 1
+            async with self._condition:
+                self._active[model] -= 1
+                if not self._active[model]:
+                    del self._active[model]
+                    del self._activated_at[model]
+                self._condition.notify_all()
+
+    def stats(self) -> dict:
+        return {
+            "max_active": self.max_active,
+            "active": dict(self._active),
+            "resident": sorted(self.resident),
+            "models": {
+                model: {
+                    "keep_alive": get_keep_alive(model),
+                    "resident": model in self.resident,
+                    "requests": stats.requests,
+                    "inflight": stats.inflight,
+                    "queue_depth": stats.queued,
+                    "max_wait_seconds": round(stats.wait_seconds_max, 2),
+                    "loads": stats.loads,
+                    "load_seconds_last": round(stats.load_seconds_last, 2) if stats.load_seconds_last is not None else None,
+                    "load_seconds_avg": round(stats.load_seconds_total / stats.loads, 2) if stats.loads else None,
+                    "load_seconds_max": round(stats.load_seconds_max, 2),
+                }
+                for model, stats in self.stats_by_model.items()
+            },
+        }
+
+
+_model_manager: Optional[ModelManager] = None
+
+
+def get_model_manager() -> ModelManager:
+    """Process-wide model manager (its scheduling state lives on the event loop of this worker)."""
+    global _model_manager
+    if _model_manager is None:
+        _model_manager = ModelManager()
+    return _model_manager
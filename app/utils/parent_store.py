@@ -0,0 +1,138 @@
+# app/utils/parent_store.py
+import logging
+from typing import Dict, Optional, Union
+
+from langchain.retrievers import ParentDocumentRetriever
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from langchain_community.vectorstores import FAISS
+from langchain_core.stores import BaseStore
+
+from app.database.docstore import PostgresStore
+from app.utils.docu_manager import AdvancedDocumentManager
+from app.utils.hybrid_retriever import HybridRetriever
+from app.utils.index_store import VectorIndexStore
+from app.utils.settings import EMBEDDING_MODEL, FILES_DIR, HYBRID_SEARCH_ENABLED
+from app.utils.sparse_index import SparseIndex
+
+logger = logging.getLogger(__name__)
+
+#-----------------------------------------------------------------------------------------------------------#
+#   Persistent ParentDocumentRetriever.                                                                     #
+#                                                                                                           #
+#   child chunks (400 chars)  -> versioned FAISS index in app/index/parents/ (VectorIndexStore)             #
+#   parent chunks (3000 chars) -> `docstore` table in Postgres, key = <doc_id>-p<position>                  #
+#                                                                                                           #
+#   The doc_id contains the content hash of the file, so parent keys never change meaning: parents of a     #
+#   new or changed file are written before the child vectors that point to them are published, and the     #
+#   parents of changed or removed files are deleted only after the new version is live. The ledger in the   #
+#   manifest records the parent keys of every file next to its child vector ids.                            #
+#-----------------------------------------------------------------------------------------------------------#
+
+# Parent keys checked in the docstore before an existing version is reused
+DOCSTORE_PROBE_KEYS = 32
+
+
+def parent_key(doc_id: str, position: int) -> str:
+    """Stable docstore key of the n-th parent chunk of a document."""
+    return f"{doc_id}-p{position}"
+
+
+class ParentIndexStore(VectorIndexStore):
+    """Child vectors on disk and parent documents in the docstore, published together as one version."""
+
+    # One document per PDF with page markers, like AdvancedDocumentManager.load_file
+    parse_mode = "document"
+
+    def __init__(self, name="parents", source_dir=FILES_DIR, embedding_model=EMBEDDING_MODEL,
+                 docstore: Optional[BaseStore] = None, id_key="parent_id", glob_pattern=['**/*.pdf'], **kwargs):
+        super().__init__(name=name, source_dir=source_dir, embedding_model=embedding_model,
+                         glob_pattern=glob_pattern, **kwargs)
+        self.docstore = docstore if docstore is not None else PostgresStore()
+        self.id_key = id_key
+        self.parent_splitter = RecursiveCharacterTextSplitter(chunk_size=3000)
+        self.child_splitter = RecursiveCharacterTextSplitter(chunk_size=400, add_start_index=True)
+        # path -> [(parent key, parent document)] of the files split but not yet written
+        self._pending_parents: Dict[str, list] = {}
+
+    def make_document_manager(self):
+        return AdvancedDocumentManager(directory_path=self.source_dir, glob_pattern=self.glob_pattern)
+
+    def split_documents(self, document_manager: AdvancedDocumentManager, path: str, documents: list):
+        """Split one file into parents (kept for the docstore) and children (returned for embedding)."""
+        if not documents:
+            return []
+
+        doc_id = documents[0].metadata["doc_id"]
+        parents, children = [], []
+        for position, parent in enumerate(self.parent_splitter.split_documents(documents)):
+            key = parent_key(doc_id, position)
+            parents.append((key, parent))
+            for child in self.child_splitter.split_documents([parent]):
+                child.metadata = {"source": parent.metadata.get("source"), "doc_id": doc_id, self.id_key: key}
+                children.append(child)
+        self._pending_parents[path] = parents
+        return children
+
+    def add_block(self, vectordb: FAISS, pending: list, ledger: Dict[str, dict], files: Dict[str, dict]) -> None:
+        """Write the parents of the pending files, then embed and add their children."""
+        parents = [pair for path, _ in pending for pair in self._pending_parents.get(path, [])]
+        if parents:
+            self.docstore.mset(parents)
+        paths = [path for path, _ in pending]
+        super().add_block(vectordb, pending, ledger, files)
+        for path in paths:
+            ledger[path]["parents"] = [key for key, _ in self._pending_parents.pop(path, [])]
+
+    def release(self, stale: Dict[str, dict]) -> None:
+        """Delete the parents of changed and removed files, nothing references them anymore."""
+        keys = [key for entry in stale.values() for key in entry.get("parents", [])]
+        if keys:
+            self.docstore.mdelete(keys)
+            logger.info(f"Removed {len(keys)} parent documents of {len(stale)} changed or removed files.")
+
+    def build(self) -> FAISS:
+        """Rebuild from scratch and drop the parents of the previous version that are no longer used."""
+        version = self.current_version()
+        previous = self.read_manifest(version).get("files", {}) if version else {}
+        vectordb = super().build()
+        current = {key for entry in self.manifest["files"].values() for key in entry.get("parents", [])}
+        self.release({path: {"parents": [key for key in entry.get("parents", []) if key not in current]}
+                      for path, entry in previous.items()})
+        return vectordb
+
+    def docstore_complete(self, manifest: dict) -> bool:
+        """Check a sample of the parents of a version in the docstore (they are gone after a database reset)."""
+        keys = [key for entry in manifest.get("files", {}).values() for key in entry.get("parents", [])]
+        probe = keys[:: max(len(keys) // DOCSTORE_PROBE_KEYS, 1)][:DOCSTORE_PROBE_KEYS]
+        return not probe or all(document is not None for document in self.docstore.mget(probe))
+
+    def load_or_build(self) -> FAISS:
+        """Reattach to the published version, syncing changed files; rebuild if the docstore lost its parents."""
+        version = self.current_version()
+        if version and not self.docstore_complete(self.read_manifest(version)):
+            # The child vectors point to parents that are gone, an incremental sync cannot repair that
+            logger.warning(f"Docstore is missing parents of index '{self.name}' version {version}, rebuilding.")
+            self.build()
+            return self.load()
+        return super().load_or_build()
+
+    def as_retriever(self, vectordb: Optional[FAISS] = None, hybrid: bool = HYBRID_SEARCH_ENABLED,
+                     sparse: Optional[SparseIndex] = None, **search_kwargs) -> Union[HybridRetriever, ParentDocumentRetriever]:
+        """
+        Parent retriever on top of the loaded child index and the persistent docstore: dense + BM25 with
+        reciprocal-rank fusion when `hybrid`, otherwise the plain dense ParentDocumentRetriever.
+        """
+        vectordb = vectordb if vectordb is not None else self.vectordb
+        sparse = sparse if sparse is not None else self.sparse
+        if hybrid and sparse is not None:
+            return HybridRetriever(vectorstore=vectordb, sparse=sparse, docstore=self.docstore,
+                                   id_key=self.id_key, **search_kwargs)
+        return ParentDocumentRetriever(
+            vectorstore=vectordb,
+            docstore=self.docstore,
+            id_key=self.id_key,
+            parent_splitter=self.parent_splitter,
+            child_splitter=self.child_splitter,
+            child_metadata_fields=["source", "doc_id"],
+            search_kwargs=search_kwargs,
+        )
@@ -0,0 +1,191 @@
+# app/utils/parsing.py
+import logging
+import multiprocessing
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from dataclasses import dataclass, field
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+import PyPDF2
+from langchain_community.document_loaders import Docx2txtLoader, PyMuPDFLoader, TextLoader
+from langchain_core.documents import Document
+
+from app.utils.settings import PARSE_TIMEOUT_SECONDS, PARSE_WORKERS
+
+logger = logging.getLogger(__name__)
+
+#-----------------------------------------------------------------------------------------------------------#
+#   Document parsing, in-process for single files and on a process pool for whole directories.             #
+#                                                                                                           #
+#   mode "pages":    one Document per page (PyMuPDF / docx2txt / plain text), used by DocumentManager       #
+#   mode "document": one Document per PDF with page markers (PyPDF2), used by AdvancedDocumentManager      #
+#                                                                                                           #
+#   Page texts are produced by generators and joined once. On the pool every file is parsed in its own     #
+#   task: a broken file only fails itself, a file that takes longer than PARSE_TIMEOUT_SECONDS is given up. #
+#   A hung worker cannot be killed alone without breaking the pool, so the pool is replaced right away and  #
+#   the other unfinished files are resubmitted to the new one with a fresh deadline; no file waits behind   #
+#   a stuck worker. The workers are spawned (not forked) because the API process holds thread pools and     #
+#   open connections.                                                                                       #
+#-----------------------------------------------------------------------------------------------------------#
+
+PAGE_MARKER = "\n---------- New Page Started (Page No.: {page}) ----------\n{text}\n"
+
+
+@dataclass
+class ParseResult:
+    path: str
+    documents: List[Document] = field(default_factory=list)
+    seconds: float = 0.0
+    error: Optional[str] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+# -----------------------
+# Parsers (generators of page texts / documents)
+# -----------------------
+def iter_pdf_pages(path: str) -> Iterator[str]:
+    """Yield the text of every PDF page wrapped in the page marker used by the parent retriever."""
+    with open(path, 'rb') as file:
+        reader = PyPDF2.PdfReader(file)
+        for page_num, page in enumerate(reader.pages):
+            text = page.extract_text()
+            if text:
+                yield PAGE_MARKER.format(page=page_num + 1, text=text)
+
+
+def iter_page_documents(path: str) -> Iterator[Document]:
+    """Yield one Document per page (or per file for docx/txt) with the matching LangChain loader."""
+    if path.endswith('.pdf'):
+        loader = PyMuPDFLoader(path)
+    elif path.endswith('.docx'):
+        loader = Docx2txtLoader(path)
+    elif path.endswith('.txt'):
+        loader = TextLoader(path)
+    else:
+        logger.warning(f'Please check documets format: {path}')
+        return
+    yield from loader.lazy_load()
+
+
+def parse_file(path: str, doc_id: str, mode: str = "pages") -> List[Document]:
+    """Parse one file into documents tagged with `doc_id`."""
+    if mode == "document":
+        if not path.endswith('.pdf'):
+            return []
+        full_text = "".join(iter_pdf_pages(path))
+        if not full_text:
+            return []
+        return [Document(page_content=full_text, metadata={'source': path, "doc_id": doc_id})]
+
+    documents = []
+    for document in iter_page_documents(path):
+        document.metadata["doc_id"] = doc_id
+        documents.append(document)
+    return documents
+
+
+def _parse_task(path: str, doc_id: str, mode: str) -> ParseResult:
+    """Pool task: never raises, so one broken file cannot take the run down."""
+    started = time.perf_counter()
+    try:
+        documents = parse_file(path, doc_id, mode)
+        return ParseResult(path, documents, time.perf_counter() - started)
+    except Exception as e:
+        return ParseResult(path, [], time.perf_counter() - started, f"{type(e).__name__}: {e}")
+
+
+# -----------------------
+# Process pool
+# -----------------------
+def _kill_workers(executor: ProcessPoolExecutor) -> None:
+    """Terminate workers that are stuck on a timed out file (the executor has no public API for this)."""
+    for process in list(getattr(executor, "_processes", {}).values()):
+        if process.is_alive():
+            process.terminate()
+
+
+def _ready() -> None:
+    """No-op task, run once per worker to start it."""
+
+
+def _new_executor(workers: int) -> ProcessPoolExecutor:
+    """Pool with all `workers` processes spawned and imported, so no file's timeout pays for a worker start."""
+    executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+    wait([executor.submit(_ready) for _ in range(workers)])
+    return executor
+
+
+def parse_files(files: Iterable[Tuple[str, str]], mode: str = "pages", workers: int = PARSE_WORKERS,
+                timeout: float = PARSE_TIMEOUT_SECONDS) -> Iterator[ParseResult]:
+    """
+    Parse (path, doc_id) pairs on a process pool and yield a ParseResult per file as soon as it is done.
+
+    At most `workers` files are in flight and every worker is free when a file is submitted, so the
+    timeout of a file starts when a worker picks it up and finished documents do not pile up in memory
+    while the consumer is still busy.
+    """
+    files = list(files)
+    if not files:
+        return
+    workers = max(1, min(workers, len(files)))
+    if workers == 1:
+        for path, doc_id in files:
+            result = _parse_task(path, doc_id, mode)
+            _log_result(result)
+            yield result
+        return
+
+    executor = _new_executor(workers)
+    started_at = time.perf_counter()
+    try:
+        queue = deque(files)
+        in_flight = {}
+        while True:
+            while len(in_flight) < workers and queue:
+                path, doc_id = queue.popleft()
+                in_flight[executor.submit(_parse_task, path, doc_id, mode)] = (path, doc_id, time.monotonic() + timeout)
+            if not in_flight:
+                break
+
+            next_deadline = min(deadline for _, _, deadline in in_flight.values())
+            wait(in_flight, timeout=max(next_deadline - time.monotonic(), 0), return_when=FIRST_COMPLETED)
+            now = time.monotonic()
+            expired = [future for future, (_, _, deadline) in in_flight.items() if not future.done() and deadline <= now]
+            for future in [future for future in in_flight if future.done()]:
+                path, _, _ = in_flight.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:  # worker died (e.g. segfault in a PDF library)
+                    result = ParseResult(path, [], 0.0, f"{type(e).__name__}: {e}")
+                _log_result(result)
+                yield result
+            if not expired:
+                continue
+
+            for future in expired:
+                path, _, _ = in_flight.pop(future)
+                result = ParseResult(path, [], timeout, f"Timed out after {timeout:.0f} seconds")
+                _log_result(result)
+                yield result
+            # Replace the pool: the stuck workers are killed now, the files still running on the other
+            # workers start over on the new pool
+            queue.extendleft(reversed([(path, doc_id) for path, doc_id, _ in in_flight.values()]))
+            in_flight.clear()
+            _kill_workers(executor)
+            executor.shutdown(wait=False, cancel_futures=True)
+            executor = _new_executor(workers)
+    finally:
+        _kill_workers(executor)
+        executor.shutdown(wait=False, cancel_futures=True)
+        logger.info(f"Parsed {len(files)} files with {workers} workers in {time.perf_counter() - started_at:.1f}s.")
+
+
+def _log_result(result: ParseResult) -> None:
+    if result.ok:
+        logger.info(f"Parsed {result.path} in {result.seconds:.2f}s ({len(result.documents)} documents).")
+    else:
+        logger.error(f"Could not parse {result.path} after {result.seconds:.2f}s: {result.error}")
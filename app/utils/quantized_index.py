@@ -0,0 +1,86 @@
+# app/utils/quantized_index.py
+from typing import Optional, Tuple
+
+import faiss
+import numpy as np
+
+from app.utils.settings import RESCORE_FACTOR
+
+#-----------------------------------------------------------------------------------------------------------#
+#   Two-stage search over compact vectors.                                                                  #
+#                                                                                                           #
+#   storage   coarse index holds            bytes / dim   bge-m3 (1024 dims) per vector                     #
+#   float32   full vectors                  4             4096 B                                            #
+#   float16   SQfp16                        2             2048 B   (2x)                                     #
+#   int8      SQ8 (scalar quantized)        1             1024 B   (4x)                                     #
+#   binary    sign bits, Hamming distance   1/8            128 B   (32x)                                    #
+#   (ivf_pq stores PQ codes whatever the storage is)                                                        #
+#                                                                                                           #
+#   The coarse pass returns k * RESCORE_FACTOR candidates, which are rescored with the exact squared L2     #
+#   distance against the float32 vectors in vectors.npy. That file is memory-mapped: only the rows of the   #
+#   candidates are paged in, the resident memory is the coarse index.                                       #
+#-----------------------------------------------------------------------------------------------------------#
+
+STORAGE_TYPES = ("float32", "float16", "int8", "binary")
+
+# faiss codec of the vectors inside flat/HNSW/IVF indexes
+STORAGE_CODECS = {"float32": "Flat", "float16": "SQfp16", "int8": "SQ8"}
+
+
+def binarize(vectors: np.ndarray) -> np.ndarray:
+    """One bit per dimension (component > 0), packed to uint8 as faiss binary indexes expect."""
+    return np.packbits(np.asarray(vectors) > 0, axis=1)
+
+
+def index_nbytes(index) -> int:
+    """Serialized (= resident) size of a faiss index."""
+    if isinstance(index, RescoringIndex):
+        index = index.coarse
+    if isinstance(index, faiss.IndexBinary):
+        return len(faiss.serialize_index_binary(index))
+    return len(faiss.serialize_index(index))
+
+
+class RescoringIndex:
+    """
+    faiss-like index (search/reconstruct/ntotal/d) that searches the compact `coarse` index and reranks
+    its candidates exactly against `vectors`, so LangChain's FAISS wrapper can use it unchanged.
+    """
+
+    def __init__(self, coarse, vectors: np.ndarray, factor: int = RESCORE_FACTOR):
+        self.coarse = coarse
+        self.vectors = vectors
+        self.factor = max(1, factor)
+        self.binary = isinstance(coarse, faiss.IndexBinary)
+
+    @property
+    def ntotal(self) -> int:
+        return self.coarse.ntotal
+
+    @property
+    def d(self) -> int:
+        return self.vectors.shape[1]
+
+    def reconstruct(self, position: int) -> np.ndarray:
+        return np.array(self.vectors[position], dtype=np.float32)
+
+    def coarse_search(self, queries: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        return self.coarse.search(binarize(queries) if self.binary else queries, k)
+
+    def search(self, queries: np.ndarray, k: int, rescore: Optional[bool] = True) -> Tuple[np.ndarray, np.ndarray]:
+        queries = np.asarray(queries, dtype=np.float32)
+        if not rescore:
+            return self.coarse_search(queries, k)
+        _, candidates = self.coarse_search(queries, k * self.factor)
+        distances = np.full((len(queries), k), np.inf, dtype=np.float32)
+        indices = np.full((len(queries), k), -1, dtype=np.int64)
+        for row, (query, ids) in enumerate(zip(queries, candidates)):
+            ids = np.unique(ids[ids >= 0])  # sorted, so the memory map is read front to back
+            if not len(ids):
+                continue
+            exact = np.asarray(self.vectors[ids], dtype=np.float32)
+            scores = ((exact - query) ** 2).sum(axis=1)
+            best = np.argsort(scores)[:k]
+            distances[row, :len(best)] = scores[best]
+            indices[row, :len(best)] = ids[best]
+        return distances, indices
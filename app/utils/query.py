@@ -1,10 +1,11 @@
 
 
 # Function for rewriting a query to improve retrieval
-from langchain_ollama import OllamaEmbeddings, OllamaLLM
+from langchain_ollama import OllamaLLM
 from langchain.prompts import PromptTemplate
 from sklearn.metrics.pairwise import cosine_similarity
 from IPython.display import display, Markdown
+from app.utils.embedding_cache import get_embeddings
 
 
 def rewrite_query(original_query, llm_chain):
@@ -66,7 +67,7 @@ class RAGQueryProcessor:
     def __init__(self):
 
         self.llm = OllamaLLM(model="llama3.1:8b", base_url='http://ollama-container:11434')
-        self.embed_model = OllamaEmbeddings(model='nomic-embed-text', base_url="http://ollama-container:11434")
+        self.embed_model = get_embeddings('nomic-embed-text')
         # Initialize LLM models
         self.re_write_llm = self.llm
         self.step_back_llm = self.llm
@@ -0,0 +1,164 @@
+# app/utils/query_rewriter.py
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+from typing import Optional, Sequence
+
+from langchain_core.messages import BaseMessage
+from langchain_core.output_parsers import StrOutputParser
+
+from app.utils.settings import REWRITE_CACHE_SIZE
+
+#-----------------------------------------------------------------------------------------------------------#
+#   Question rewrite without an LLM round trip where possible.                                              #
+#                                                                                                           #
+#   1. first turn of a session (no history)            -> the question is used as is                        #
+#   2. question looks self-contained (heuristic below) -> the question is used as is                        #
+#   3. same history + question rewritten before        -> cached rewrite                                    #
+#   4. otherwise                                       -> rewrite with the (small) REWRITE_MODEL            #
+#                                                                                                           #
+#   The heuristic looks for words that only make sense with the previous turns: pronouns and demonstratives #
+#   ("dazu", "diese", "that"), leading conjunctions ("und ...", "what about ...") and very short questions. #
+#-----------------------------------------------------------------------------------------------------------#
+
+# German and English words that usually refer back to an earlier turn
+REFERENCE_WORDS = {
+    # German (articles, "es" and "sie" are left out, they are too common in standalone questions)
+    "er", "ihn", "ihm", "ihnen", "dies", "diese", "dieser", "dieses", "diesen", "diesem",
+    "jene", "jener", "jenes", "dort", "dabei", "dazu", "davon", "damit", "darüber", "daran", "darauf", "dafür",
+    "deren", "dessen", "derselbe", "dasselbe", "dieselbe", "vorher", "oben", "genannt", "genannten", "erwähnt",
+    "erwähnten", "letzte", "letzten", "nochmal", "ebenfalls",
+    # English
+    "it", "its", "they", "them", "their", "he", "she", "him", "her", "this", "that", "these", "those", "there",
+    "above", "previous", "mentioned", "same", "again",
+}
+# Openers of elliptic follow-ups ("und für Teilzeit?", "what about interns?")
+FOLLOW_UP_START = re.compile(r"^\s*(und|oder|aber|also|sondern|and|or|but|so|what about|how about|wie ist es mit|was ist mit)\b",
+                             re.IGNORECASE)
+WORD = re.compile(r"\w+", re.UNICODE)
+
+# Questions with at most this many words are rarely self-contained
+MIN_STANDALONE_WORDS = 4
+
+
+def needs_rewrite(question: str) -> bool:
+    """Cheap check whether `question` depends on the previous turns."""
+    words = WORD.findall(question.lower())
+    if len(words) <= MIN_STANDALONE_WORDS:
+        return True
+    if FOLLOW_UP_START.match(question):
+        return True
+    return any(word in REFERENCE_WORDS for word in words)
+
+
+def history_key(model: str, messages: Sequence[BaseMessage], question: str) -> str:
+    digest = hashlib.sha256(model.encode("utf-8"))
+    for message in messages:
+        digest.update(f"{message.type}:{message.content}\x00".encode("utf-8"))
+    digest.update(question.strip().encode("utf-8"))
+    return digest.hexdigest()
+
+
+class RewriteCache:
+    """LRU of standalone questions keyed by (rewrite model, history hash, question)."""
+
+    def __init__(self, max_items=REWRITE_CACHE_SIZE):
+        self.max_items = max_items
+        self._items: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        # requests answered without the LLM: first turns and self-contained questions
+        self.skipped_first_turn = 0
+        self.skipped_heuristic = 0
+
+    def get(self, key: str, count_miss: bool = True) -> Optional[str]:
+        with self._lock:
+            value = self._items.get(key)
+            if value is None:
+                if count_miss:
+                    self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: str, value: str) -> None:
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+
+    def stats(self) -> dict:
+        return {
+            "items": len(self._items),
+            "max_items": self.max_items,
+            "skipped_first_turn": self.skipped_first_turn,
+            "skipped_heuristic": self.skipped_heuristic,
+            "hits": self.hits,
+            "llm_rewrites": self.misses,
+        }
+
+
+_rewrite_cache = None
+_lock = threading.Lock()
+
+
+def get_rewrite_cache() -> RewriteCache:
+    """Return the process-wide rewrite cache."""
+    global _rewrite_cache
+    with _lock:
+        if _rewrite_cache is None:
+            _rewrite_cache = RewriteCache()
+        return _rewrite_cache
+
+
+class QueryRewriter:
+    """Turns the latest question into a standalone question, calling the LLM only when it has to."""
+
+    def __init__(self, llm, prompt, model_name: str, cache: Optional[RewriteCache] = None):
+        self.chain = prompt | llm | StrOutputParser()
+        self.model_name = model_name
+        self.cache = cache or get_rewrite_cache()
+
+    def _shortcut(self, inputs: dict) -> Optional[str]:
+        question = inputs["input"]
+        if not inputs.get("chat_history"):
+            self.cache.skipped_first_turn += 1
+            return question
+        if not needs_rewrite(question):
+            self.cache.skipped_heuristic += 1
+            return question
+        return None
+
+    def cached(self, inputs: dict) -> Optional[str]:
+        """Standalone question if it is known without the LLM (shortcut or cached rewrite), otherwise None."""
+        question = self._shortcut(inputs)
+        if question is None:
+            key = history_key(self.model_name, inputs["chat_history"], inputs["input"])
+            question = self.cache.get(key, count_miss=False)
+        return question
+
+    def rewrite(self, inputs: dict) -> str:
+        question = self._shortcut(inputs)
+        if question is not None:
+            return question
+        key = history_key(self.model_name, inputs["chat_history"], inputs["input"])
+        question = self.cache.get(key)
+        if question is None:
+            question = self.chain.invoke(inputs).strip() or inputs["input"]
+            self.cache.put(key, question)
+        return question
+
+    async def arewrite(self, inputs: dict) -> str:
+        question = self._shortcut(inputs)
+        if question is not None:
+            return question
+        key = history_key(self.model_name, inputs["chat_history"], inputs["input"])
+        question = self.cache.get(key)
+        if question is None:
+            question = (await self.chain.ainvoke(inputs)).strip() or inputs["input"]
+            self.cache.put(key, question)
+        return question
@@ -1,126 +1,330 @@
 # app/utils/services.py
-from fastapi import logger
+import asyncio
+import logging
 from app.utils.docu_manager import AdvancedDocumentManager, DocumentManager
-from app.utils.embed_manager import EmbeddingManager, FAISSEmbeddingManager
+from app.utils.embed_manager import FAISSEmbeddingManager
+from app.utils.index_store import VectorIndexStore
+from app.utils.parent_store import ParentIndexStore
+from app.utils.chain_registry import ChainRegistry
+from app.utils.embedding_cache import get_embeddings
+from app.utils.executor import run_blocking
+from app.utils.startup import StartupOrchestrator, warm_up_models
+from app.database.docstore import PostgresStore
+from app.utils.settings import (EMBEDDING_MODEL, FILES_DIR, INDEX_KEEP_VERSIONS, INDEX_POLL_SECONDS, INDEX_ROLE,
+                                REINDEX_DEBOUNCE_SECONDS, REINDEX_MAX_DELAY_SECONDS)
 
 
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
-from queue import Queue
+from queue import Empty, Queue
 import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+#-----------------------------------------------------------------------------------------------------------#
+#   Background reindexing.                                                                                  #
+#                                                                                                           #
+#   watchdog thread  --(changed paths)-->  Queue  -->  ReindexWorker thread                                 #
+#                                                                                                           #
+#   The worker waits until no event arrived for REINDEX_DEBOUNCE_SECONDS (at most REINDEX_MAX_DELAY_SECONDS #
+#   after the first one), so copying a folder of PDFs triggers one sync instead of hundreds. A sync diffs   #
+#   the whole directory against the ledger, so the events only say *that* something changed.               #
+#   Both indexes are synced into new immutable versions, loaded and then swapped into app.state in one     #
+#   step; requests that already hold the old retriever finish on the old version.                          #
+#                                                                                                           #
+#   With INDEX_ROLE=reader (several gunicorn workers) only app/scripts/run_indexer.py runs this worker.     #
+#   The API workers never write: an IndexWatcher per worker follows the CURRENT pointers and maps the new   #
+#   versions read-only, so every worker shares one copy of the index pages.                                #
+#-----------------------------------------------------------------------------------------------------------#
 
 class FileChangeHandler(FileSystemEventHandler):
     """
-        Watches for file changes (creation, modification, deletion) in a directory and and queues events.
+        Watches for file changes (creation, modification, deletion, move) in a directory and queues the paths.
     """
-    def __init__(self, app, queue):
+    def __init__(self, queue, suffixes=(".pdf", ".docx", ".txt")):
         """
-        Initialize the handler with a reference to the FastAPI app and a shared queue.
+        Initialize the handler with the queue shared with the reindex worker.
         
-        :param app: The FastAPI app instance.
+        :param queue: Queue the changed paths are put into.
         """
-        self.app = app
-        # self.queue = queue
+        self.queue = queue
+        self.suffixes = suffixes
+
+    def _queue(self, *paths):
+        for path in paths:
+            if path and path.lower().endswith(self.suffixes):
+                self.queue.put(path)
 
     def on_created(self, event):
-        """
-        Triggered when a file is created in the watched directory.
-        :param event: File system event object.
-        """
         if not event.is_directory:
-            print(f"File created: {event.src_path}")
-            self.process_file(event.src_path, action="created")
+            self._queue(event.src_path)
     
     def on_deleted(self, event):
-        """
-        Triggered when a file is deleted in the watched directory.
-        :param event: File system event object.
-        """
-
         if not event.is_directory:
-            print(f"File deleted: {event.src_path}")
-            self.process_file(event.src_path, action="deleted")
+            self._queue(event.src_path)
 
     def on_modified(self, event):
-        """
-        Triggered when a file is modified in the watched directory.
-        
-        :param event: File system event object.
-        """
         if not event.is_directory:  # Ignore directory modifications
-            print(f"File modified: {event.src_path}")
-            self.process_file(event.src_path, action="modified")
+            self._queue(event.src_path)
 
+    def on_moved(self, event):
+        if not event.is_directory:
+            self._queue(event.src_path, getattr(event, "dest_path", None))
 
-    def process_file(self, file_path, action):
 
-        """
-        Process file changes and update vector database.
-        """
-        
-        document_manager = self.app.state.document_manager
-        embedding_manager = self.app.state.embedding_manager
-        vectordb = self.app.state.vectordb
-        
-        if action=="created":
-            print(f"Processing new file: {file_path}")
-            # Recreate embeddings for all files (or just the new one,based on design)
-            chunks = document_manager.split_document([file_path])
-            embedding_manager.add_to_vectordb(chunks, vectordb)
+class ReindexWorker(threading.Thread):
+    """Debounces file events and applies them to the live indexes, off the request path."""
 
+    def __init__(self, app, queue: Queue, debounce=REINDEX_DEBOUNCE_SECONDS, max_delay=REINDEX_MAX_DELAY_SECONDS,
+                 action=None):
+        super().__init__(name="reindex-worker", daemon=True)
+        self.app = app
+        self.queue = queue
+        # What a batch of events triggers: reindex(app) in the API, publish only in the indexer process
+        self.action = action or (lambda: reindex(self.app))
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self._stop_event = threading.Event()
+        self.last_run = None
+        self.last_error = None
 
-        elif action=="deleted":
-            print(f"Removing file: {file_path}")
-            # Handle file deletion
-            # Remove embeddings for the deleted file
+    def stop(self):
+        self._stop_event.set()
+        self.queue.put(None)  # wake the worker up
 
-            file_name = file_path.split("/")[-1]
-            vectordb = self.app.state.vectordb
-            if vectordb:
-                vectordb.remove_embeddings(file_name)
-          
+    def request(self, path="manual"):
+        """Ask for a sync without a file event (e.g. after the files were changed while the app was down)."""
+        self.queue.put(path)
 
+    def _collect(self):
+        """Block until an event arrives, then coalesce events until the directory was quiet for `debounce`."""
+        first = self.queue.get()
+        if first is None:
+            return set()
+        paths = {first}
+        deadline = time.monotonic() + self.max_delay
+        while not self._stop_event.is_set():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                path = self.queue.get(timeout=min(self.debounce, remaining))
+            except Empty:
+                break
+            if path is None:
+                break
+            paths.add(path)
+        return paths
 
+    def run(self):
+        while not self._stop_event.is_set():
+            paths = self._collect()
+            if not paths or self._stop_event.is_set():
+                continue
+            logger.info(f"Reindexing after {len(paths)} changed paths.")
+            started = time.perf_counter()
+            try:
+                self.action()
+                self.last_error = None
+            except Exception as e:
+                self.last_error = str(e)
+                logger.error(f"Background reindex failed: {e}", exc_info=True)
+            self.last_run = {"paths": len(paths), "seconds": round(time.perf_counter() - started, 2), "error": self.last_error}
 
+    def status(self) -> dict:
+        return {"alive": self.is_alive(), "pending_events": self.queue.qsize(), "last_run": self.last_run}
 
 
-def start_file_watcher(app):
+def reindex(app):
     """
-    Initialize the file watcher and event processor.
+    Sync both indexes with the source directory and swap the new versions into app.state.
+    Nothing is swapped if nothing changed; a failed sync leaves the live versions untouched.
+    """
+    index_store = app.state.index_store
+    parent_store = app.state.parent_store
+    chunk_version = index_store.manifest["version"] if index_store.manifest else None
+    parent_version = parent_store.manifest["version"] if parent_store.manifest else None
 
-    :param app: The FastAPI app instance.
+    index_store.sync()
+    parent_store.sync()
+    if index_store.current_version() == chunk_version and parent_store.current_version() == parent_version:
+        logger.info("Reindex: no changes.")
+        return
+
+    serve_published(app)
+    for store in (index_store, parent_store):
+        store.prune_versions(keep=INDEX_KEEP_VERSIONS)
+
+
+def serve_published(app):
+    """Load the published versions of both indexes read-only and swap them into app.state."""
+    index_store = app.state.index_store
+    parent_store = app.state.parent_store
+    # Load before anything is swapped
+    vectordb = index_store.load()
+    retriever = parent_store.as_retriever(parent_store.load())
+
+    app.state.vectordb = vectordb
+    app.state.retriever = retriever
+    app.state.chain_registry.invalidate(retriever, version=parent_store.manifest["version"],
+                                        sources=parent_store.doc_ids())
+    logger.info(f"Serving chunks {index_store.manifest['version']} and parents {parent_store.manifest['version']}.")
+
+
+class IndexWatcher(threading.Thread):
+    """Swaps app.state to the versions another process publishes (INDEX_ROLE=reader)."""
+
+    def __init__(self, app, interval=INDEX_POLL_SECONDS):
+        super().__init__(name="index-watcher", daemon=True)
+        self.app = app
+        self.interval = interval
+        self._stop_event = threading.Event()
+        self.last_swap = None
+        self.last_error = None
+
+    def stop(self):
+        self._stop_event.set()
+
+    def outdated(self) -> bool:
+        """True if a store's CURRENT points to another version than the one being served."""
+        for store in (self.app.state.index_store, self.app.state.parent_store):
+            version = store.current_version()
+            if version is not None and version != (store.manifest or {}).get("version"):
+                return True
+        return False
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            try:
+                if not self.outdated():
+                    continue
+                serve_published(self.app)
+                self.last_error = None
+                self.last_swap = time.time()
+            except Exception as e:
+                # e.g. the version was pruned while loading it; the next poll loads the newer one
+                self.last_error = str(e)
+                logger.error(f"Could not swap to the published index: {e}", exc_info=True)
+
+    def status(self) -> dict:
+        return {"alive": self.is_alive(), "role": "reader", "last_swap": self.last_swap, "error": self.last_error}
+
+
+def start_file_watcher(app):
     """
+    Start the reindex worker and the file watcher feeding it.
 
-    # Initialize app state if not already initialized
-    if not hasattr(app.state, "document_manager"):
-        initialize_app_state(app)
+    :param app: The FastAPI app instance (state must be initialized).
+    :return: (observer, worker), stop them with stop_file_watcher.
+    """
+    queue = Queue()
+    worker = ReindexWorker(app, queue)
+    worker.start()
 
-    handler = FileChangeHandler(app)
+    handler = FileChangeHandler(queue)
     observer = Observer()
-    observer.schedule(handler, path="app/files/", recursive=False)
+    observer.schedule(handler, path=FILES_DIR, recursive=True)
     observer.start()
 
-    # Start file processor in a separate thread
-    #threading.Thread(target=process_file, args=(app, queue), daemon=True).start()
+    app.state.file_observer = observer
+    app.state.reindex_worker = worker
+    logger.info(f"Watching {FILES_DIR} for changes.")
+    return observer, worker
 
-async def initialize_app_state(app):
-    try: 
-        document_manager = AdvancedDocumentManager(directory_path = "app/files/")#DocumentManager(directory_path = "app/files/")
-        embedding_manager = EmbeddingManager(chunks=document_manager.split_document())
-        vectordb = embedding_manager.create_embeddings()
-        document_manager.load_documents()
-        retriever = document_manager.create_parent_retriever(use_postgres=True, emd_model='bge-m3')
-        #embedding_manager = FAISSEmbeddingManager(chunks=document_manager.split_document())
-        #vectordb = embedding_manager.create_embeddings()
-        #print("Infos: vectordb created.", vectordb)
-
-        # Set up app state
-        app.state.document_manager = document_manager
-        app.state.embedding_manager = embedding_manager
-        app.state.vectordb = vectordb
-        app.state.retriever = retriever
+
+def stop_file_watcher(app):
+    observer = getattr(app.state, "file_observer", None)
+    worker = getattr(app.state, "reindex_worker", None)
+    if observer:
+        observer.stop()
+        observer.join(timeout=5)
+    if worker:
+        worker.stop()
+        worker.join(timeout=5)
+
+
+def start_index_watcher(app):
+    """Follow the versions published by the indexer process (INDEX_ROLE=reader)."""
+    watcher = IndexWatcher(app)
+    watcher.start()
+    app.state.index_watcher = watcher
+    return watcher
+
+
+def stop_index_watcher(app):
+    watcher = getattr(app.state, "index_watcher", None)
+    if watcher:
+        watcher.stop()
+        watcher.join(timeout=5)
+
+
+async def wait_for_published(store: VectorIndexStore, interval=INDEX_POLL_SECONDS) -> None:
+    """Wait until the indexer published a first version of `store` (readers never build one)."""
+    while store.current_version() is None:
+        logger.info(f"Waiting for the indexer to publish index '{store.name}'.")
+        await asyncio.sleep(interval)
+
+def build_startup(app) -> StartupOrchestrator:
+    """
+    Startup steps of the app state. The steps only load the persisted indexes (they are re-embedded
+    only when the source files changed) and publish everything to app.state in the last step.
+    With INDEX_ROLE=reader the indexes are only loaded, never synced, once the indexer published them.
+
+    :param app: The FastAPI app instance.
+    :return: The orchestrator, call start() from the lifespan.
+    """
+    orchestrator = StartupOrchestrator()
+    loaded = {}
+
+    async def docstore():
+        loaded["docstore"] = await run_blocking(PostgresStore)
+
+    async def chunks():
+        index_store = VectorIndexStore(name="chunks", source_dir=FILES_DIR)
+        if INDEX_ROLE == "reader":
+            await wait_for_published(index_store)
+            loaded["vectordb"] = await run_blocking(index_store.load)
+        else:
+            loaded["vectordb"] = await run_blocking(index_store.load_or_build)
+        loaded["index_store"] = index_store
+
+    async def parents():
+        # Reattach to the persisted parent retriever (child vectors + Postgres parents), no corpus reload
+        parent_store = ParentIndexStore(source_dir=FILES_DIR, embedding_model=EMBEDDING_MODEL,
+                                        docstore=loaded["docstore"])
+        if INDEX_ROLE == "reader":
+            await wait_for_published(parent_store)
+            loaded["retriever"] = parent_store.as_retriever(await run_blocking(parent_store.load))
+        else:
+            loaded["retriever"] = parent_store.as_retriever(await run_blocking(parent_store.load_or_build))
+        loaded["parent_store"] = parent_store
+
+    async def warmup():
+        await warm_up_models(get_embeddings(EMBEDDING_MODEL))
+
+    async def chains():
+        # Set up app state at once, the dependencies never see a half initialized state
+        app.state.document_manager = AdvancedDocumentManager(directory_path = FILES_DIR)
+        app.state.index_store = loaded["index_store"]
+        app.state.parent_store = loaded["parent_store"]
+        app.state.vectordb = loaded["vectordb"]
+        app.state.retriever = loaded["retriever"]
+        # Answers are generated from the parent retriever, so its version keys the chains and the answer cache
+        app.state.chain_registry = ChainRegistry(loaded["retriever"], version=loaded["parent_store"].manifest["version"])
         logger.info("App state initialized successfully.")
 
-    except Exception as e:
-        logger.error(f"Error initializing app state {e}", exe_info =True)
-        raise
\ No newline at end of file
+    orchestrator.add_step("docstore", docstore)
+    orchestrator.add_step("chunks", chunks)
+    orchestrator.add_step("parents", parents, requires=["docstore"])
+    orchestrator.add_step("warmup", warmup, required=False)
+    orchestrator.add_step("chains", chains, requires=["chunks", "parents"])
+    return orchestrator
+
+
+async def initialize_app_state(app):
+    """Run all startup steps and wait for them (scripts and tests; the API starts them in the background)."""
+    orchestrator = build_startup(app)
+    await orchestrator.start()
+    if not orchestrator.ready:
+        raise RuntimeError(f"App state could not be initialized: {orchestrator.status()}")
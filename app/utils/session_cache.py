@@ -0,0 +1,153 @@
+# app/utils/session_cache.py
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Iterable, Optional
+
+from langchain_community.chat_message_histories import ChatMessageHistory
+from langchain_core.messages import BaseMessage
+
+from app.utils.settings import INDEX_ROLE, SESSION_CACHE_MAX_SESSIONS, SESSION_CACHE_TTL_SECONDS, SESSION_HISTORY_MAX_TURNS
+
+#-----------------------------------------------------------------------------------------------------------#
+#   Bounded session history cache.                                                                          #
+#                                                                                                           #
+#   - at most `max_sessions` histories are kept, the least recently used one is evicted first               #
+#   - a history that was not used for `ttl` seconds is dropped and reloaded from Postgres on next use       #
+#   - only the last `max_turns` turns are loaded and kept per session                                       #
+#                                                                                                           #
+#   The cache behaves like the plain dict it replaces (`get`, `in`, `[]`, `[]=`), so the chain managers     #
+#   use it exactly like their old `store` dicts. New turns are appended to the cached history in place      #
+#   by RunnableWithMessageHistory, and written to chat_history by the routers, so a session is only read    #
+#   from the database when it is not cached.                                                                #
+#                                                                                                           #
+#   The cache lives in one process. With several gunicorn workers (INDEX_ROLE=reader) the turns of a        #
+#   session land on any worker, so a cached history can miss turns another worker stored. There the cache   #
+#   is `revalidate`d: the chain managers reload the history from Postgres once at the start of every        #
+#   request and the cache only carries it through that request (RunnableWithMessageHistory reads it         #
+#   synchronously).                                                                                         #
+#-----------------------------------------------------------------------------------------------------------#
+
+HTML_TAG = re.compile(r"<[^>]+>")
+
+
+class BoundedChatMessageHistory(ChatMessageHistory):
+    """ChatMessageHistory that keeps only the most recent `max_messages` messages."""
+
+    max_messages: int = SESSION_HISTORY_MAX_TURNS * 2
+
+    def add_message(self, message: BaseMessage) -> None:
+        super().add_message(message)
+        if len(self.messages) > self.max_messages:
+            del self.messages[:len(self.messages) - self.max_messages]
+
+
+def response_to_text(response) -> str:
+    """Turn the stored answer (list of content blocks with HTML) back into plain text for the prompt."""
+    if isinstance(response, str):
+        return response
+    parts = [block.get("content", "") for block in response or [] if isinstance(block, dict) and block.get("type") == "text"]
+    return HTML_TAG.sub("", "\n".join(parts)).strip()
+
+
+def history_from_turns(records: Iterable, max_turns: int = SESSION_HISTORY_MAX_TURNS) -> BoundedChatMessageHistory:
+    """Build a bounded history from chat_history rows in chronological order."""
+    chat_history = BoundedChatMessageHistory(max_messages=max_turns * 2)
+    for record in records:
+        if record.question:
+            chat_history.add_user_message(record.question)
+        if record.response:
+            chat_history.add_ai_message(response_to_text(record.response))
+    return chat_history
+
+
+class SessionHistoryCache:
+    """
+    Dict-like LRU + TTL cache of chat histories keyed by session id.
+    `revalidate`: other processes write the same sessions, reload a history at the start of every request.
+    """
+
+    def __init__(self, max_sessions=SESSION_CACHE_MAX_SESSIONS, ttl=SESSION_CACHE_TTL_SECONDS, max_turns=SESSION_HISTORY_MAX_TURNS,
+                 revalidate=INDEX_ROLE == "reader"):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.max_turns = max_turns
+        self.revalidate = revalidate
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()  # session_id -> (history, last access)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _expired(self, last_access: float) -> bool:
+        return self.ttl > 0 and time.monotonic() - last_access > self.ttl
+
+    def get(self, session_id: str) -> Optional[BoundedChatMessageHistory]:
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is None or self._expired(entry[1]):
+                if entry is not None:
+                    del self._entries[session_id]
+                    self.evictions += 1
+                self.misses += 1
+                return None
+            self._entries[session_id] = (entry[0], time.monotonic())
+            self._entries.move_to_end(session_id)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, session_id: str, history) -> None:
+        with self._lock:
+            self._entries[session_id] = (history, time.monotonic())
+            self._entries.move_to_end(session_id)
+            while len(self._entries) > self.max_sessions:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, session_id: str, default=None):
+        with self._lock:
+            entry = self._entries.pop(session_id, None)
+        return entry[0] if entry else default
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def new_history(self) -> BoundedChatMessageHistory:
+        return BoundedChatMessageHistory(max_messages=self.max_turns * 2)
+
+    def append_turn(self, session_id: str, user_message: str, bot_response: str) -> None:
+        """Append a finished turn to a cached history in place (no-op if the session is not cached)."""
+        history = self.get(session_id)
+        if history is not None:
+            history.add_user_message(user_message)
+            history.add_ai_message(bot_response)
+
+    # dict interface used by the chain managers
+    def __contains__(self, session_id) -> bool:
+        return self.get(session_id) is not None
+
+    def __getitem__(self, session_id):
+        history = self.get(session_id)
+        if history is None:
+            raise KeyError(session_id)
+        return history
+
+    def __setitem__(self, session_id, history) -> None:
+        self.put(session_id, history)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> dict:
+        return {
+            "sessions": len(self._entries),
+            "max_sessions": self.max_sessions,
+            "ttl_seconds": self.ttl,
+            "max_turns": self.max_turns,
+            "revalidate": self.revalidate,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
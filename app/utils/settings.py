@@ -0,0 +1,156 @@
+# app/utils/settings.py
+import os
+from dotenv import load_dotenv
+
+#-----------------------------------------------------------------------------------------------------------#
+#   Runtime settings for the RAG pipeline. Every value can be overridden from the .env file so the         #
+#   same image can be used for development and for the production container.                               #
+#-----------------------------------------------------------------------------------------------------------#
+
+# Load enviroment variable like database from .env
+load_dotenv()
+
+# Ollama server used for embeddings and generation
+OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://ollama-container:11434")
+
+# Directory with the source documents (mounted from /mnt/ in docker-compose)
+FILES_DIR = os.getenv("FILES_DIR", "app/files/")
+
+# Directory where the versioned vector indexes are persisted
+INDEX_DIR = os.getenv("INDEX_DIR", "app/index/")
+
+# Embedding model used for the shared chunk index
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "bge-m3")
+
+# Embedding client: texts per /api/embed request, requests in flight, retries and timeout (seconds)
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "64"))
+EMBED_MAX_CONCURRENCY = int(os.getenv("EMBED_MAX_CONCURRENCY", "4"))
+EMBED_MAX_RETRIES = int(os.getenv("EMBED_MAX_RETRIES", "3"))
+EMBED_TIMEOUT = float(os.getenv("EMBED_TIMEOUT", "120"))
+
+# Number of chunks embedded and appended to the index as one block during ingestion
+INDEX_BLOCK_SIZE = int(os.getenv("INDEX_BLOCK_SIZE", "1024"))
+
+# Embedding cache: entries kept in memory per worker and sqlite file for the persistent tier
+EMBED_CACHE_MEMORY_ITEMS = int(os.getenv("EMBED_CACHE_MEMORY_ITEMS", "50000"))
+EMBED_CACHE_PATH = os.getenv("EMBED_CACHE_PATH", os.path.join(INDEX_DIR, "embedding_cache.sqlite"))
+
+# Threads for blocking work (markdown rendering, parsing) that must not run on the event loop
+BLOCKING_EXECUTOR_WORKERS = int(os.getenv("BLOCKING_EXECUTOR_WORKERS", "8"))
+
+# WebSocket chat: frames buffered per connection before generation is slowed down, questions queued per connection
+WS_SEND_QUEUE_SIZE = int(os.getenv("WS_SEND_QUEUE_SIZE", "256"))
+WS_MAX_PENDING_QUESTIONS = int(os.getenv("WS_MAX_PENDING_QUESTIONS", "8"))
+
+# Session history cache: cached sessions per worker, idle time before a session is dropped, turns kept per session
+SESSION_CACHE_MAX_SESSIONS = int(os.getenv("SESSION_CACHE_MAX_SESSIONS", "1000"))
+SESSION_CACHE_TTL_SECONDS = float(os.getenv("SESSION_CACHE_TTL_SECONDS", "3600"))
+SESSION_HISTORY_MAX_TURNS = int(os.getenv("SESSION_HISTORY_MAX_TURNS", "20"))
+
+# Context packing: context window (num_ctx) per model as "model=tokens,...", tokens kept free for the answer
+# and for the chat history, smallest useful piece of a truncated chunk
+DEFAULT_CONTEXT_WINDOW = int(os.getenv("DEFAULT_CONTEXT_WINDOW", "8192"))
+MODEL_CONTEXT_WINDOWS = os.getenv("MODEL_CONTEXT_WINDOWS", "llama3.1:8b=8192,deepseek-r1:32b=8192")
+ANSWER_TOKEN_RESERVE = int(os.getenv("ANSWER_TOKEN_RESERVE", "1024"))
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "1536"))
+MIN_CHUNK_TOKENS = int(os.getenv("MIN_CHUNK_TOKENS", "128"))
+
+# Token counting: HuggingFace tokenizer (name or local path) per model as "model=tokenizer,...";
+# models without one are estimated with CHARS_PER_TOKEN
+MODEL_TOKENIZERS = os.getenv("MODEL_TOKENIZERS", "")
+CHARS_PER_TOKEN = float(os.getenv("CHARS_PER_TOKEN", "3.5"))
+
+# Replace chat turns that do not fit the history budget by a cached LLM summary instead of dropping them
+HISTORY_SUMMARY_ENABLED = os.getenv("HISTORY_SUMMARY_ENABLED", "false").lower() == "true"
+HISTORY_SUMMARY_MAX_TOKENS = int(os.getenv("HISTORY_SUMMARY_MAX_TOKENS", "256"))
+
+# Semantic answer cache (opt-in): minimum cosine similarity of the standalone questions, lifetime and size per worker
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "false").lower() == "true"
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+ANSWER_CACHE_TTL_SECONDS = float(os.getenv("ANSWER_CACHE_TTL_SECONDS", "86400"))
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "2000"))
+
+# Question rewrite: model used to make follow-up questions standalone (empty = the answering model),
+# rewrites cached per worker
+REWRITE_MODEL = os.getenv("REWRITE_MODEL", "")
+REWRITE_CACHE_SIZE = int(os.getenv("REWRITE_CACHE_SIZE", "5000"))
+
+# Parent docstore: store documents zlib compressed in the binary column, hot parents cached per worker,
+# rows per bulk statement
+DOCSTORE_COMPRESSION = os.getenv("DOCSTORE_COMPRESSION", "false").lower() == "true"
+DOCSTORE_CACHE_ITEMS = int(os.getenv("DOCSTORE_CACHE_ITEMS", "512"))
+DOCSTORE_BATCH_SIZE = int(os.getenv("DOCSTORE_BATCH_SIZE", "500"))
+
+# Document parsing: worker processes (default: all cores) and seconds before a single file is given up
+PARSE_WORKERS = int(os.getenv("PARSE_WORKERS", str(os.cpu_count() or 1)))
+PARSE_TIMEOUT_SECONDS = float(os.getenv("PARSE_TIMEOUT_SECONDS", "300"))
+
+# Background reindexing: watch FILES_DIR, wait until no event arrived for the debounce time (but at most
+# the max delay) before a sync, index versions kept on disk
+REINDEX_WATCH_ENABLED = os.getenv("REINDEX_WATCH_ENABLED", "true").lower() == "true"
+REINDEX_DEBOUNCE_SECONDS = float(os.getenv("REINDEX_DEBOUNCE_SECONDS", "5"))
+REINDEX_MAX_DELAY_SECONDS = float(os.getenv("REINDEX_MAX_DELAY_SECONDS", "60"))
+INDEX_KEEP_VERSIONS = int(os.getenv("INDEX_KEEP_VERSIONS", "3"))
+
+# Startup: attempts per startup step (Postgres/Ollama may still be starting) and the pause between them,
+# chat models loaded into Ollama during startup as "model,..."
+STARTUP_MAX_ATTEMPTS = int(os.getenv("STARTUP_MAX_ATTEMPTS", "5"))
+STARTUP_RETRY_SECONDS = float(os.getenv("STARTUP_RETRY_SECONDS", "10"))
+WARMUP_MODELS = [model.strip() for model in os.getenv("WARMUP_MODELS", "llama3.1:8b").split(",") if model.strip()]
+
+# Seconds a client is asked to wait (Retry-After) when a request arrives before the app is ready
+NOT_READY_RETRY_AFTER = int(os.getenv("NOT_READY_RETRY_AFTER", "5"))
+
+# Ollama models: keep_alive per model as "model=duration,..." (-1 keeps a model loaded forever), keep_alive of
+# all other models, different models generating at the same time (0 = no limit; 1 avoids swapping two large
+# models in and out of GPU memory on every request) and how long the /api/ps result is reused
+MODEL_KEEP_ALIVE = os.getenv("MODEL_KEEP_ALIVE", "llama3.1:8b=-1,deepseek-r1:32b=30m")
+DEFAULT_KEEP_ALIVE = os.getenv("DEFAULT_KEEP_ALIVE", "30m")
+MODEL_MAX_ACTIVE = int(os.getenv("MODEL_MAX_ACTIVE", "0"))
+MODEL_PS_REFRESH_SECONDS = float(os.getenv("MODEL_PS_REFRESH_SECONDS", "5"))
+
+# Admission control: concurrent generations per model as "model=slots,..." (DEFAULT_MODEL_CONCURRENCY for the
+# rest), requests waiting per model before new ones are rejected with 429 and the longest wait for a slot
+MODEL_CONCURRENCY = os.getenv("MODEL_CONCURRENCY", "llama3.1:8b=4,deepseek-r1:32b=1")
+DEFAULT_MODEL_CONCURRENCY = int(os.getenv("DEFAULT_MODEL_CONCURRENCY", "2"))
+ADMISSION_QUEUE_SIZE = int(os.getenv("ADMISSION_QUEUE_SIZE", "32"))
+ADMISSION_TIMEOUT_SECONDS = float(os.getenv("ADMISSION_TIMEOUT_SECONDS", "60"))
+
+# Hybrid retrieval: BM25 parameters of the sparse index, idf below which a query term is ignored (0.2 = the
+# term is in more than ~80% of the chunks, 0 = score every term), candidates taken from the dense and the
+# sparse search, constant and weights of the reciprocal-rank fusion
+HYBRID_SEARCH_ENABLED = os.getenv("HYBRID_SEARCH_ENABLED", "true").lower() == "true"
+BM25_K1 = float(os.getenv("BM25_K1", "1.5"))
+BM25_B = float(os.getenv("BM25_B", "0.75"))
+BM25_MIN_IDF = float(os.getenv("BM25_MIN_IDF", "0.2"))
+HYBRID_FETCH_K = int(os.getenv("HYBRID_FETCH_K", "20"))
+HYBRID_RRF_K = int(os.getenv("HYBRID_RRF_K", "60"))
+HYBRID_DENSE_WEIGHT = float(os.getenv("HYBRID_DENSE_WEIGHT", "1.0"))
+HYBRID_SPARSE_WEIGHT = float(os.getenv("HYBRID_SPARSE_WEIGHT", "1.0"))
+
+# ANN index of the published versions: flat, hnsw, ivf_flat, ivf_pq or auto (by corpus size), query-time
+# parameters used until app/scripts/tune_index.py wrote tuned ones ("nprobe=16", "efSearch=64"), IVF lists
+# (0 = about 4 * sqrt(n)), PQ bytes per vector (0 = dimension / 16), vectors used to train IVF, HNSW
+# graph degree and build effort, and the target recall of the tuner
+ANN_INDEX_TYPE = os.getenv("ANN_INDEX_TYPE", "auto")
+ANN_SEARCH_PARAMS = os.getenv("ANN_SEARCH_PARAMS", "")
+ANN_NLIST = int(os.getenv("ANN_NLIST", "0"))
+ANN_PQ_M = int(os.getenv("ANN_PQ_M", "0"))
+ANN_TRAIN_SAMPLE = int(os.getenv("ANN_TRAIN_SAMPLE", "100000"))
+ANN_HNSW_M = int(os.getenv("ANN_HNSW_M", "32"))
+ANN_HNSW_EF_CONSTRUCTION = int(os.getenv("ANN_HNSW_EF_CONSTRUCTION", "200"))
+ANN_AUTO_FLAT_BELOW = int(os.getenv("ANN_AUTO_FLAT_BELOW", "50000"))
+ANN_AUTO_HNSW_BELOW = int(os.getenv("ANN_AUTO_HNSW_BELOW", "1000000"))
+ANN_TARGET_RECALL = float(os.getenv("ANN_TARGET_RECALL", "0.95"))
+
+# How the published index stores its vectors: float32, float16, int8 (scalar quantized) or binary (sign bits);
+# all but float32 search the compact codes for k * RESCORE_FACTOR candidates and rescore them exactly against
+# the memory-mapped float32 vectors
+VECTOR_STORAGE = os.getenv("VECTOR_STORAGE", "float32")
+RESCORE_FACTOR = int(os.getenv("RESCORE_FACTOR", "4"))
+
+# Serving role: "standalone" (the API process builds, watches and serves the indexes) or "reader" (gunicorn
+# workers only memory-map the versions published by app/scripts/run_indexer.py and swap to a new version once
+# its CURRENT pointer changes, checked every INDEX_POLL_SECONDS)
+INDEX_ROLE = os.getenv("INDEX_ROLE", "standalone")
+INDEX_POLL_SECONDS = float(os.getenv("INDEX_POLL_SECONDS", "10"))
@@ -0,0 +1,147 @@
+# app/utils/sparse_index.py
+import logging
+import heapq
+import math
+import pickle
+import re
+from collections import Counter
+from typing import Dict, Iterable, List, Tuple
+
+from langchain_core.documents import Document
+
+from app.utils.settings import BM25_B, BM25_K1, BM25_MIN_IDF
+
+logger = logging.getLogger(__name__)
+
+#-----------------------------------------------------------------------------------------------------------#
+#   Corpus-wide BM25 inverted index over the indexed chunks.                                                #
+#                                                                                                           #
+#   postings: term -> {chunk id: term frequency}, with the same chunk ids as the FAISS docstore, so the     #
+#   ledger ids that delete vectors of changed files also delete their postings. The index is saved as       #
+#   sparse.pkl next to index.faiss in every version and updated by the same incremental sync.               #
+#                                                                                                           #
+#   Tokens are lower-cased words; codes like "AB-1234/5" are kept as one token and additionally indexed     #
+#   by their parts, so contract numbers and product codes match exactly or by their pieces.                 #
+#                                                                                                           #
+#   Search scores the query terms rarest first. Terms below BM25_MIN_IDF (in almost every chunk) are        #
+#   skipped. Once k chunks are scored and the remaining terms together cannot lift any other chunk above    #
+#   the k-th score (MaxScore), those terms only update the chunks already scored instead of walking their   #
+#   whole posting list, so a common word costs O(candidates) instead of O(corpus) and the top k is exact.   #
+#-----------------------------------------------------------------------------------------------------------#
+
+SPARSE_NAME = "sparse.pkl"
+
+TOKEN_PATTERN = re.compile(r"\w+(?:[-./:]\w+)*")
+CODE_SEPARATORS = re.compile(r"[-./:]")
+
+
+def tokenize(text: str) -> List[str]:
+    tokens = []
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        tokens.append(token)
+        if not token.isalnum():
+            tokens.extend(part for part in CODE_SEPARATORS.split(token) if part)
+    return tokens
+
+
+class SparseIndex:
+    """Incremental BM25 index; ids are chunk ids, scores follow Okapi BM25 with k1 and b from the settings."""
+
+    def __init__(self, k1=BM25_K1, b=BM25_B, min_idf=BM25_MIN_IDF):
+        self.k1 = k1
+        self.b = b
+        self.min_idf = min_idf
+        self.postings: Dict[str, Dict[str, int]] = {}
+        self.lengths: Dict[str, int] = {}
+        self.doc_terms: Dict[str, Tuple[str, ...]] = {}  # terms of every chunk, needed to remove it again
+        self.total_length = 0
+
+    def __len__(self) -> int:
+        return len(self.lengths)
+
+    def add(self, ids: Iterable[str], texts: Iterable[str]) -> None:
+        for id, text in zip(ids, texts):
+            if id in self.lengths:
+                self.remove([id])
+            counts = Counter(tokenize(text))
+            for term, count in counts.items():
+                self.postings.setdefault(term, {})[id] = count
+            length = sum(counts.values())
+            self.lengths[id] = length
+            self.doc_terms[id] = tuple(counts)
+            self.total_length += length
+
+    def remove(self, ids: Iterable[str]) -> None:
+        for id in ids:
+            length = self.lengths.pop(id, None)
+            if length is None:
+                continue
+            self.total_length -= length
+            for term in self.doc_terms.pop(id, ()):
+                posting = self.postings.get(term)
+                if posting is not None:
+                    posting.pop(id, None)
+                    if not posting:
+                        del self.postings[term]
+
+    def search(self, query: str, k: int = 20) -> List[Tuple[str, float]]:
+        """Return the `k` best (chunk id, BM25 score) pairs for `query`."""
+        if not self.lengths or k <= 0:
+            return []
+        total = len(self.lengths)
+        average_length = self.total_length / total or 1.0
+        postings = sorted((self.postings[term] for term in set(tokenize(query)) if term in self.postings), key=len)
+        terms = [(posting, math.log(1 + (total - len(posting) + 0.5) / (len(posting) + 0.5))) for posting in postings]
+        # A query of common words only is still answered by its rarest word
+        terms = [(posting, idf) for posting, idf in terms if idf >= self.min_idf] or terms[:1]
+        # Upper bound of what the terms from i on can add to a score: idf * (k1 + 1) each
+        bounds = [idf * (self.k1 + 1) for _, idf in terms]
+        remaining = [sum(bounds[i:]) for i in range(len(bounds))]
+
+        scores: Dict[str, float] = {}
+        for (posting, idf), bound in zip(terms, remaining):
+            if len(scores) >= k and bound < heapq.nlargest(k, scores.values())[-1]:
+                ids = [id for id in scores if id in posting]  # no new chunk can reach the top k any more
+            else:
+                ids = posting
+            for id in ids:
+                count = posting[id]
+                norm = self.k1 * (1 - self.b + self.b * self.lengths[id] / average_length)
+                scores[id] = scores.get(id, 0.0) + idf * count * (self.k1 + 1) / (count + norm)
+        return heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+
+    # -----------------------
+    # Persistence
+    # -----------------------
+    def save(self, path: str) -> None:
+        with open(path, "wb") as file:
+            pickle.dump({"k1": self.k1, "b": self.b, "postings": self.postings, "lengths": self.lengths,
+                         "doc_terms": self.doc_terms, "total_length": self.total_length},
+                        file, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, path: str) -> "SparseIndex":
+        with open(path, "rb") as file:
+            state = pickle.load(file)
+        index = cls(k1=state["k1"], b=state["b"])
+        index.postings = state["postings"]
+        index.lengths = state["lengths"]
+        index.doc_terms = state["doc_terms"]
+        index.total_length = state["total_length"]
+        return index
+
+    @classmethod
+    def from_documents(cls, documents: Dict[str, Document]) -> "SparseIndex":
+        """Build the index from chunk id -> Document (versions written before sparse.pkl existed)."""
+        index = cls()
+        index.add(documents.keys(), (document.page_content for document in documents.values()))
+        return index
+
+
+def reciprocal_rank_fusion(rankings: List[List[str]], weights: List[float], k: int = 60) -> List[str]:
+    """Fuse ranked id lists: score(id) = sum(weight / (k + rank)), rank starting at 1."""
+    scores: Dict[str, float] = {}
+    for ranking, weight in zip(rankings, weights):
+        for rank, id in enumerate(ranking, start=1):
+            scores[id] = scores.get(id, 0.0) + weight / (k + rank)
+    return sorted(scores, key=scores.get, reverse=True)
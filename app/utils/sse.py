@@ -0,0 +1,27 @@
+# app/utils/sse.py
+import json
+from typing import Any, Optional
+
+# Headers for text/event-stream responses: no caching and no proxy buffering (Apache/nginx in front)
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "Connection": "keep-alive",
+    "X-Accel-Buffering": "no",
+}
+
+
+def sse_event(data: Any, event: Optional[str] = None, event_id: Optional[str] = None) -> str:
+    """
+    Format one server-sent event frame.
+
+    `data` is sent as JSON unless it already is a string; multi-line payloads are split into
+    several `data:` lines as required by the SSE specification.
+    """
+    payload = data if isinstance(data, str) else json.dumps(data, ensure_ascii=False)
+    lines = []
+    if event:
+        lines.append(f"event: {event}")
+    if event_id:
+        lines.append(f"id: {event_id}")
+    lines.extend(f"data: {line}" for line in payload.split("\n"))
+    return "\n".join(lines) + "\n\n"
@@ -0,0 +1,140 @@
+# app/utils/startup.py
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, Dict, Optional
+
+from app.utils.model_manager import get_model_manager
+from app.utils.settings import STARTUP_MAX_ATTEMPTS, STARTUP_RETRY_SECONDS, WARMUP_MODELS
+
+logger = logging.getLogger(__name__)
+
+#-----------------------------------------------------------------------------------------------------------#
+#   Startup orchestrator.                                                                                    #
+#                                                                                                           #
+#   The lifespan only starts the orchestrator, so the server accepts connections right away: /healthz       #
+#   answers immediately, /readyz and the chat endpoints answer 503 until every step has finished.           #
+#   Independent steps run concurrently, a step waits only for the steps it depends on:                      #
+#                                                                                                           #
+#       docstore ──► parents ──┐                                                                            #
+#       chunks ────────────────┴──► chains (publishes app.state, app is ready)                              #
+#       warmup (optional, does not block readiness)                                                         #
+#                                                                                                           #
+#   A failing step is retried STARTUP_MAX_ATTEMPTS times (Postgres or Ollama may still be starting in the   #
+#   compose setup); after that the app stays up but not ready and /readyz reports the error.               #
+#-----------------------------------------------------------------------------------------------------------#
+
+PENDING, RUNNING, DONE, FAILED = "pending", "running", "done", "failed"
+
+
+class StartupStep:
+    def __init__(self, name: str, func: Callable[[], Awaitable], requires=(), required=True):
+        self.name = name
+        self.func = func
+        self.requires = tuple(requires)
+        # Optional steps (the warm-up) are logged when they fail but do not block readiness
+        self.required = required
+        self.status = PENDING
+        self.error: Optional[str] = None
+        self.attempts = 0
+        self.seconds: Optional[float] = None
+        self.done = asyncio.Event()
+
+    def describe(self) -> dict:
+        return {"status": self.status, "attempts": self.attempts, "seconds": self.seconds, "error": self.error}
+
+
+class StartupOrchestrator:
+    """Runs the startup steps in the background and tracks readiness for /readyz and the dependencies."""
+
+    def __init__(self, max_attempts=STARTUP_MAX_ATTEMPTS, retry_seconds=STARTUP_RETRY_SECONDS):
+        self.max_attempts = max_attempts
+        self.retry_seconds = retry_seconds
+        self.steps: Dict[str, StartupStep] = {}
+        self.ready = False
+        self.started_at: Optional[float] = None
+        self.ready_after: Optional[float] = None
+        self._task: Optional[asyncio.Task] = None
+        self._step_tasks = []
+        self._on_ready = []
+
+    def add_step(self, name: str, func: Callable[[], Awaitable], requires=(), required=True) -> None:
+        self.steps[name] = StartupStep(name, func, requires, required)
+
+    def on_ready(self, callback: Callable[[], None]) -> None:
+        """Register a callback that runs once all required steps are done (e.g. the file watcher)."""
+        self._on_ready.append(callback)
+
+    def start(self) -> asyncio.Task:
+        self.started_at = time.monotonic()
+        self._task = asyncio.create_task(self._run(), name="startup")
+        return self._task
+
+    async def stop(self) -> None:
+        """Cancel the steps that are still running (blocking work already in a thread finishes on its own)."""
+        tasks = [task for task in [self._task, *self._step_tasks] if task and not task.done()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _run_step(self, step: StartupStep) -> None:
+        for name in step.requires:
+            dependency = self.steps[name]
+            await dependency.done.wait()
+            if dependency.status != DONE:
+                step.status, step.error = FAILED, f"requires '{name}', which failed"
+                step.done.set()
+                return
+
+        step.status = RUNNING
+        started = time.perf_counter()
+        while True:
+            step.attempts += 1
+            try:
+                await step.func()
+                step.status, step.error = DONE, None
+                break
+            except Exception as e:
+                step.error = f"{type(e).__name__}: {e}"
+                if step.attempts >= self.max_attempts:
+                    step.status = FAILED
+                    log = logger.error if step.required else logger.warning
+                    log(f"Startup step '{step.name}' failed after {step.attempts} attempts: {step.error}")
+                    break
+                logger.warning(f"Startup step '{step.name}' failed ({step.error}), retrying in {self.retry_seconds}s.")
+                await asyncio.sleep(self.retry_seconds)
+        step.seconds = round(time.perf_counter() - started, 2)
+        if step.status == DONE:
+            logger.info(f"Startup step '{step.name}' done in {step.seconds}s.")
+        step.done.set()
+
+    async def _run(self) -> None:
+        tasks = {name: asyncio.create_task(self._run_step(step)) for name, step in self.steps.items()}
+        self._step_tasks = list(tasks.values())
+        await asyncio.gather(*(tasks[name] for name, step in self.steps.items() if step.required))
+        if all(step.status == DONE for step in self.steps.values() if step.required):
+            self.ready = True
+            self.ready_after = round(time.monotonic() - self.started_at, 2)
+            logger.info(f"App ready after {self.ready_after}s.")
+            for callback in self._on_ready:
+                try:
+                    callback()
+                except Exception as e:
+                    logger.error(f"Ready callback failed: {e}", exc_info=True)
+        else:
+            logger.error("App startup failed, see /readyz.")
+        # Optional steps may still be running
+        await asyncio.gather(*tasks.values())
+
+    def status(self) -> dict:
+        return {
+            "ready": self.ready,
+            "ready_after_seconds": self.ready_after,
+            "steps": {name: step.describe() for name, step in self.steps.items()},
+        }
+
+
+async def warm_up_models(embeddings, models=WARMUP_MODELS) -> None:
+    """Load the embedding model and the chat models into Ollama so the first request does not pay for it."""
+    await embeddings.aembed_query("warm up")
+    await get_model_manager().preload(models)
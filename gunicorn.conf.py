@@ -0,0 +1,50 @@
+# gunicorn.conf.py
+import multiprocessing
+import os
+
+#-----------------------------------------------------------------------------------------------------------#
+#   Production serving: gunicorn master + N uvicorn workers.                                                #
+#                                                                                                           #
+#       gunicorn -c gunicorn.conf.py main:app        (API workers, INDEX_ROLE=reader)                       #
+#       python app/scripts/run_indexer.py            (one indexer process, the only writer of app/index/)   #
+#                                                                                                           #
+#   Every worker memory-maps the published versions read-only: a flat or IVF faiss index, vectors.npy and   #
+#   the chunk store are in RAM once (page cache) whatever the number of workers; HNSW graphs and the BM25   #
+#   postings are loaded per worker. A worker swaps to a new version when the indexer publishes it.          #
+#   Requests are spread over all workers, CPU-bound work (BM25 scoring, markdown rendering) uses all cores. #
+#                                                                                                           #
+#   State kept per worker, not shared:                                                                      #
+#     - admission control and the model manager: MODEL_CONCURRENCY and ADMISSION_QUEUE_SIZE are per worker  #
+#     - answer and rewrite caches: a hit only helps the worker that stored it (the embedding cache has a    #
+#       sqlite tier that all workers share)                                                                 #
+#     - session histories: the turns of a session land on any worker, so with INDEX_ROLE=reader a cached    #
+#       history is reloaded from Postgres at the start of every request (see session_cache.py)              #
+#-----------------------------------------------------------------------------------------------------------#
+
+# Workers only read the indexes; set before the workers import the app
+os.environ.setdefault("INDEX_ROLE", "reader")
+
+bind = os.getenv("BIND", "0.0.0.0:8000")
+workers = int(os.getenv("WEB_CONCURRENCY", str(min(multiprocessing.cpu_count(), 4))))
+worker_class = "uvicorn.workers.UvicornWorker"
+# Each worker loads the app itself after the fork: faiss, the thread pools and the database engine
+# must not be shared with the master
+preload_app = False
+# Streams (SSE) and websockets stay open for a whole answer
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "300"))
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", "60"))
+keepalive = 5
+# Behind the Apache reverse proxy, like uvicorn --proxy-headers
+forwarded_allow_ips = os.getenv("FORWARDED_ALLOW_IPS", "*")
+accesslog = "-"
+errorlog = "-"
+loglevel = os.getenv("LOG_LEVEL", "info")
+
+
+def on_starting(server):
+    """Create the tables once in the master; the workers run as readers and skip the create_all of main.py."""
+    from app.database.config import Base, engine
+    from app.models.models import User, ChatHistory, pgDocument  # registers the tables on Base
+
+    Base.metadata.create_all(bind=engine)
+    engine.dispose()  # no pooled connection may be inherited by the workers
@@ -1,13 +1,17 @@
 # app/main.py
 import warnings, logging
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Request
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
 from fastapi_proxiedheadersmiddleware import ProxiedHeadersMiddleware
 from app.routers import user_router
 from app.routers import chat_router
+from app.routers import ws_router
 from app.database.config import engine, Base
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.middleware.trustedhost import TrustedHostMiddleware
-from app.utils.services import initialize_app_state, start_file_watcher
+from app.utils.services import (build_startup, start_file_watcher, start_index_watcher, stop_file_watcher,
+                                stop_index_watcher)
+from app.utils.settings import INDEX_ROLE, REINDEX_WATCH_ENABLED
 from contextlib import asynccontextmanager
 
 
@@ -27,19 +31,31 @@ logging.getLogger("httpx").setLevel(logging.WARNING)         # Suppress httpx lo
 # Surpress all warnings
 warnings.filterwarnings('ignore')
 #Base.metadata.drop_all(bind=engine)
-# Create all database tables
 from app.models.models import User, ChatHistory, pgDocument  # should always be imported if u want to create tables
-Base.metadata.create_all(bind=engine)
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # Startup logic
-    #start_file_watcher(app)
+    # Startup logic: indexes and models are loaded in the background, /readyz tells when we are ready
     print("running: ")
-    initialize_app_state(app)
+    if INDEX_ROLE != "reader":
+        # Create all database tables; under gunicorn (INDEX_ROLE=reader) the master does it once in on_starting,
+        # before any worker starts, instead of every worker racing on it
+        Base.metadata.create_all(bind=engine)
+    startup = build_startup(app)
+    if INDEX_ROLE == "reader":
+        # gunicorn worker: app/scripts/run_indexer.py publishes new versions, this process only swaps to them
+        startup.on_ready(lambda: start_index_watcher(app))
+    elif REINDEX_WATCH_ENABLED:
+        # Keep the indexes in sync with app/files/ in a background worker, once they are loaded
+        startup.on_ready(lambda: start_file_watcher(app))
+    app.state.startup = startup
+    startup.start()
     yield
     # Add shutdown logic here if needed
+    await startup.stop()
+    stop_file_watcher(app)
+    stop_index_watcher(app)
     #cleanup_app_state(app)
 
 
@@ -82,17 +98,8 @@ app.add_middleware(
 app.include_router(user_router.router)
 app.include_router(chat_router.router)
 
-# websocket endpoint for real-time chat
-@app.websocket("ws/chat/{session_id}")
-async def websocket_endpoint(websocket: WebSocket, session_id: str):
-    await websocket.accept()
-    try:
-        while True:
-            data = await websocket.receive_text()
-            response = f"Session {session_id}: {data}"
-            await websocket.send_text(response)
-    except WebSocketDisconnect:
-        print(f"WebSocket disconnected for session {session_id}")
+# websocket endpoint for real-time chat: /ws/chat/{session_id}
+app.include_router(ws_router.router)
 
 
 # Middleware to handle X-Forwarded-* headers (if needed)
@@ -115,3 +122,16 @@ async def handle_proxy_headers(request: Request, call_next):
 async def root():
     return {"message": "Welcome to Chatbot API"}
 
+
+# Liveness: the process is up and serving, nothing is checked
+@app.get("/healthz")
+async def healthz():
+    return {"status": "ok"}
+
+
+# Readiness: 200 once the indexes are loaded and the chains are set up, 503 with the startup steps before
+@app.get("/readyz")
+async def readyz(request: Request):
+    startup = request.app.state.startup
+    return JSONResponse(startup.status(), status_code=200 if startup.ready else 503)
+
@@ -0,0 +1,86 @@
+import asyncio
+
+import pytest
+
+from app.utils.admission import BATCH, INTERACTIVE, AdmissionController, AdmissionRejected
+
+
+def controller(**kwargs):
+    return AdmissionController(**{"limits": {}, "default_limit": 1, "queue_size": 10, "timeout": 5, **kwargs})
+
+
+def test_released_slot_goes_to_interactive_before_batch_requests():
+    async def scenario():
+        admission = controller()
+        slot = await admission.acquire("llama", INTERACTIVE)
+        order = []
+
+        async def request(name, priority):
+            async with await admission.acquire("llama", priority):
+                order.append(name)
+                await asyncio.sleep(0)
+
+        waiting = []
+        for name, priority in [("batch-1", BATCH), ("interactive-1", INTERACTIVE), ("batch-2", BATCH),
+                               ("interactive-2", INTERACTIVE)]:
+            waiting.append(asyncio.create_task(request(name, priority)))
+            await asyncio.sleep(0)  # queued in this order
+        assert admission.stats()["llama"]["queue_depth"] == 4
+
+        slot.release()
+        await asyncio.gather(*waiting)
+        return order, admission.stats()["llama"]
+
+    order, stats = asyncio.run(scenario())
+    assert order == ["interactive-1", "interactive-2", "batch-1", "batch-2"]
+    assert stats["active"] == 0 and stats["admitted"] == 5
+
+
+def test_full_queue_is_rejected_with_retry_after():
+    async def scenario():
+        admission = controller(queue_size=1)
+        slot = await admission.acquire("llama")
+        queued = asyncio.create_task(admission.acquire("llama"))
+        await asyncio.sleep(0)
+        with pytest.raises(AdmissionRejected) as rejected:
+            await admission.acquire("llama")
+        # other models have their own slots
+        await admission.acquire("mistral")
+        slot.release()
+        (await queued).release()
+        return rejected.value, admission.stats()["llama"]
+
+    rejected, stats = asyncio.run(scenario())
+    assert rejected.model == "llama" and rejected.reason == "queue is full"
+    assert rejected.retry_after >= 1
+    assert stats["rejected"] == 1 and stats["active"] == 0
+
+
+def test_waiting_too_long_is_rejected():
+    async def scenario():
+        admission = controller(timeout=0.01)
+        slot = await admission.acquire("llama")
+        with pytest.raises(AdmissionRejected) as rejected:
+            await admission.acquire("llama")
+        slot.release()
+        return rejected.value, admission.stats()["llama"]
+
+    rejected, stats = asyncio.run(scenario())
+    assert rejected.reason.startswith("no slot within")
+    assert stats["timed_out"] == 1 and stats["queue_depth"] == 0 and stats["active"] == 0
+
+
+def test_release_is_idempotent():
+    async def scenario():
+        admission = controller(default_limit=2)
+        first = await admission.acquire("llama")
+        second = await admission.acquire("llama")
+        first.release()
+        first.release()  # must not free the slot held by `second`
+        async with first:
+            pass
+        active = admission.stats()["llama"]["active"]
+        second.release()
+        return active, admission.stats()["llama"]["active"]
+
+    assert asyncio.run(scenario()) == (1, 0)
@@ -0,0 +1,93 @@
+import numpy as np
+import pytest
+
+faiss = pytest.importorskip("faiss")
+
+from app.utils import ann_index
+from app.utils.ann_index import build_ann_index, default_nlist, default_pq_m, factory_string, resolve_index_type
+
+
+@pytest.fixture(autouse=True)
+def default_settings(monkeypatch):
+    monkeypatch.setattr(ann_index, "ANN_NLIST", 0)
+    monkeypatch.setattr(ann_index, "ANN_PQ_M", 0)
+    monkeypatch.setattr(ann_index, "ANN_HNSW_M", 32)
+
+
+@pytest.mark.parametrize("n_vectors, nlist", [(0, 1), (100, 2), (10_000, 256), (1_000_000, 4000), (100_000_000, 40_000)])
+def test_default_nlist(n_vectors, nlist):
+    assert default_nlist(n_vectors) == nlist
+
+
+def test_default_nlist_keeps_enough_training_points_per_list():
+    for n_vectors in (39, 1_000, 12_345, 250_000):
+        assert n_vectors // default_nlist(n_vectors) >= 39
+
+
+@pytest.mark.parametrize("dimension, m", [(1024, 64), (768, 48), (384, 24), (100, 5), (7, 1)])
+def test_default_pq_m_divides_the_dimension(dimension, m):
+    assert default_pq_m(dimension) == m
+
+
+@pytest.mark.parametrize("index_type, storage, factory", [
+    ("flat", "float32", "Flat"),
+    ("flat", "float16", "SQfp16"),
+    ("hnsw", "float32", "HNSW32,Flat"),
+    ("hnsw", "int8", "HNSW32,SQ8"),
+    ("ivf_flat", "float32", "IVF256,Flat"),
+    ("ivf_flat", "float16", "IVF256,SQfp16"),
+    ("ivf_pq", "float32", "IVF256,PQ64x8"),
+    ("ivf_pq", "int8", "IVF256,PQ64x8"),
+    ("flat", "binary", "BFlat"),
+    ("hnsw", "binary", "BHNSW32"),
+    ("ivf_flat", "binary", "BIVF256"),
+    ("ivf_pq", "binary", "BIVF256"),
+])
+def test_factory_string(index_type, storage, factory):
+    assert factory_string(index_type, 1024, 10_000, storage) == factory
+
+
+def test_factory_string_uses_the_configured_lists_and_codes(monkeypatch):
+    monkeypatch.setattr(ann_index, "ANN_NLIST", 1000)
+    monkeypatch.setattr(ann_index, "ANN_PQ_M", 32)
+    assert factory_string("ivf_pq", 1024, 10_000) == "IVF1000,PQ32x8"
+
+    monkeypatch.setattr(ann_index, "ANN_PQ_M", 30)
+    with pytest.raises(ValueError):
+        factory_string("ivf_pq", 1024, 10_000)
+    with pytest.raises(ValueError):
+        factory_string("flat", 1024, 10_000, storage="float8")
+
+
+def test_resolve_index_type(monkeypatch):
+    monkeypatch.setattr(ann_index, "ANN_AUTO_FLAT_BELOW", 50_000)
+    monkeypatch.setattr(ann_index, "ANN_AUTO_HNSW_BELOW", 1_000_000)
+    assert [resolve_index_type("auto", n) for n in (10, 50_000, 1_000_000)] == ["flat", "hnsw", "ivf_pq"]
+    assert resolve_index_type("ivf_flat", 10) == "ivf_flat"
+    with pytest.raises(ValueError):
+        resolve_index_type("lsh", 10)
+
+
+def test_too_few_vectors_for_ivf_fall_back_to_flat():
+    flat = faiss.IndexFlatL2(8)
+    flat.add(np.random.default_rng(0).standard_normal((100, 8)).astype(np.float32))
+
+    index, description = build_ann_index(flat, "ivf_flat")
+
+    assert index is flat
+    assert description["type"] == "flat" and description["rescore"] is False
+
+
+@pytest.mark.parametrize("storage, binary", [("float16", False), ("binary", True)])
+def test_build_ann_index_keeps_vector_positions(storage, binary):
+    vectors = np.random.default_rng(0).standard_normal((500, 32)).astype(np.float32)
+    flat = faiss.IndexFlatL2(32)
+    flat.add(vectors)
+
+    index, description = build_ann_index(flat, "flat", storage=storage)
+
+    assert isinstance(index, faiss.IndexBinary) is binary
+    assert index.ntotal == 500 and description["rescore"] is True
+    query = ann_index.binarize(vectors[:5]) if binary else vectors[:5]
+    _, positions = index.search(query, 1)
+    assert positions[:, 0].tolist() == [0, 1, 2, 3, 4]
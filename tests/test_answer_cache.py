@@ -0,0 +1,67 @@
+import numpy as np
+
+from app.utils.answer_cache import AnswerCache
+
+
+def vector(*values):
+    return np.array(values, dtype=np.float32)
+
+
+def test_lookup_hits_only_above_threshold():
+    cache = AnswerCache(threshold=0.95, ttl=0, max_entries=10)
+    cache.put("llama", "v1", vector(1, 0, 0), "Wie viele Urlaubstage habe ich?", "30", frozenset({"doc-1"}))
+
+    hit = cache.lookup("llama", "v1", vector(1, 0.1, 0))  # cosine ~0.995
+    assert hit is not None and hit.answer == "30"
+    assert cache.lookup("llama", "v1", vector(1, 1, 0)) is None  # cosine ~0.707
+    assert cache.lookup("mistral", "v1", vector(1, 0, 0)) is None  # other model
+    assert (cache.hits, cache.misses) == (1, 2)
+
+
+def test_lookup_returns_most_similar_entry():
+    cache = AnswerCache(threshold=0.9, ttl=0, max_entries=10)
+    cache.put("llama", "v1", vector(1, 0, 0), "a", "first", frozenset({"doc-1"}))
+    cache.put("llama", "v1", vector(0.95, 0.3, 0), "b", "second", frozenset({"doc-1"}))
+
+    assert cache.lookup("llama", "v1", vector(0.9, 0.35, 0)).answer == "second"
+
+
+def test_empty_answers_are_not_cached():
+    cache = AnswerCache(threshold=0.9, ttl=0, max_entries=10)
+    cache.put("llama", "v1", vector(1, 0), "a", "", frozenset({"doc-1"}))
+    assert cache.stats()["entries"] == 0
+
+
+def test_oldest_entry_is_evicted_when_full():
+    cache = AnswerCache(threshold=0.99, ttl=0, max_entries=2)
+    cache.put("llama", "v1", vector(1, 0, 0), "a", "first", frozenset({"doc-1"}))
+    cache.put("llama", "v1", vector(0, 1, 0), "b", "second", frozenset({"doc-1"}))
+    cache.put("mistral", "v1", vector(0, 0, 1), "c", "third", frozenset({"doc-1"}))
+
+    assert cache.stats()["entries"] == 2
+    assert cache.lookup("llama", "v1", vector(1, 0, 0)) is None
+    assert cache.lookup("llama", "v1", vector(0, 1, 0)).answer == "second"
+
+
+def test_expired_entries_are_not_returned():
+    cache = AnswerCache(threshold=0.9, ttl=60, max_entries=10)
+    cache.put("llama", "v1", vector(1, 0), "a", "old", frozenset({"doc-1"}))
+    cache._buckets[("llama", "v1")].entries[0].created -= 61
+
+    assert cache.lookup("llama", "v1", vector(1, 0)) is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_new_index_version_drops_answers_of_changed_documents():
+    cache = AnswerCache(threshold=0.9, ttl=0, max_entries=10)
+    cache.put("llama", "v1", vector(1, 0, 0), "a", "unchanged", frozenset({"doc-1"}))
+    cache.put("llama", "v1", vector(0, 1, 0), "b", "changed", frozenset({"doc-1", "doc-2"}))
+    cache.put("llama", "v1", vector(0, 0, 1), "c", "no sources", frozenset())
+
+    cache.rebase("v2", valid_sources={"doc-1", "doc-3"})
+
+    assert cache.lookup("llama", "v1", vector(1, 0, 0)) is None  # old version is gone
+    assert cache.lookup("llama", "v2", vector(1, 0, 0)).answer == "unchanged"
+    assert cache.lookup("llama", "v2", vector(0, 1, 0)) is None
+    assert cache.lookup("llama", "v2", vector(0, 0, 1)) is None
+    assert cache.invalidated == 2
@@ -0,0 +1,89 @@
+import random
+
+import pytest
+from langchain_core.documents import Document
+
+from app.utils.chunk_store import ChunkStore, ChunkStoreWriter, write_chunk_store
+
+
+@pytest.fixture
+def chunks():
+    rng = random.Random(0)
+    ids = [f"chunk-{i:03d}" for i in range(50)]
+    rng.shuffle(ids)  # index order is not id order
+    documents = []
+    for i, id in enumerate(ids):
+        metadata = {"source": f"app/files/doc-{i % 3}.pdf", "page": i}
+        if i % 5 == 0:
+            metadata["sections"] = ["Urlaub", "Teilzeit"]
+        if i % 7 == 0:
+            del metadata["page"]
+        documents.append(Document(page_content=f"Text {i} über Überstunden – {id}", metadata=metadata))
+    return ids, documents
+
+
+def test_round_trip(tmp_path, chunks):
+    ids, documents = chunks
+    write_chunk_store(tmp_path, ids, documents)
+
+    store = ChunkStore(tmp_path)
+
+    assert len(store) == 50
+    for position, (id, document) in enumerate(zip(ids, documents)):
+        assert store.id(position) == id
+        assert store.text(position) == document.page_content
+        assert store.metadata_of(position) == document.metadata
+        assert store.position(id) == position
+    assert list(store.ids()) == ids
+    assert [(id, document.page_content, document.metadata) for id, document in store.items()] == \
+        [(id, document.page_content, document.metadata) for id, document in zip(ids, documents)]
+    # "source" is interned: three files, one table entry each
+    assert len(store.tables[store.keys.index("source")]) == 3
+
+
+def test_search_by_id(tmp_path, chunks):
+    ids, documents = chunks
+    write_chunk_store(tmp_path, ids, documents)
+    store = ChunkStore(tmp_path)
+
+    found = store.search(ids[17])
+    assert isinstance(found, Document)
+    assert (found.id, found.page_content, found.metadata) == (ids[17], documents[17].page_content, documents[17].metadata)
+    assert store.search("chunk-999") == "ID chunk-999 not found."
+    assert store.position("") is None
+
+
+def test_chunk_ids_maps_index_positions_to_ids(tmp_path, chunks):
+    ids, documents = chunks
+    write_chunk_store(tmp_path, ids, documents)
+
+    index_ids = ChunkStore(tmp_path).index_ids()
+
+    assert len(index_ids) == 50
+    assert index_ids[0] == ids[0] and index_ids[49] == ids[49]
+    assert list(index_ids) == list(range(50))
+    assert dict(index_ids.items()) == dict(enumerate(ids))
+    assert index_ids.get(50) is None
+    with pytest.raises(KeyError):
+        index_ids[-1]
+
+
+def test_empty_store(tmp_path):
+    ChunkStoreWriter(tmp_path).close()
+
+    store = ChunkStore(tmp_path)
+
+    assert len(store) == 0
+    assert list(store.ids()) == []
+    assert store.search("chunk-000") == "ID chunk-000 not found."
+
+
+def test_store_is_read_only(tmp_path, chunks):
+    ids, documents = chunks
+    write_chunk_store(tmp_path, ids[:1], documents[:1])
+    store = ChunkStore(tmp_path)
+
+    with pytest.raises(NotImplementedError):
+        store.add({"new": Document(page_content="x")})
+    with pytest.raises(NotImplementedError):
+        store.delete(ids[:1])
@@ -0,0 +1,71 @@
+import pytest
+from langchain_core.documents import Document
+from langchain_core.messages import AIMessage, HumanMessage
+
+from app.utils import context_packer
+from app.utils.context_packer import MESSAGE_OVERHEAD_TOKENS, ContextPacker
+
+
+class WordCounter:
+    """One token per word, so the budgets in the tests are easy to follow."""
+
+    def count(self, text):
+        return len(text.split())
+
+    def truncate(self, text, max_tokens):
+        return " ".join(text.split()[:max_tokens])
+
+
+@pytest.fixture
+def packer(monkeypatch):
+    monkeypatch.setattr(context_packer, "get_token_counter", lambda model: WordCounter())
+    return ContextPacker("llama", context_window=1000, answer_reserve=200, history_budget=50, min_chunk_tokens=5)
+
+
+def words(n, word="wort"):
+    return " ".join([word] * n)
+
+
+def test_split_history_keeps_newest_whole_turns(packer):
+    # every turn costs 2 * (10 + overhead) = 36 tokens, only one fits the budget of 50
+    messages = []
+    for turn in range(3):
+        messages += [HumanMessage(content=words(10, f"q{turn}")), AIMessage(content=words(10, f"a{turn}"))]
+
+    older, recent = packer.split_history(messages)
+
+    assert older == messages[:4]
+    assert recent == messages[4:]
+
+
+def test_split_history_never_keeps_a_question_without_its_answer(packer):
+    messages = [HumanMessage(content=words(5)), AIMessage(content=words(30)), HumanMessage(content=words(5)),
+                AIMessage(content=words(5))]
+
+    older, recent = packer.split_history(messages)
+
+    assert [message.type for message in recent] == ["human", "ai"]
+    assert older + recent == messages
+
+
+def test_pack_documents_deduplicates_and_truncates_the_first_document_that_does_not_fit(packer):
+    documents = [Document(page_content=words(20, "a"), metadata={"source": "a"}),
+                 Document(page_content=words(20, "a"), metadata={"source": "copy"}),
+                 Document(page_content=words(20, "b"), metadata={"source": "b"}),
+                 Document(page_content=words(20, "c"), metadata={"source": "c"})]
+    budget = 2 * (20 + MESSAGE_OVERHEAD_TOKENS) + MESSAGE_OVERHEAD_TOKENS + 10
+
+    packed = packer.pack_documents(documents, budget)
+
+    assert [document.metadata["source"] for document in packed] == ["a", "b", "c"]
+    assert packed[2].page_content == words(10, "c")
+    assert packed[2].metadata["truncated"] is True
+    assert "truncated" not in documents[3].metadata
+
+
+def test_pack_documents_drops_a_remainder_below_min_chunk_tokens(packer):
+    documents = [Document(page_content=words(20, "a")), Document(page_content=words(20, "b"))]
+    budget = (20 + MESSAGE_OVERHEAD_TOKENS) + MESSAGE_OVERHEAD_TOKENS + 4
+
+    assert [document.page_content for document in packer.pack_documents(documents, budget)] == [words(20, "a")]
+    assert packer.document_budget(used_tokens=300) == 500
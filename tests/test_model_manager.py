@@ -0,0 +1,85 @@
+import asyncio
+
+from app.utils.model_manager import ModelManager
+
+
+class RecordingManager(ModelManager):
+    """ModelManager with Ollama replaced by a log of the models that started generating."""
+
+    def __init__(self, max_active):
+        super().__init__(base_url="http://ollama.invalid", max_active=max_active)
+        self.started = []
+        self.max_concurrent = {}
+
+    async def ensure_loaded(self, model):
+        self.started.append(model)
+        self.max_concurrent[model] = max(self.max_concurrent.get(model, 0), self._active[model])
+
+
+async def generate(manager, model, release):
+    async with manager.use(model):
+        await release.wait()
+
+
+async def queue(manager, requests, release):
+    tasks = []
+    for model in requests:
+        tasks.append(asyncio.create_task(generate(manager, model, release)))
+        await asyncio.sleep(0)  # queued in this order
+    return tasks
+
+
+def test_waiting_requests_of_a_switched_in_model_run_in_one_batch():
+    async def scenario():
+        manager = RecordingManager(max_active=1)
+        release_first, release_rest = asyncio.Event(), asyncio.Event()
+        first = asyncio.create_task(generate(manager, "big-a", release_first))
+        await asyncio.sleep(0)
+        # "big-a" is active, but its second request must not overtake the switch the first "big-b" waits for
+        rest = await queue(manager, ["big-b", "big-a", "big-b"], release_rest)
+        assert manager.started == ["big-a"]
+        assert manager.stats()["models"]["big-b"]["queue_depth"] == 2
+
+        release_first.set()
+        await first
+        for _ in range(5):
+            await asyncio.sleep(0)
+        # both "big-b" requests run together after a single switch
+        assert manager.started == ["big-a", "big-b", "big-b"]
+        assert manager.stats()["active"] == {"big-b": 2}
+
+        release_rest.set()
+        await asyncio.gather(*rest)
+        return manager
+
+    manager = asyncio.run(scenario())
+    assert manager.started == ["big-a", "big-b", "big-b", "big-a"]
+    assert manager.max_concurrent == {"big-a": 1, "big-b": 2}
+    assert manager.stats()["active"] == {}
+
+
+def test_requests_of_the_active_model_join_while_nobody_waits_for_a_switch():
+    async def scenario():
+        manager = RecordingManager(max_active=1)
+        release = asyncio.Event()
+        tasks = await queue(manager, ["big-a", "big-a", "big-a"], release)
+        assert manager.stats()["active"] == {"big-a": 3}
+        release.set()
+        await asyncio.gather(*tasks)
+        return manager
+
+    manager = asyncio.run(scenario())
+    assert manager.max_concurrent == {"big-a": 3}
+
+
+def test_without_a_limit_every_model_starts_at_once():
+    async def scenario():
+        manager = RecordingManager(max_active=0)
+        release = asyncio.Event()
+        tasks = await queue(manager, ["big-a", "big-b", "small"], release)
+        started = list(manager.started)
+        release.set()
+        await asyncio.gather(*tasks)
+        return started
+
+    assert asyncio.run(scenario()) == ["big-a", "big-b", "small"]
@@ -0,0 +1,80 @@
+import numpy as np
+import pytest
+
+faiss = pytest.importorskip("faiss")
+
+from app.utils.quantized_index import RescoringIndex, binarize, index_nbytes
+
+
+def exact_top_k(vectors, queries, k):
+    distances = ((queries[:, None, :] - vectors[None, :, :]) ** 2).sum(axis=2)
+    order = np.argsort(distances, axis=1)[:, :k]
+    return np.take_along_axis(distances, order, axis=1), order
+
+
+@pytest.fixture
+def data():
+    rng = np.random.default_rng(0)
+    return rng.standard_normal((2000, 32)).astype(np.float32), rng.standard_normal((20, 32)).astype(np.float32)
+
+
+def test_binarize_packs_one_bit_per_dimension():
+    vectors = np.array([[0.5, -1, 0, 2, -0.1, 3, 1, -2, 4]], dtype=np.float32)
+    assert binarize(vectors).tolist() == [[0b10010110, 0b10000000]]
+
+
+def test_rescored_results_are_in_exact_distance_order(data):
+    vectors, queries = data
+    coarse = faiss.index_factory(32, "SQ8")
+    coarse.train(vectors)
+    coarse.add(vectors)
+    index = RescoringIndex(coarse, vectors, factor=4)
+
+    distances, positions = index.search(queries, 10)
+
+    exact = ((queries[:, None, :] - vectors[positions]) ** 2).sum(axis=2)
+    np.testing.assert_allclose(distances, exact, rtol=1e-5)
+    assert (np.diff(distances, axis=1) >= 0).all()
+    _, expected = exact_top_k(vectors, queries, 10)
+    recall = np.mean([len(set(found) & set(truth)) / 10 for found, truth in zip(positions, expected)])
+    assert recall >= 0.95
+
+
+def test_rescoring_a_flat_coarse_index_is_exact(data):
+    vectors, queries = data
+    coarse = faiss.IndexFlatL2(32)
+    coarse.add(vectors)
+
+    distances, positions = RescoringIndex(coarse, vectors, factor=2).search(queries, 5)
+
+    expected_distances, expected_positions = exact_top_k(vectors, queries, 5)
+    np.testing.assert_array_equal(positions, expected_positions)
+    np.testing.assert_allclose(distances, expected_distances, rtol=1e-5)
+
+
+def test_binary_coarse_index_is_rescored_against_float_vectors(data):
+    vectors, queries = data
+    coarse = faiss.IndexBinaryFlat(32)
+    coarse.add(binarize(vectors))
+    index = RescoringIndex(coarse, vectors, factor=8)
+
+    distances, positions = index.search(queries, 5)
+    hamming, _ = index.search(queries, 5, rescore=False)
+
+    exact = ((queries[:, None, :] - vectors[positions]) ** 2).sum(axis=2)
+    np.testing.assert_allclose(distances, exact, rtol=1e-5)
+    assert hamming.dtype == np.int32  # the coarse pass alone returns Hamming distances
+    assert index.d == 32 and index.ntotal == 2000
+    np.testing.assert_array_equal(index.reconstruct(7), vectors[7])
+    assert index_nbytes(index) < vectors.nbytes / 16
+
+
+def test_fewer_candidates_than_k_are_padded(data):
+    vectors, queries = data
+    coarse = faiss.IndexFlatL2(32)
+    coarse.add(vectors[:3])
+
+    distances, positions = RescoringIndex(coarse, vectors[:3]).search(queries[:2], 5)
+
+    assert (positions[:, 3:] == -1).all() and np.isinf(distances[:, 3:]).all()
+    assert sorted(positions[0, :3].tolist()) == [0, 1, 2]
@@ -0,0 +1,70 @@
+import pytest
+from langchain_core.messages import AIMessage, HumanMessage
+
+from app.utils.query_rewriter import QueryRewriter, RewriteCache, needs_rewrite
+
+
+@pytest.mark.parametrize("question", [
+    "Wie viele Urlaubstage habe ich pro Jahr?",
+    "How do I request parental leave in the portal?",
+    "Welche Unterlagen brauche ich für die Reisekostenabrechnung?",
+])
+def test_self_contained_questions_skip_the_rewrite(question):
+    assert not needs_rewrite(question)
+
+
+@pytest.mark.parametrize("question", [
+    "Und für Teilzeit?",                                   # too short
+    "und wie ist das bei Teilzeitkräften geregelt?",       # leading conjunction
+    "What about interns working less than twenty hours?",  # elliptic follow-up
+    "Wie viele Tage bekomme ich dafür zusätzlich frei?",   # refers back ("dafür")
+    "Can I carry them over into the next calendar year?",  # refers back ("them")
+])
+def test_follow_up_questions_are_rewritten(question):
+    assert needs_rewrite(question)
+
+
+class CountingRewriter(QueryRewriter):
+    """QueryRewriter with the LLM chain replaced by a counter."""
+
+    def __init__(self, cache):
+        self.model_name = "rewrite"
+        self.cache = cache
+        self.calls = 0
+        self.chain = self
+
+    def invoke(self, inputs):
+        self.calls += 1
+        return "Wie viele Urlaubstage bekommen Teilzeitkräfte?"
+
+
+def test_llm_is_only_called_for_uncached_follow_ups():
+    rewriter = CountingRewriter(RewriteCache(max_items=10))
+    history = [HumanMessage(content="Wie viele Urlaubstage habe ich?"), AIMessage(content="30 Tage.")]
+
+    assert rewriter.rewrite({"input": "Und für Teilzeit?", "chat_history": []}) == "Und für Teilzeit?"
+    assert rewriter.rewrite({"input": "Wie beantrage ich meinen Urlaub im Portal?", "chat_history": history}) \
+        == "Wie beantrage ich meinen Urlaub im Portal?"
+    assert rewriter.calls == 0
+
+    for _ in range(2):
+        assert rewriter.rewrite({"input": "Und für Teilzeit?", "chat_history": history}) \
+            == "Wie viele Urlaubstage bekommen Teilzeitkräfte?"
+    assert rewriter.calls == 1
+    assert rewriter.cache.stats() == {"items": 1, "max_items": 10, "skipped_first_turn": 1, "skipped_heuristic": 1,
+                                      "hits": 1, "llm_rewrites": 1}
+
+
+def test_cached_never_calls_the_llm():
+    rewriter = CountingRewriter(RewriteCache(max_items=10))
+    history = [HumanMessage(content="Wie viele Urlaubstage habe ich?"), AIMessage(content="30 Tage.")]
+    follow_up = {"input": "Und für Teilzeit?", "chat_history": history}
+
+    assert rewriter.cached({"input": "Und für Teilzeit?", "chat_history": []}) == "Und für Teilzeit?"
+    assert rewriter.cached(follow_up) is None
+    assert rewriter.calls == 0
+
+    rewriter.rewrite(follow_up)
+    assert rewriter.cached(follow_up) == "Wie viele Urlaubstage bekommen Teilzeitkräfte?"
+    assert rewriter.calls == 1
+    assert rewriter.cache.stats()["llm_rewrites"] == 1
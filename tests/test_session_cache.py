@@ -0,0 +1,68 @@
+from types import SimpleNamespace
+
+import pytest
+
+from app.utils import session_cache
+from app.utils.session_cache import SessionHistoryCache, history_from_turns
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = SimpleNamespace(value=1000.0)
+    monkeypatch.setattr(session_cache, "time", SimpleNamespace(monotonic=lambda: now.value))
+    return now
+
+
+def test_least_recently_used_session_is_evicted(clock):
+    cache = SessionHistoryCache(max_sessions=2, ttl=0, max_turns=5)
+    cache["a"] = cache.new_history()
+    cache["b"] = cache.new_history()
+    assert "a" in cache  # a is now more recent than b
+    cache["c"] = cache.new_history()
+
+    assert "b" not in cache
+    assert "a" in cache and "c" in cache
+    assert cache.evictions == 1
+
+
+def test_idle_session_expires_after_ttl(clock):
+    cache = SessionHistoryCache(max_sessions=10, ttl=60, max_turns=5)
+    cache["a"] = cache.new_history()
+    clock.value += 59
+    assert cache.get("a") is not None  # access refreshes the ttl
+    clock.value += 59
+    assert cache.get("a") is not None
+    clock.value += 61
+
+    assert cache.get("a") is None
+    assert len(cache) == 0
+    with pytest.raises(KeyError):
+        cache["a"]
+
+
+def test_append_turn_updates_cached_history_in_place(clock):
+    cache = SessionHistoryCache(max_sessions=10, ttl=0, max_turns=2)
+    history = cache.new_history()
+    cache["a"] = history
+
+    for turn in range(3):
+        cache.append_turn("a", f"question {turn}", f"answer {turn}")
+    cache.append_turn("unknown", "question", "answer")  # not cached: nothing to update
+
+    assert [message.content for message in cache["a"].messages] == ["question 1", "answer 1", "question 2", "answer 2"]
+    assert cache["a"] is history
+    assert "unknown" not in cache
+
+
+def test_history_from_turns_keeps_the_last_turns_as_text():
+    records = [SimpleNamespace(question=f"q{i}", response=[{"type": "text", "content": f"<p>a{i}</p>"}]) for i in range(4)]
+
+    history = history_from_turns(records, max_turns=2)
+
+    assert [message.type for message in history.messages] == ["human", "ai", "human", "ai"]
+    assert [message.content for message in history.messages] == ["q2", "a2", "q3", "a3"]
+
+
+def test_revalidate_follows_the_serving_role():
+    assert SessionHistoryCache(revalidate=True).stats()["revalidate"] is True
+    assert SessionHistoryCache().revalidate is (session_cache.INDEX_ROLE == "reader")
@@ -0,0 +1,122 @@
+import math
+import random
+from collections import Counter
+
+import pytest
+
+from app.utils.sparse_index import SparseIndex, reciprocal_rank_fusion, tokenize
+
+
+def brute_force_bm25(index, query):
+    """Reference Okapi BM25 over every chunk and every query term."""
+    total = len(index.lengths)
+    average_length = index.total_length / total
+    scores = {}
+    for id in index.lengths:
+        score = 0.0
+        for term in set(tokenize(query)):
+            posting = index.postings.get(term, {})
+            if id not in posting:
+                continue
+            idf = math.log(1 + (total - len(posting) + 0.5) / (len(posting) + 0.5))
+            count = posting[id]
+            norm = index.k1 * (1 - index.b + index.b * index.lengths[id] / average_length)
+            score += idf * count * (index.k1 + 1) / (count + norm)
+        if score:
+            scores[id] = score
+    return scores
+
+
+def test_tokenize_keeps_codes_and_their_parts():
+    assert tokenize("Vertrag AB-1234/5 gilt") == ["vertrag", "ab-1234/5", "ab", "1234", "5", "gilt"]
+
+
+def test_search_ranks_rare_and_repeated_terms_first():
+    index = SparseIndex(k1=1.5, b=0.75, min_idf=0)
+    index.add(["a", "b", "c", "d"], [
+        "Urlaub beantragen im Portal",
+        "Urlaub und Urlaubstage für Teilzeit, Teilzeit und Elternzeit",
+        "Reisekosten abrechnen",
+        "Vertrag AB-1234/5 kündigen",
+    ])
+
+    assert [id for id, _ in index.search("Teilzeit Urlaub")] == ["b", "a"]
+    assert [id for id, _ in index.search("1234")] == ["d"]
+    assert index.search("Gehalt") == []
+    assert index.search("Urlaub", k=0) == []
+
+
+def test_removed_chunks_are_not_found():
+    index = SparseIndex(min_idf=0)
+    index.add(["a", "b"], ["Urlaub beantragen", "Urlaub verschieben"])
+    index.remove(["a"])
+    index.add(["b"], ["Reisekosten abrechnen"])  # re-adding replaces the old text
+
+    assert index.search("Urlaub") == []
+    assert [id for id, _ in index.search("Reisekosten")] == ["b"]
+    assert index.total_length == 2
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_pruned_search_returns_the_exact_top_k(seed):
+    rng = random.Random(seed)
+    # Zipf-like vocabulary: a few words are in most chunks, most words are rare
+    vocabulary = [f"w{i}" for i in range(300)]
+    weights = [1 / (rank + 1) for rank in range(len(vocabulary))]
+    index = SparseIndex(min_idf=0)
+    for id in range(500):
+        index.add([str(id)], [" ".join(rng.choices(vocabulary, weights, k=rng.randint(5, 60)))])
+
+    for _ in range(20):
+        query = " ".join(rng.choices(vocabulary[:5], k=2) + rng.choices(vocabulary[5:], k=2))
+        expected = sorted(brute_force_bm25(index, query).items(), key=lambda item: item[1], reverse=True)[:10]
+        found = dict(index.search(query, k=10))
+        assert sorted(found.values(), reverse=True) == pytest.approx([score for _, score in expected])
+        # ties at the 10th score may be broken either way
+        assert all(id in found for id, score in expected if score > expected[-1][1] + 1e-9)
+
+
+def test_terms_in_almost_every_chunk_are_ignored():
+    index = SparseIndex(min_idf=0.2)
+    index.add([str(i) for i in range(10)], ["die Regel"] * 9 + ["die Ausnahme"])
+
+    results = index.search("die Ausnahme")
+    assert [id for id, _ in results] == ["9"]
+    assert results[0][1] == pytest.approx(brute_force_bm25(index, "Ausnahme")["9"])
+    # a query of common words only still finds the chunks of its rarest word
+    assert len(index.search("die", k=20)) == 10
+
+
+def test_save_and_load(tmp_path):
+    index = SparseIndex(min_idf=0)
+    index.add(["a", "b"], ["Urlaub beantragen", "Reisekosten abrechnen"])
+    index.save(str(tmp_path / "sparse.pkl"))
+
+    loaded = SparseIndex.load(str(tmp_path / "sparse.pkl"))
+    loaded.min_idf = 0
+    assert loaded.search("Urlaub") == index.search("Urlaub")
+    assert Counter(loaded.lengths) == Counter(index.lengths)
+
+
+def test_reciprocal_rank_fusion_rewards_agreement():
+    dense = ["a", "b", "c"]
+    sparse = ["c", "d", "a"]
+
+    fused = reciprocal_rank_fusion([dense, sparse], [1.0, 1.0], k=60)
+
+    # a: 1/61 + 1/63, c: 1/63 + 1/61 (tie, dense first), b: 1/62, d: 1/62
+    assert fused[:2] == ["a", "c"]
+    assert set(fused[2:]) == {"b", "d"}
+
+
+def test_reciprocal_rank_fusion_weights_and_constant():
+    dense = ["a", "b"]
+    sparse = ["b", "a"]
+
+    assert reciprocal_rank_fusion([dense, sparse], [2.0, 1.0], k=60) == ["a", "b"]
+    assert reciprocal_rank_fusion([dense, sparse], [1.0, 2.0], k=60) == ["b", "a"]
+    # a smaller k makes the top ranks count more: "x" at rank 1 in one list beats "y" at rank 4 in both
+    rankings = [["x", "p", "s", "y"], ["q", "r", "t", "y"]]
+    assert reciprocal_rank_fusion(rankings, [1.0, 1.0], k=1)[0] == "x"
+    assert reciprocal_rank_fusion(rankings, [1.0, 1.0], k=60)[0] == "y"
+    assert reciprocal_rank_fusion([], [], k=60) == []